@@ -0,0 +1,80 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures peak memory taken by attaching several big files to an account and saving
+the database, comparing files read into memory at once to files streamed from disk.
+
+Run from the project root:
+    python -m benchmarks.benchmark_attach
+"""
+
+import os
+import tempfile
+import tracemalloc
+from pathlib import Path
+from unittest.mock import patch
+
+from core.database_utils import Account, Attachment, Database
+
+FILES_COUNT = 3
+FILE_SIZE = 100 * 1024 ** 2
+
+
+def read_whole(paths: dict[str, Path]) -> dict[str, Attachment]:
+    """
+    Attaches files the way it was done before streaming.
+    """
+    return {name: Attachment(path.read_bytes()) for name, path in paths.items()}
+
+
+def read_streamed(paths: dict[str, Path]) -> dict[str, Attachment]:
+    attached_files, errors = Attachment.from_files(paths)
+    assert not errors
+    return attached_files
+
+
+def measure(attach, paths: dict[str, Path]) -> float:
+    """
+    :return: peak memory in MiB taken while attaching the files and saving the database.
+    """
+
+    tracemalloc.start()
+    account = Account("bench", "", "", "", "", "", attached_files=attach(paths))
+    Database("bench", "123", {"bench": account}).create()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 ** 2
+
+
+def main():
+    with tempfile.TemporaryDirectory(dir=".") as src_dir, \
+            patch("core.SRC_DIR", Path(src_dir)):
+        paths = {}
+        for i in range(FILES_COUNT):
+            paths[f"file{i}"] = Path(src_dir) / f"file{i}.bin"
+            with open(paths[f"file{i}"], "wb") as file:
+                for _ in range(FILE_SIZE // 2 ** 20):
+                    file.write(os.urandom(2 ** 20))
+
+        print(f"{FILES_COUNT} files of {FILE_SIZE // 1024 ** 2} MiB")
+        print(f"{'attached files':<20}{'peak, MiB':>12}")
+        print(f"{'read at once':<20}{measure(read_whole, paths):>12.0f}")
+        print(f"{'streamed':<20}{measure(read_streamed, paths):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares account codecs on a database of 10k accounts.
+
+Run from the project root:
+    python -m benchmarks.benchmark_codecs
+"""
+
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from core.database_utils import Account, Attachment, Database
+from core.serialization import CODECS
+
+ACCOUNTS_COUNT = 10_000
+
+
+def make_accounts(count: int) -> dict[str, Account]:
+    accounts = {}
+    for i in range(count):
+        account = Account(
+            accountname=f"account {i}",
+            username=f"user{i}",
+            email=f"user{i}@example.com",
+            password=os.urandom(12).hex(),
+            birthdate="01.01.2000",
+            notes=f"Notes of account {i}.\n" * 5,
+            copy_email=bool(i % 2),
+            attached_files={"key.txt": Attachment(os.urandom(1024))},
+        )
+        accounts[account.accountname] = account
+    return accounts
+
+
+def measure(func, repeat=3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    accounts = make_accounts(ACCOUNTS_COUNT)
+    streams = {"key.txt": 1}
+    print(f"{ACCOUNTS_COUNT} accounts")
+    print(f"{'codec':<8}{'encode, ms':>12}{'decode, ms':>12}{'size, KiB':>12}{'open, ms':>12}")
+
+    for name, codec in CODECS.items():
+        records = [codec.encode(account, streams) for account in accounts.values()]
+        encode = measure(lambda: [codec.encode(a, streams) for a in accounts.values()])
+        decode = measure(lambda: [codec.decode(record) for record in records])
+        size = sum(map(len, records)) / 1024
+
+        with tempfile.TemporaryDirectory() as src_dir, \
+                patch("core.SRC_DIR", Path(src_dir)), \
+                patch("core.database_utils.DEFAULT_CODEC", name):
+            db = Database("bench", "123", accounts)
+            db.create()
+            open_time = measure(lambda: Database("bench", _key_cache=db._key_cache).open("123"))
+
+        print(f"{name:<8}{encode * 1000:>12.1f}{decode * 1000:>12.1f}{size:>12.1f}{open_time * 1000:>12.1f}")
+
+    legacy = Database("bench", "123", accounts)
+    print(f"legacy json with base64 attachments: {len(legacy.dumps()) / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
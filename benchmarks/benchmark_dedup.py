@@ -0,0 +1,72 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Reports space saved by storing attachments with the same content once.
+
+Without arguments a database where every account has the same attachments (e.g. a
+shared recovery key) is created and its size is reported. With a name of a database
+from SRC_DIR, the space saved in that database is reported instead.
+
+Run from the project root:
+    python -m benchmarks.benchmark_dedup [database name]
+"""
+
+import getpass
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.benchmark_codecs import make_accounts
+from core.database_utils import Attachment, Database, Deduplication
+
+ACCOUNTS = 1000
+SHARED_SIZE = 64 * 1024
+
+
+def print_report(report: Deduplication):
+    print(f"attachments:       {report.attachments}")
+    print(f"unique:            {report.unique}")
+    print(f"attachments, KiB:  {report.size / 1024:.0f}")
+    print(f"stored, KiB:       {report.unique_size / 1024:.0f}")
+    print(f"saved, KiB:        {report.saved / 1024:.0f}")
+
+
+def main():
+    if len(sys.argv) > 1:
+        db = Database(sys.argv[1])
+        db.open(getpass.getpass())
+        print_report(db.deduplication())
+        return
+
+    accounts = make_accounts(ACCOUNTS)
+    shared = Attachment(os.urandom(SHARED_SIZE))
+    for account in accounts.values():
+        # a separate object with the same content, as if attached from the same file
+        account.attached_files["shared.bin"] = Attachment(shared.read())
+
+    with tempfile.TemporaryDirectory(dir=".") as src_dir, \
+            patch("core.SRC_DIR", Path(src_dir)):
+        db = Database("bench", "123", accounts)
+        db.create()
+        print_report(db.deduplication())
+        print(f"file, KiB:         {db.dba_file.stat().st_size / 1024:.0f}")
+
+
+if __name__ == "__main__":
+    main()
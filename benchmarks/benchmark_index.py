@@ -0,0 +1,56 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares time needed to read names of the accounts from the index with time needed
+to open the whole database, i.e. how soon the database window can display the accounts.
+
+The key derivation function is excluded, since it's run once for both.
+
+Run from the project root:
+    python -m benchmarks.benchmark_index
+"""
+
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.benchmark_codecs import make_accounts, measure
+from core.database_utils import Database
+
+SIZES = (1000, 10_000, 50_000)
+
+
+def main():
+    print(f"{'accounts':<10}{'size, KiB':>12}{'index, ms':>12}{'open, ms':>12}")
+
+    for count in SIZES:
+        accounts = make_accounts(count)
+        with tempfile.TemporaryDirectory(dir=".") as src_dir, \
+                patch("core.SRC_DIR", Path(src_dir)):
+            Database("bench", "123", accounts).create()
+            db = Database("bench")
+            size = db.dba_file.stat().st_size / 1024
+            db.read_index("123")
+
+            index = measure(lambda: db.read_index("123"))
+            opened = measure(lambda: Database("bench", _key_cache=db._key_cache).open("123"))
+
+        print(f"{count:<10}{size:>12.0f}{index * 1000:>12.1f}{opened * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
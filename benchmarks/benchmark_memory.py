@@ -0,0 +1,113 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures memory taken by 100k accounts loaded from a database, comparing slotted
+accounts with interned fields to accounts with `__dict__` and no interning.
+
+Run from the project root:
+    python -m benchmarks.benchmark_memory
+"""
+
+import gc
+import json
+import tracemalloc
+from dataclasses import dataclass, field
+
+from core.database_utils import Account, Database
+
+ACCOUNTS_COUNT = 100_000
+
+
+@dataclass
+class DictAccount:
+    """
+    Account as it was before it got slots.
+    """
+
+    accountname: str
+    username: str
+    email: str
+    password: str
+    birthdate: str
+    notes: str
+    copy_email: bool = True
+    attached_files: dict = field(default_factory=dict)
+
+
+def make_json(count: int) -> str:
+    """
+    Creates legacy database json, most users have several accounts with the same
+    username and email.
+    """
+
+    accounts = {}
+    for i in range(count):
+        user = i % 1000
+        accounts[f"account {i}"] = {
+            "account": f"account {i}",
+            "name": f"user{user}",
+            "email": f"user{user}@example.com",
+            "password": f"password {i}",
+            "date": f"{i % 28 + 1:02}.01.2000",
+            "comment": "",
+            "copy_email": True,
+            "attach_files": {},
+        }
+    return json.dumps(accounts)
+
+
+def load_dict_accounts(string: str) -> dict:
+    return {
+        name: DictAccount(
+            **{Account.reversed_mapping.get(k, k): v for k, v in account.items()}
+        )
+        for name, account in json.loads(string).items()
+    }
+
+
+def load_slotted_accounts(string: str) -> dict:
+    db = Database("bench")
+    db.loads(string)
+    return db.accounts
+
+
+def measure(load, string: str) -> float:
+    """
+    :return: memory in bytes taken per account.
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    accounts = load(string)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert len(accounts) == ACCOUNTS_COUNT
+    return size / ACCOUNTS_COUNT
+
+
+def main():
+    string = make_json(ACCOUNTS_COUNT)
+    print(f"{ACCOUNTS_COUNT} accounts")
+    print(f"{'account':<32}{'bytes per account':>20}")
+    print(f"{'__dict__, not interned':<32}{measure(load_dict_accounts, string):>20.0f}")
+    print(f"{'slots, interned':<32}{measure(load_slotted_accounts, string):>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures time of merging two diverged copies of a database.
+
+Both copies and their common ancestor are written to .dba files and read back, every
+copy changes CHANGED_RATIO of the accounts, some of them in both copies.
+
+Run from the project root:
+    python -m benchmarks.benchmark_merge
+"""
+
+import dataclasses
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.benchmark_codecs import make_accounts
+from core.database_utils import Database
+from core.merge import merge
+
+ACCOUNTS = 50_000
+CHANGED_RATIO = 0.05
+
+
+def diverge(db: Database, step: int, field: str):
+    """
+    Changes every `step` account of the database.
+    """
+
+    for name in list(db.accounts)[::step]:
+        db.accounts[name] = dataclasses.replace(db.accounts[name], **{field: "changed"})
+    db.save_changes()
+
+
+def main():
+    step = int(1 / CHANGED_RATIO)
+    with tempfile.TemporaryDirectory(dir=".") as src_dir, \
+            patch("core.SRC_DIR", Path(src_dir)):
+        Database("base", "123", make_accounts(ACCOUNTS)).create()
+        for name in ("ours", "theirs"):
+            shutil.copy(Path(src_dir) / "base.dba", Path(src_dir) / f"{name}.dba")
+
+        ours, theirs, base = Database("ours"), Database("theirs"), Database("base")
+        ours.open("123")
+        theirs.open("123")
+        # the copies change different fields of some of the same accounts
+        diverge(ours, step, "notes")
+        diverge(theirs, step - 1, "email")
+
+        start = time.perf_counter()
+        for db in (base, ours, theirs):
+            db.open("123")
+        opened = time.perf_counter()
+        result = merge(base.accounts, ours.accounts, theirs.accounts, ours._data_key)
+        merged = time.perf_counter()
+
+    print(f"accounts:          {ACCOUNTS}")
+    print(f"changed:           {len(result.changed)}")
+    print(f"conflicts:         {len(result.conflicts)}")
+    print(f"open, s:           {opened - start:.2f}")
+    print(f"merge, s:          {merged - opened:.2f}")
+
+
+if __name__ == "__main__":
+    main()
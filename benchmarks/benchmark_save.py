@@ -0,0 +1,58 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures latency added to saving databases by writing them atomically (fsync of
+the temporary file and of the directory) and by keeping a backup.
+
+Run from the project root:
+    python -m benchmarks.benchmark_save
+"""
+
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.benchmark_codecs import make_accounts, measure
+from core.database_utils import Database
+
+SIZES = (100, 1000, 10_000)
+
+
+def main():
+    print(f"{'accounts':<10}{'size, KiB':>12}{'no fsync, ms':>14}{'atomic, ms':>12}{'+backup, ms':>13}")
+
+    for count in SIZES:
+        accounts = make_accounts(count)
+        with tempfile.TemporaryDirectory(dir=".") as src_dir, \
+                patch("core.SRC_DIR", Path(src_dir)):
+            db = Database("bench", "123", accounts)
+            db.create()
+            size = db.dba_file.stat().st_size / 1024
+
+            with patch("os.fsync"):
+                no_fsync = measure(db.create)
+            atomic = measure(db.create)
+            backup = measure(lambda: db.create(backups=1))
+
+        print(
+            f"{count:<10}{size:>12.0f}{no_fsync * 1000:>14.1f}"
+            f"{atomic * 1000:>12.1f}{backup * 1000:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measures how much is transferred when a database is pushed to a sync target after
+changing one account, compared with pushing it for the first time.
+
+Run from the project root:
+    python -m benchmarks.benchmark_sync
+"""
+
+import dataclasses
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.benchmark_codecs import make_accounts
+from core.database_utils import Database
+from core.sync import DirectoryTarget, SyncResult, push
+
+ACCOUNTS = 20_000
+
+
+def timed_push(target: DirectoryTarget) -> tuple[SyncResult, float]:
+    start = time.perf_counter()
+    result = push("bench", target)
+    return result, time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory(dir=".") as src_dir, \
+            patch("core.SRC_DIR", Path(src_dir)):
+        target = DirectoryTarget(Path(src_dir) / "target")
+        db = Database("bench", "123", make_accounts(ACCOUNTS))
+        db.create()
+        first, first_time = timed_push(target)
+
+        name = next(iter(db.accounts))
+        db.accounts[name] = dataclasses.replace(db.accounts[name], notes="changed")
+        db.save_changes()
+        edit, edit_time = timed_push(target)
+
+    print(f"file, KiB:           {first.size / 1024:.0f}")
+    print(f"first push, KiB:     {first.transferred / 1024:.0f} in {first_time:.2f} s")
+    print(f"after edit, KiB:     {edit.transferred / 1024:.1f} in {edit_time:.2f} s")
+    print(f"transferred, %:      {100 * edit.transferred / edit.size:.3f}")
+
+
+if __name__ == "__main__":
+    main()
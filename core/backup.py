@@ -0,0 +1,475 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Deduplicating encrypted backups of SRC_DIR.
+
+Run from the project root:
+    python -m core.backup init <repository> [--auto [--keep <snapshots to keep>]]
+    python -m core.backup backup|list <repository>
+    python -m core.backup restore <repository> <snapshot> <directory> [file ...]
+    python -m core.backup prune <repository> <snapshots to keep>
+
+A repository is a directory (e.g. on an external drive) holding snapshots of SRC_DIR.
+Files are split into chunks at boundaries defined by their content (see core.sync.split)
+and every chunk is stored once, so a snapshot adds only the chunks that changed since the
+previous ones. Files that didn't change (same size and modification time) aren't even
+read again, the snapshot reuses their chunks.
+Backing up, restoring and pruning hold the lock of the repository, so that databases
+saved at the same time are backed up one after another.
+
+Chunks and snapshots are encrypted with a random key of the repository, which is stored
+in its `config` file wrapped with a key derived from the password of the repository.
+Chunks are named by a keyed hash of their content, so the names don't reveal it.
+
+With `--auto` the key is also kept in SRC_DIR/KEY_FILE, then the databases are backed up
+every time they're saved (see `auto_backup`). It gives access to the backups only to
+those who can read SRC_DIR anyway, and KEY_FILE itself is never backed up. Automatic
+backups keep only the newest snapshots (AUTO_KEEP by default, see `--keep`).
+"""
+
+import argparse
+import base64
+import getpass
+import hashlib
+import hmac
+import json
+import logging
+import mmap
+import os
+import secrets
+import sys
+import time
+import traceback
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import core
+from core import container
+from core.container import CorruptedContainer
+from core.file_utils import atomic_write, locked
+from core.kdf import SALT_SIZE, KdfParams, calibrate
+from core.manifest import MANIFEST_FILE
+from core.sync import split
+
+CONFIG_FILE = "config"
+CHUNKS_DIR = "chunks"
+SNAPSHOTS_DIR = "snapshots"
+# held while snapshots are added or removed, see `Repository.lock`
+LOCK_FILE = "lock"
+# keeps the repository and its key for automatic backups, in SRC_DIR
+KEY_FILE = "backup.key"
+# how many snapshots automatic backups keep by default
+AUTO_KEEP = 100
+REPOSITORY_VERSION = 1
+
+
+class BackupError(Exception):
+    """
+    Raised when the repository or a snapshot can't be used.
+    """
+
+
+@dataclass
+class FileEntry:
+    """
+    A file of a snapshot.
+    """
+
+    size: int
+    mtime_ns: int
+    # names of the chunks of the file in order
+    chunks: list[str]
+
+
+@dataclass
+class Snapshot:
+    """
+    State of SRC_DIR at the moment of a backup.
+    """
+
+    name: str
+    time: float
+    # files mapped by their paths relative to the backed up directory
+    files: dict[str, FileEntry] = field(default_factory=dict)
+    # number of the chunks and bytes added to the repository by the snapshot
+    added_chunks: int = 0
+    added_size: int = 0
+
+    @property
+    def size(self) -> int:
+        return sum(entry.size for entry in self.files.values())
+
+    def dumps(self) -> bytes:
+        return json.dumps(asdict(self)).encode()
+
+    @staticmethod
+    def loads(data: bytes) -> "Snapshot":
+        snapshot = Snapshot(**json.loads(data))
+        snapshot.files = {
+            name: FileEntry(**entry) for name, entry in snapshot.files.items()
+        }
+        return snapshot
+
+
+class Repository:
+    """
+    Stores encrypted chunks of files and snapshots listing them.
+    """
+
+    def __init__(self, path: str | os.PathLike, key: bytes):
+        """
+        :param key: the random key of the repository.
+        """
+
+        self.path = Path(path)
+        self.key = key
+        self.cipher = AESGCM(container.derive_subkey(key, b"backup data"))
+        self.id_key = container.derive_subkey(key, b"backup ids")
+
+    @staticmethod
+    def init(
+            path: str | os.PathLike,
+            password: str,
+            kdf: KdfParams | None = None,
+    ) -> "Repository":
+        """
+        Creates new repository in given directory.
+        :raises BackupError: if there already is a repository.
+        """
+
+        path = Path(path)
+        if (path / CONFIG_FILE).exists():
+            raise BackupError(f"There already is a repository in {path}.")
+        kdf = kdf or KdfParams(os.urandom(SALT_SIZE))
+        key = os.urandom(container.DATA_KEY_SIZE)
+        config = {
+            "version": REPOSITORY_VERSION,
+            "kdf": kdf.to_dict(),
+            "wrapped_key": base64.b64encode(
+                container.wrap_key(kdf.derive(password), key),
+            ).decode("ascii"),
+        }
+        (path / CHUNKS_DIR).mkdir(parents=True, exist_ok=True)
+        (path / SNAPSHOTS_DIR).mkdir(exist_ok=True)
+        with atomic_write(path / CONFIG_FILE) as file:
+            file.write(json.dumps(config).encode())
+        return Repository(path, key)
+
+    @staticmethod
+    def open(path: str | os.PathLike, password: str) -> "Repository":
+        """
+        :raises BackupError: if there is no repository in the directory.
+        :raises CorruptedContainer: if the password is wrong.
+        """
+
+        path = Path(path)
+        try:
+            config = json.loads((path / CONFIG_FILE).read_bytes())
+            kdf = KdfParams.from_dict(config["kdf"])
+            wrapped_key = base64.b64decode(config["wrapped_key"])
+        except FileNotFoundError as err:
+            raise BackupError(f"There is no repository in {path}.") from err
+        except (ValueError, KeyError, TypeError) as err:
+            raise BackupError(f"The repository config in {path} is damaged.") from err
+        if config.get("version") != REPOSITORY_VERSION:
+            raise BackupError(f"Unsupported repository version: {config.get('version')}.")
+        return Repository(path, container.unwrap_key(kdf.derive(password), wrapped_key))
+
+    def encrypt(self, name: str, data: bytes) -> bytes:
+        # the name is authenticated too, so that objects can't be swapped
+        nonce = os.urandom(container.NONCE_SIZE)
+        return nonce + self.cipher.encrypt(nonce, data, name.encode())
+
+    def decrypt(self, name: str, data: bytes) -> bytes:
+        try:
+            nonce = data[:container.NONCE_SIZE]
+            return self.cipher.decrypt(nonce, data[container.NONCE_SIZE:], name.encode())
+        except (InvalidTag, ValueError) as err:
+            raise BackupError(f"{name} is damaged.") from err
+
+    def chunk_id(self, chunk: bytes) -> str:
+        return hmac.new(self.id_key, chunk, hashlib.sha256).hexdigest()
+
+    def chunk_path(self, chunk_id: str) -> Path:
+        return self.path / CHUNKS_DIR / chunk_id[:2] / chunk_id
+
+    def write(self, path: Path, name: str, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(path) as file:
+            file.write(self.encrypt(name, data))
+
+    def read_chunk(self, chunk_id: str) -> bytes:
+        try:
+            data = self.chunk_path(chunk_id).read_bytes()
+        except FileNotFoundError as err:
+            raise BackupError(f"Chunk {chunk_id} is missing.") from err
+        chunk = self.decrypt(chunk_id, data)
+        if not hmac.compare_digest(self.chunk_id(chunk), chunk_id):
+            raise BackupError(f"Chunk {chunk_id} is damaged.")
+        return chunk
+
+    def lock(self):
+        """
+        Context manager holding the lock of the repository, so that e.g. pruning doesn't
+        remove chunks a backup running at the same time relies on.
+        """
+        return locked(self.path / LOCK_FILE)
+
+    def snapshot_names(self) -> list[str]:
+        """
+        :return: names of the snapshots from the oldest to the newest, without reading them.
+        """
+
+        return sorted(
+            path.name
+            for path in (self.path / SNAPSHOTS_DIR).iterdir()
+            if not path.name.endswith(".tmp")
+        )
+
+    def snapshots(self) -> list[Snapshot]:
+        """
+        :return: snapshots from the oldest to the newest.
+        """
+        return [self.snapshot(name) for name in self.snapshot_names()]
+
+    def snapshot(self, name: str) -> Snapshot:
+        try:
+            data = (self.path / SNAPSHOTS_DIR / name).read_bytes()
+        except FileNotFoundError as err:
+            raise BackupError(f"There is no snapshot {name}.") from err
+        return Snapshot.loads(self.decrypt(name, data))
+
+    def backup(self, directory: Path | None = None) -> Snapshot:
+        """
+        Stores a snapshot of the files of the directory (SRC_DIR by default), storing
+        only the chunks the repository doesn't have yet.
+        """
+
+        directory = directory or core.SRC_DIR
+        with self.lock():
+            return self._backup(directory)
+
+    def _backup(self, directory: Path) -> Snapshot:
+        names = self.snapshot_names()
+        # only the newest snapshot is read, however many there are
+        previous = self.snapshot(names[-1]).files if names else {}
+        # snapshots taken within the same second still get distinct, ordered names, the
+        # random part keeps them unique even if the repository is used without the lock
+        number = int(names[-1].split("-")[5]) + 1 if names else 0
+        name = time.strftime("%Y-%m-%dT%H-%M-%S", time.gmtime())
+        name = f"{name}-{number:06d}-{secrets.token_hex(4)}"
+        snapshot = Snapshot(name, time.time())
+
+        for path in sorted(directory.rglob("*")):
+            relative = path.relative_to(directory).as_posix()
+            if not path.is_file() or relative in (KEY_FILE, MANIFEST_FILE) \
+                    or path.name.endswith(".tmp") or path.is_relative_to(self.path):
+                continue
+            stat = path.stat()
+            entry = previous.get(relative)
+            if entry and (entry.size, entry.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                snapshot.files[relative] = entry
+                continue
+            snapshot.files[relative] = self.backup_file(path, snapshot)
+
+        self.write(self.path / SNAPSHOTS_DIR / name, name, snapshot.dumps())
+        return snapshot
+
+    def backup_file(self, path: Path, snapshot: Snapshot) -> FileEntry:
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            entry = FileEntry(stat.st_size, stat.st_mtime_ns, [])
+            if not stat.st_size:
+                return entry
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                for start, size in split(content):
+                    chunk = content[start:start + size]
+                    chunk_id = self.chunk_id(chunk)
+                    chunk_path = self.chunk_path(chunk_id)
+                    if not chunk_path.exists():
+                        self.write(chunk_path, chunk_id, chunk)
+                        snapshot.added_chunks += 1
+                        snapshot.added_size += size
+                    entry.chunks.append(chunk_id)
+        return entry
+
+    def restore(self, name: str, directory: Path, files: list[str] | None = None):
+        """
+        Restores files of given snapshot to the directory, every file is replaced
+        atomically and checked before it replaces an existing one.
+        :param files: paths of the files to restore relative to the directory, all
+        files of the snapshot by default.
+        :raises BackupError: if the snapshot doesn't have a file or it is damaged.
+        """
+
+        with self.lock():
+            self._restore(name, directory, files)
+
+    def _restore(self, name: str, directory: Path, files: list[str] | None):
+        snapshot = self.snapshot(name)
+        for relative in files or list(snapshot.files):
+            entry = snapshot.files.get(relative)
+            if entry is None:
+                raise BackupError(f"There is no {relative} in snapshot {name}.")
+            path = directory / relative
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_write(path) as file:
+                for chunk_id in entry.chunks:
+                    file.write(self.read_chunk(chunk_id))
+            os.utime(path, ns=(entry.mtime_ns, entry.mtime_ns))
+
+    def prune(self, keep: int) -> tuple[list[str], int]:
+        """
+        Removes all snapshots except the `keep` newest ones and the chunks that only
+        removed snapshots refer to.
+        :return: names of the removed snapshots and number of the removed chunks.
+        :raises BackupError: if `keep` is less than 1.
+        """
+
+        if keep < 1:
+            raise BackupError("At least one snapshot must be kept.")
+        with self.lock():
+            return self._prune(keep)
+
+    def _prune(self, keep: int) -> tuple[list[str], int]:
+        names = self.snapshot_names()
+        removed, kept = names[:-keep], names[-keep:]
+        used = {
+            chunk_id
+            for name in kept
+            for entry in self.snapshot(name).files.values()
+            for chunk_id in entry.chunks
+        }
+        for name in removed:
+            (self.path / SNAPSHOTS_DIR / name).unlink()
+
+        removed_chunks = 0
+        for path in (self.path / CHUNKS_DIR).glob("*/*"):
+            if path.name not in used:
+                path.unlink()
+                removed_chunks += 1
+        return removed, removed_chunks
+
+    def save_key(self, keep: int = AUTO_KEEP):
+        """
+        Keeps the key in SRC_DIR, so that the databases are backed up every time they're
+        saved, see `auto_backup`.
+        :param keep: how many snapshots automatic backups keep.
+        :raises BackupError: if `keep` is less than 1.
+        """
+
+        if keep < 1:
+            raise BackupError("At least one snapshot must be kept.")
+        data = {
+            "repository": str(self.path),
+            "key": base64.b64encode(self.key).decode("ascii"),
+            "keep": keep,
+        }
+        with atomic_write(core.SRC_DIR / KEY_FILE) as file:
+            file.write(json.dumps(data).encode())
+        os.chmod(core.SRC_DIR / KEY_FILE, 0o600)
+
+
+def auto_backup() -> Snapshot | None:
+    """
+    Backs up SRC_DIR to the repository kept in KEY_FILE, errors are only logged, since
+    they shouldn't prevent saving databases.
+
+    Once there are twice as many snapshots as automatic backups keep, the oldest ones are
+    pruned; pruning reads all the snapshots, so it's done only once per `keep` backups.
+    :return: the new snapshot, None if automatic backups aren't enabled or failed.
+    """
+
+    try:
+        data = json.loads((core.SRC_DIR / KEY_FILE).read_bytes())
+    except FileNotFoundError:
+        return None
+
+    try:
+        repository = Repository(data["repository"], base64.b64decode(data["key"]))
+        snapshot = repository.backup()
+        keep = data.get("keep", AUTO_KEEP)
+        if len(repository.snapshot_names()) >= 2 * keep:
+            repository.prune(keep)
+        return snapshot
+    except Exception:
+        logging.error(traceback.format_exc())
+        return None
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m core.backup")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name: str, description: str) -> argparse.ArgumentParser:
+        subparser = commands.add_parser(name, help=description)
+        subparser.add_argument("repository", type=Path)
+        return subparser
+
+    init = command("init", "create a repository")
+    init.add_argument("--auto", action="store_true", help="back up on every save")
+    init.add_argument(
+        "--keep", type=int, default=AUTO_KEEP, help="snapshots automatic backups keep",
+    )
+    command("backup", "take a snapshot of SRC_DIR")
+    command("list", "list snapshots")
+    restore = command("restore", "restore files of a snapshot")
+    restore.add_argument("snapshot")
+    restore.add_argument("directory", type=Path)
+    restore.add_argument("files", nargs="*")
+    prune = command("prune", "remove all snapshots except the newest ones")
+    prune.add_argument("keep", type=int)
+    args = parser.parse_args(argv[1:])
+
+    password = getpass.getpass("Password of the repository: ")
+    try:
+        run(args, password)
+    except (BackupError, CorruptedContainer) as err:
+        print(err)
+        return 1
+    return 0
+
+
+def run(args: argparse.Namespace, password: str):
+    if args.command == "init":
+        if args.keep < 1:
+            raise BackupError("At least one snapshot must be kept.")
+        repository = Repository.init(args.repository, password, calibrate())
+        if args.auto:
+            repository.save_key(args.keep)
+        return
+
+    repository = Repository.open(args.repository, password)
+    if args.command == "backup":
+        snapshot = repository.backup()
+        print(f"{snapshot.name}: {len(snapshot.files)} files, "
+              f"added {snapshot.added_size / 1024:.0f} KiB of {snapshot.size / 1024:.0f} KiB")
+    elif args.command == "list":
+        for snapshot in repository.snapshots():
+            print(f"{snapshot.name}: {len(snapshot.files)} files, {snapshot.size / 1024:.0f} KiB")
+    elif args.command == "restore":
+        repository.restore(args.snapshot, args.directory, args.files)
+    else:
+        removed, chunks = repository.prune(args.keep)
+        print(f"Removed {len(removed)} snapshots and {chunks} chunks.")
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
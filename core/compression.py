@@ -0,0 +1,99 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compression applied to streams of version 2 .dba files before they are encrypted.
+"""
+
+from __future__ import annotations
+
+import lzma
+import zlib
+from dataclasses import dataclass
+from typing import Protocol
+
+COMPRESSION_ALGORITHMS = ("none", "zlib", "lzma")
+DEFAULT_ALGORITHM = "zlib"
+DEFAULT_LEVEL = 6
+
+
+class Compressor(Protocol):
+    def compress(self, data: bytes) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+
+class Decompressor(Protocol):
+    eof: bool
+
+    def decompress(self, data: bytes) -> bytes: ...
+
+
+class NoCompressor:
+    """
+    Compressor and decompressor that leaves the data as it is.
+    """
+
+    eof = True
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+@dataclass(frozen=True)
+class Compression:
+    """
+    Compression algorithm and level used when saving databases.
+
+    Level ranges from 0 to 9 for every algorithm, the higher it is the smaller the file,
+    but the longer it takes to save it.
+    """
+
+    algorithm: str = DEFAULT_ALGORITHM
+    level: int = DEFAULT_LEVEL
+
+    def __post_init__(self):
+        if self.algorithm not in COMPRESSION_ALGORITHMS:
+            raise ValueError(f"Unsupported compression algorithm: {self.algorithm}")
+        if not 0 <= self.level <= 9:
+            raise ValueError(f"Compression level must be from 0 to 9, got {self.level}")
+
+    def compressor(self) -> Compressor:
+        if self.algorithm == "zlib":
+            return zlib.compressobj(self.level)
+        if self.algorithm == "lzma":
+            return lzma.LZMACompressor(preset=self.level)
+        return NoCompressor()
+
+
+def decompressor(algorithm: str) -> Decompressor:
+    """
+    Returns decompressor for data compressed with given algorithm.
+    """
+
+    if algorithm == "zlib":
+        return zlib.decompressobj()
+    if algorithm == "lzma":
+        return lzma.LZMADecompressor()
+    if algorithm == "none":
+        return NoCompressor()
+    raise ValueError(f"Unsupported compression algorithm: {algorithm}")
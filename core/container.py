@@ -0,0 +1,974 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Reads and writes the .dba container format.
+
+Legacy (v1) .dba file is a 16 byte salt followed by a single Fernet token.
+
+Version 2 file looks like this:
+* MAGIC, format version (u16) and header length (u32);
+* header, a json object with key derivation parameters (see core.kdf), the data key wrapped with
+  the key derived from password, the features the file uses (see FEATURES) and other
+  options needed to read the file; the header is padded with spaces to HEADER_ALIGNMENT;
+* files with SLOTS_FEATURE have two copies of the header (slots) of the same length instead,
+  see `replace_header`;
+* encrypted segments, each of them is a record header (stream id, segment number, flags
+  and length) followed by a nonce and AES-GCM ciphertext of at most `segment_size` bytes
+  of plaintext.
+
+Segments belong to streams, a stream is a sequence of bytes (e.g. serialized accounts)
+split into segments. Each segment is authenticated separately together with its record
+header, so the segments can be decrypted one by one or in parallel, and segments can't
+be reordered, moved to another stream or dropped from the end of a stream unnoticed.
+Files with FILE_ID_FEATURE also authenticate a random id of the file stored in the header,
+which is new every time the file is written from scratch, so that segments of an older
+copy of the file (e.g. a backup) can't be put in place of the current ones unnoticed.
+
+Streams can be compressed before encryption, the compression algorithm is recorded in
+the header, see core.compression.
+
+Accounts are split into shards by a hash of their names (see `shard_of`), each shard is
+a separate stream and the header lists the streams of the shards. Files without the list
+store all accounts in ACCOUNTS_STREAM.
+
+Changes made to the database after it was written can be appended to the end of the file
+as a journal: streams with ids starting from JOURNAL_ATTACHMENTS contain attached files
+and streams starting from TRANSACTIONS contain changed and deleted accounts. Once in a
+while new versions of the changed shards are appended to the file (streams starting from
+SHARD_STREAMS) together with a transaction listing streams of all shards, the journal
+before it doesn't need to be replayed anymore. See core.database_utils.Database.save_changes.
+
+The index stream is written right after the header and contains names of the accounts,
+so that they can be displayed before the shards are decrypted. When the journal is folded
+a new version of the index is appended (streams starting from INDEX_STREAMS) and listed
+in the same transaction as the shards.
+
+Attached files are content addressed: attachments with the same content are stored once,
+in one stream. The digests stream maps streams of attachments to digests of their content
+(a keyed hash, see `attachment_digest`), so that a new attachment can be matched with
+the stored ones without decrypting them. Transactions add digests of the attachments
+they append, new versions of the digests stream (streams starting from DIGEST_STREAMS)
+are appended when the journal is folded, the same as the index.
+"""
+
+from __future__ import annotations
+
+import base64
+import dataclasses
+import hashlib
+import hmac
+import json
+import lzma
+import mmap
+import os
+import shutil
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterable, Iterator
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from core.compression import DEFAULT_LEVEL, Compression, Compressor, decompressor
+from core.file_utils import atomic_write
+from core.kdf import KdfParams
+
+MAGIC = b"PYACCDBA"
+FORMAT_VERSION = 2
+PREAMBLE = struct.Struct("<8sHI")
+
+# legacy file is a salt followed by base64 encoded Fernet token, which starts with
+# the version byte (0x80) and a timestamp that has its upper bits unset
+LEGACY_SALT_SIZE = 16
+LEGACY_TOKEN_PREFIX = b"gAAAAA"
+# size of the salt and the shortest Fernet token (of empty data)
+LEGACY_MIN_SIZE = LEGACY_SALT_SIZE + 100
+
+# features of version 2 files that were added after the format itself, a file lists the
+# ones a reader must support to read it correctly, files written before the features were
+# listed don't have the list
+JOURNAL_FEATURE = "journal"
+SHARDS_FEATURE = "shards"
+INDEX_FEATURE = "index"
+DIGESTS_FEATURE = "digests"
+SLOTS_FEATURE = "slots"
+FILE_ID_FEATURE = "file-id"
+FEATURES = (
+    JOURNAL_FEATURE,
+    SHARDS_FEATURE,
+    INDEX_FEATURE,
+    DIGESTS_FEATURE,
+    SLOTS_FEATURE,
+    FILE_ID_FEATURE,
+)
+
+SEGMENT_SIZE = 64 * 1024
+NONCE_SIZE = 12
+TAG_SIZE = 16
+SEGMENT_HEADER = struct.Struct("<IIBI")
+FINAL_SEGMENT = 0x01
+
+# stream containing serialized accounts, the rest of streams contain attached files
+ACCOUNTS_STREAM = 0
+INDEX_STREAMS = 1 << 28
+DIGEST_STREAMS = 3 << 27
+SHARD_STREAMS = 1 << 29
+# ids of streams appended by the journal
+JOURNAL_ATTACHMENTS = 1 << 30
+TRANSACTIONS = 1 << 31
+# kinds of records in transaction streams, followed by serialized account, account name,
+# stream ids of all shards, stream id of the index, stream id of the digests or a digest
+# record (see `encode_digest`) respectively
+UPSERT = b"\x01"
+DELETE = b"\x02"
+SHARDS = b"\x03"
+INDEX = b"\x04"
+DIGESTS = b"\x05"
+ATTACHMENT = b"\x06"
+
+# accounts are split into shards of about this many accounts
+ACCOUNTS_PER_SHARD = 1024
+MAX_SHARDS = 64
+
+RECORD_LENGTH = struct.Struct("<I")
+STREAM_ID = struct.Struct("<I")
+# stream id of an attachment and digest of its content
+DIGEST_RECORD = struct.Struct("<I32s")
+
+# preamble and header together take a multiple of this many bytes
+HEADER_ALIGNMENT = 512
+DATA_KEY_SIZE = 32
+FILE_ID_SIZE = 16
+# associated data of the wrapped data key, so that it can't be mistaken for a segment
+DATA_KEY_AAD = MAGIC + b" data key"
+
+
+class CorruptedContainer(InvalidToken):
+    """
+    Raised when the container can't be decrypted or its structure is broken.
+
+    It's a subclass of InvalidToken because for the user it means the same thing as for
+    legacy databases: either the password is wrong or the file is damaged.
+    """
+
+
+@dataclass
+class Header:
+    """
+    Header of version 2 .dba file.
+    """
+
+    kdf: KdfParams
+    cipher: str = "aes-256-gcm"
+    segment_size: int = SEGMENT_SIZE
+    # name of the codec accounts are serialized with, see core.serialization
+    codec: str = "json"
+    # compression algorithm applied to every stream, see core.compression
+    compression: str = "none"
+    # data key encrypted with the key derived from password, files that don't have it
+    # are encrypted with the derived key itself
+    wrapped_key: bytes | None = None
+    # ids of the streams containing shards of accounts
+    shards: list[int] | None = None
+    # id of the stream containing names of the accounts
+    index: int | None = None
+    # id of the stream containing digests of the attachments
+    digests: int | None = None
+    # random id of the file authenticated together with every segment, see FILE_ID_FEATURE
+    file_id: bytes | None = None
+    # features the file uses, see FEATURES
+    features: list[str] = field(default_factory=lambda: list(FEATURES))
+    version: int = FORMAT_VERSION
+    # the header with the greatest sequence number is the current one, see `replace_header`
+    sequence: int = field(default=0, compare=False)
+
+    @property
+    def shard_streams(self) -> list[int]:
+        return self.shards or [ACCOUNTS_STREAM]
+
+    @property
+    def segment_aad(self) -> bytes:
+        """
+        Prefix of associated data of the segments, the record header of a segment follows it.
+        """
+        return self.file_id or b""
+
+    def to_dict(self) -> dict:
+        _dict = {
+            "kdf": self.kdf.to_dict(),
+            "cipher": self.cipher,
+            "segment_size": self.segment_size,
+            "codec": self.codec,
+            "compression": self.compression,
+        }
+        if self.wrapped_key is not None:
+            _dict["wrapped_key"] = base64.b64encode(self.wrapped_key).decode("ascii")
+        if self.shards is not None:
+            _dict["shards"] = self.shards
+        if self.index is not None:
+            _dict["index"] = self.index
+        if self.digests is not None:
+            _dict["digests"] = self.digests
+        if self.file_id is not None:
+            _dict["file_id"] = base64.b64encode(self.file_id).decode("ascii")
+        if self.features:
+            _dict["features"] = self.features
+        return _dict
+
+    @staticmethod
+    def from_dict(_dict: dict, version: int = FORMAT_VERSION) -> "Header":
+        return Header(
+            kdf=KdfParams.from_dict(_dict["kdf"]),
+            cipher=_dict["cipher"],
+            segment_size=_dict["segment_size"],
+            codec=_dict.get("codec", "json"),
+            compression=_dict.get("compression", "none"),
+            wrapped_key=base64.b64decode(_dict["wrapped_key"]) if "wrapped_key" in _dict else None,
+            shards=_dict.get("shards"),
+            index=_dict.get("index"),
+            digests=_dict.get("digests"),
+            file_id=base64.b64decode(_dict["file_id"]) if "file_id" in _dict else None,
+            features=_dict.get("features", []),
+            version=version,
+            sequence=_dict.get("sequence", 0),
+        )
+
+    def slot(self, length: int) -> bytes:
+        """
+        Serializes the header padded to given length.
+
+        Headers of files with SLOTS_FEATURE also contain their sequence number and checksum,
+        so that a header that was only partly written is never used.
+        :raises ValueError: if the header doesn't fit into `length` bytes.
+        """
+
+        header = self._serialize()
+        if len(header) > length:
+            raise ValueError("The header doesn't fit into given length.")
+        return header.ljust(length, b" ")
+
+    def _serialize(self) -> bytes:
+        _dict = self.to_dict()
+        if SLOTS_FEATURE in self.features:
+            _dict["sequence"] = self.sequence
+            _dict["checksum"] = header_checksum(_dict)
+        return json.dumps(_dict).encode()
+
+    def dumps(self, length: int | None = None) -> bytes:
+        """
+        Serializes the header together with preamble.
+
+        :param length: length the header (each of the slots) should be padded to, by default
+        it's padded to HEADER_ALIGNMENT.
+        :raises ValueError: if the header doesn't fit into `length` bytes.
+        """
+
+        slots = 2 if SLOTS_FEATURE in self.features else 1
+        if length is None:
+            size = len(self._serialize())
+            length = size + -(PREAMBLE.size + size * slots) % HEADER_ALIGNMENT // slots
+        return PREAMBLE.pack(MAGIC, self.version, length) + self.slot(length) * slots
+
+    def data_key(self, key: bytes) -> bytes:
+        """
+        Returns key the segments are encrypted with.
+        :param key: key derived from password.
+        """
+
+        if self.wrapped_key is None:
+            return key
+        return unwrap_key(key, self.wrapped_key)
+
+
+def header_checksum(_dict: dict) -> str:
+    """
+    :return: checksum of serialized header slot, see `Header.slot`.
+    """
+    return hashlib.sha256(json.dumps(_dict, sort_keys=True).encode()).hexdigest()
+
+
+def wrap_key(key: bytes, data_key: bytes) -> bytes:
+    """
+    Encrypts data key with the key derived from password.
+    """
+
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + AESGCM(key).encrypt(nonce, data_key, DATA_KEY_AAD)
+
+
+def unwrap_key(key: bytes, wrapped_key: bytes) -> bytes:
+    """
+    Decrypts data key wrapped by `wrap_key`.
+    """
+
+    nonce, ciphertext = wrapped_key[:NONCE_SIZE], wrapped_key[NONCE_SIZE:]
+    try:
+        return AESGCM(key).decrypt(nonce, ciphertext, DATA_KEY_AAD)
+    except InvalidTag as err:
+        raise CorruptedContainer("Can't decrypt the data key.") from err
+
+
+def shard_count(accounts: int) -> int:
+    """
+    :return: number of shards to split given number of accounts into.
+    """
+    return max(1, min(MAX_SHARDS, accounts // ACCOUNTS_PER_SHARD))
+
+
+def shard_of(accountname: str, shards: int) -> int:
+    """
+    :return: number of the shard account with given name belongs to.
+    """
+    return zlib.crc32(accountname.encode()) % shards
+
+
+def encode_shards(streams: list[int]) -> bytes:
+    """
+    Encodes transaction record listing stream ids of all shards.
+    """
+    return SHARDS + struct.pack(f"<{len(streams)}I", *streams)
+
+
+def decode_shards(record: bytes) -> list[int]:
+    data = record[len(SHARDS):]
+    if len(data) % 4:
+        raise CorruptedContainer("The journal is damaged.")
+    return list(struct.unpack(f"<{len(data) // 4}I", data))
+
+
+def encode_stream(kind: bytes, stream: int) -> bytes:
+    """
+    Encodes transaction record with stream id of the index or of the digests.
+    """
+    return kind + STREAM_ID.pack(stream)
+
+
+def decode_stream(record: bytes) -> int:
+    data = record[1:]
+    if len(data) != STREAM_ID.size:
+        raise CorruptedContainer("The journal is damaged.")
+    return STREAM_ID.unpack(data)[0]
+
+
+def encode_digest(stream: int, digest: bytes) -> bytes:
+    """
+    Encodes record of the digests stream.
+    """
+    return DIGEST_RECORD.pack(stream, digest)
+
+
+def decode_digest(record: bytes) -> tuple[int, bytes]:
+    if len(record) != DIGEST_RECORD.size:
+        raise CorruptedContainer("The digests of attachments are damaged.")
+    return DIGEST_RECORD.unpack(record)
+
+
+def derive_subkey(key: bytes, purpose: bytes) -> bytes:
+    """
+    Derives a key for given purpose from the data key, so that the same key is never used
+    for different purposes (e.g. for encryption and for hashing).
+    """
+
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"PyAccounts " + purpose)
+    return hkdf.derive(key)
+
+
+def attachment_digest(key: bytes, chunks: Iterable[bytes]) -> bytes:
+    """
+    Computes digest of attachment content: HMAC keyed with a key derived from the data key,
+    so that the digests reveal nothing about the content to those who don't have the key.
+
+    Since every database has its own data key, the same content has different digests in
+    different databases, so attachments are deduplicated only within a database. A digest
+    shared between databases would tell anyone who can read both files which attachments
+    they have in common, and the files couldn't be copied or opened separately anymore.
+    """
+
+    mac = hmac.new(derive_subkey(key, b"attachment digest"), digestmod="sha256")
+    for chunk in chunks:
+        mac.update(chunk)
+    return mac.digest()
+
+
+def is_container(file: BinaryIO) -> bool:
+    """
+    Checks whether given file is a version 2 .dba file, leaves file position unchanged.
+    """
+
+    position = file.tell()
+    magic = file.read(len(MAGIC))
+    file.seek(position)
+    return magic == MAGIC
+
+
+def is_legacy(file: BinaryIO) -> bool:
+    """
+    Checks whether given file looks like a legacy (v1) .dba file: a salt followed by
+    Fernet token, leaves file position unchanged.
+    """
+
+    position = file.tell()
+    start = file.read(LEGACY_SALT_SIZE + len(LEGACY_TOKEN_PREFIX))
+    size = file.seek(0, os.SEEK_END) - position
+    file.seek(position)
+    return size >= LEGACY_MIN_SIZE and start[LEGACY_SALT_SIZE:] == LEGACY_TOKEN_PREFIX
+
+
+def read_header(file: BinaryIO) -> Header:
+    """
+    Reads header of version 2 .dba file, the file must be positioned at its start.
+
+    Of the two slots of files with SLOTS_FEATURE the intact one with the greatest sequence
+    number is used, the file is left positioned after both of them.
+    """
+
+    _, slots = read_slots(file)
+    header = current_header(slots)
+    unsupported = set(header.features) - set(FEATURES)
+    if unsupported:
+        raise CorruptedContainer(f"Unsupported .dba features: {', '.join(sorted(unsupported))}.")
+    return header
+
+
+def read_slots(file: BinaryIO) -> tuple[int, list[Header | None]]:
+    """
+    Reads header slots of version 2 .dba file, the file must be positioned at its start.
+    :return: length of a slot and headers read from the slots, None for damaged ones.
+    """
+
+    preamble = file.read(PREAMBLE.size)
+    if len(preamble) < PREAMBLE.size:
+        raise CorruptedContainer("The file is too short.")
+
+    magic, version, length = PREAMBLE.unpack(preamble)
+    if magic != MAGIC:
+        raise CorruptedContainer("The file is not a .dba container.")
+    if version > FORMAT_VERSION:
+        raise CorruptedContainer(f"Unsupported .dba format version: {version}.")
+
+    first = load_slot(file.read(length), version)
+    if first is not None and SLOTS_FEATURE not in first.features:
+        return length, [first]
+
+    # the first slot can be damaged by an interrupted `replace_header`, then whether the
+    # file has slots is told by the second one
+    second = load_slot(file.read(length), version)
+    if second is None or SLOTS_FEATURE not in second.features:
+        if first is None:
+            raise CorruptedContainer("The header of the file is damaged.")
+        second = None
+    return length, [first, second]
+
+
+def load_slot(data: bytes, version: int) -> Header | None:
+    """
+    Parses header slot, see `Header.slot`.
+    :return: the header, or None if it's damaged.
+    """
+
+    try:
+        _dict = json.loads(data)
+        checksum = _dict.pop("checksum", None)
+        header = Header.from_dict(_dict, version)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+    if SLOTS_FEATURE in header.features and checksum != header_checksum(_dict):
+        return None
+    return header
+
+
+def current_header(slots: list[Header | None]) -> Header:
+    """
+    :return: the intact header with the greatest sequence number.
+    """
+
+    headers = [header for header in slots if header is not None]
+    if not headers:
+        raise CorruptedContainer("The header of the file is damaged.")
+    return max(headers, key=lambda header: header.sequence)
+
+
+def replace_header(path: str | os.PathLike, header: Header):
+    """
+    Replaces header of version 2 .dba file without decrypting its segments.
+
+    The header holds the only copy of the wrapped data key, so it's never overwritten in
+    place, where an interrupted write would make the file impossible to open. Instead the
+    new header is written to the slot that isn't in use with the next sequence number, the
+    current one is still there if writing is interrupted. The segments don't move, so the
+    file stays the same and its streams can still be read by StreamSource.
+
+    Files without SLOTS_FEATURE, and files whose slots are too short for the new header,
+    are copied once to a new file with the slots, which then replaces the old file.
+    """
+
+    with open(path, "r+b") as file:
+        length, slots = read_slots(file)
+        current = current_header(slots)
+        if len(slots) == 2:
+            header = dataclasses.replace(header, sequence=current.sequence + 1)
+            slot = None
+            with suppress(ValueError):
+                slot = header.slot(length)
+            if slot is not None:
+                number = 1 if slots[0] is current else 0
+                file.seek(PREAMBLE.size + number * length)
+                file.write(slot)
+                file.flush()
+                os.fsync(file.fileno())
+                return
+
+        if SLOTS_FEATURE not in header.features:
+            header = dataclasses.replace(header, features=[*header.features, SLOTS_FEATURE])
+        file.seek(PREAMBLE.size + len(slots) * length)
+        with atomic_write(path) as new_file:
+            new_file.write(header.dumps())
+            shutil.copyfileobj(file, new_file)
+
+
+class StreamWriter:
+    """
+    File-like object that compresses written data, splits it into segments and writes
+    them encrypted.
+    """
+
+    def __init__(
+            self,
+            file: BinaryIO,
+            cipher: AESGCM,
+            stream: int,
+            segment_size: int,
+            compressor: Compressor | None = None,
+            aad: bytes = b"",
+    ):
+        """
+        :param aad: prefix of associated data of the segments, see `Header.segment_aad`.
+        """
+
+        self.file = file
+        self.cipher = cipher
+        self.stream = stream
+        self.segment_size = segment_size
+        self.compressor = compressor
+        self.aad = aad
+        self.number = 0
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data: bytes):
+        if self.compressor:
+            data = self.compressor.compress(data)
+        self._buffer(data)
+
+    def _buffer(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) > self.segment_size:
+            self._flush_segment(bytes(self.buffer[:self.segment_size]), final=False)
+            del self.buffer[:self.segment_size]
+
+    def write_record(self, record: bytes):
+        """
+        Writes length prefixed record.
+        """
+        self.write(RECORD_LENGTH.pack(len(record)))
+        self.write(record)
+
+    def close(self):
+        """
+        Writes remaining data as final segment of the stream.
+        """
+
+        if self.closed:
+            return
+        if self.compressor:
+            self._buffer(self.compressor.flush())
+        self._flush_segment(bytes(self.buffer), final=True)
+        self.buffer.clear()
+        self.closed = True
+
+    def _flush_segment(self, plaintext: bytes, final: bool):
+        # nonces are random rather than counters, because the same key is used
+        # every time the database is saved
+        nonce = os.urandom(NONCE_SIZE)
+        flags = FINAL_SEGMENT if final else 0
+        length = NONCE_SIZE + len(plaintext) + TAG_SIZE
+        record_header = SEGMENT_HEADER.pack(self.stream, self.number, flags, length)
+
+        ciphertext = self.cipher.encrypt(nonce, plaintext, self.aad + record_header)
+        self.file.write(record_header)
+        self.file.write(nonce)
+        self.file.write(ciphertext)
+        self.number += 1
+
+    def __enter__(self) -> "StreamWriter":
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+
+
+class ContainerWriter:
+    """
+    Writes version 2 .dba file.
+    """
+
+    def __init__(
+            self,
+            file: BinaryIO,
+            key: bytes,
+            header: Header,
+            level: int = DEFAULT_LEVEL,
+            append: bool = False,
+    ):
+        """
+        :param level: compression level used with the algorithm specified in the header.
+        :param append: whether to append streams to an existing file instead of writing
+        a new one, the file should be positioned at the end of its last segment.
+        """
+
+        self.file = file
+        self.header = header
+        self.cipher = AESGCM(key)
+        self.compression = Compression(header.compression, level)
+        if not append:
+            file.write(header.dumps())
+
+    def stream(self, stream: int) -> StreamWriter:
+        """
+        Returns writer for given stream, streams are written one after another.
+        """
+
+        return StreamWriter(
+            self.file,
+            self.cipher,
+            stream,
+            self.header.segment_size,
+            self.compression.compressor(),
+            self.header.segment_aad,
+        )
+
+    def copy_stream(self, source: StreamSource, stream: int):
+        """
+        Copies given stream of another file without decompressing it.
+
+        The segments are bound to the file they're in (see FILE_ID_FEATURE), so they're
+        decrypted and encrypted again with the same record headers. The stream must be
+        compressed with the same algorithm and have the same or smaller segment size.
+        """
+
+        for segment in source.raw_segments(stream):
+            plaintext = source.reader.decrypt(segment)
+            nonce = os.urandom(NONCE_SIZE)
+            aad = self.header.segment_aad + segment.record_header
+            self.file.write(segment.record_header)
+            self.file.write(nonce)
+            self.file.write(self.cipher.encrypt(nonce, plaintext, aad))
+
+
+@dataclass
+class Segment:
+    stream: int
+    number: int
+    final: bool
+    record_header: bytes
+    data: bytes | memoryview
+
+
+@dataclass
+class SegmentLocation:
+    """
+    Position of an encrypted segment in the file, used to read it later.
+    """
+
+    stream: int
+    number: int
+    final: bool
+    record_header: bytes
+    offset: int
+    length: int
+
+
+class ContainerReader:
+    """
+    Reads and decrypts segments of version 2 .dba file.
+    """
+
+    def __init__(self, file: BinaryIO, key: bytes, header: Header):
+        self.file = file
+        self.header = header
+        self.cipher = AESGCM(key)
+        # position of the first segment
+        self.start = file.tell()
+        # end of the last complete segment, found by `index`
+        self.end = self.start
+
+    def index(self, content: mmap.mmap) -> dict[int, list[SegmentLocation]]:
+        """
+        Finds all segments of the file without reading their content.
+
+        A segment cut off at the end of the file (e.g. when appending to the journal was
+        interrupted) is ignored, `end` is set to the end of the last complete segment.
+        Streams left without their final segment are detected when they are read.
+        :param content: the file mapped into memory, only headers of segments are parsed.
+        :return: dict mapping stream ids to locations of their segments.
+        """
+
+        size = len(content)
+        max_length = NONCE_SIZE + self.header.segment_size + TAG_SIZE
+        self.end = self.start
+        locations = {}
+        while self.end + SEGMENT_HEADER.size <= size:
+            offset = self.end + SEGMENT_HEADER.size
+            stream, number, flags, length = SEGMENT_HEADER.unpack_from(content, self.end)
+            if length > max_length:
+                raise CorruptedContainer("The file is damaged.")
+            if offset + length > size:
+                break
+
+            location = SegmentLocation(
+                stream,
+                number,
+                bool(flags & FINAL_SEGMENT),
+                content[self.end:offset],
+                offset,
+                length,
+            )
+            locations.setdefault(stream, []).append(location)
+            self.end = offset + length
+        return locations
+
+    def decrypt(self, segment: Segment) -> bytes:
+        nonce, ciphertext = segment.data[:NONCE_SIZE], segment.data[NONCE_SIZE:]
+        try:
+            aad = self.header.segment_aad + segment.record_header
+            return self.cipher.decrypt(nonce, ciphertext, aad)
+        except InvalidTag as err:
+            raise CorruptedContainer("Can't decrypt the file.") from err
+
+    def decrypt_into(self, segment: Segment, buffer: bytearray) -> memoryview:
+        """
+        Decrypts segment into given buffer, which must be big enough for any segment.
+        :return: part of the buffer containing plaintext of the segment.
+        """
+
+        data = memoryview(segment.data)
+        plaintext = memoryview(buffer)[:len(data) - NONCE_SIZE - TAG_SIZE]
+        try:
+            aad = self.header.segment_aad + segment.record_header
+            self.cipher.decrypt_into(data[:NONCE_SIZE], data[NONCE_SIZE:], aad, plaintext)
+        except (InvalidTag, ValueError) as err:
+            raise CorruptedContainer("Can't decrypt the file.") from err
+        return plaintext
+
+    def decrypt_segments_into(
+            self,
+            segments: Iterable[Segment],
+            workers: int = 1,
+    ) -> Iterator[memoryview]:
+        """
+        Decrypts given segments into a few buffers that are reused, yielding their plaintext
+        in order, so the plaintext yielded is only valid until the next one is requested.
+
+        With several `workers` the segments are decrypted in parallel.
+        """
+
+        size = self.header.segment_size
+        if workers <= 1:
+            buffer = bytearray(size)
+            for segment in segments:
+                yield self.decrypt_into(segment, buffer)
+            return
+
+        free = [bytearray(size) for _ in range(workers * 2)]
+        with ThreadPoolExecutor(workers) as executor:
+            pending = deque()
+            for segment in segments:
+                buffer = free.pop()
+                pending.append((executor.submit(self.decrypt_into, segment, buffer), buffer))
+                if len(pending) >= workers * 2:
+                    future, buffer = pending.popleft()
+                    yield future.result()
+                    free.append(buffer)
+            while pending:
+                future, buffer = pending.popleft()
+                yield future.result()
+
+
+class StreamSource:
+    """
+    Decrypts streams of version 2 .dba file on demand.
+
+    The file is kept open, so that its streams can be read even after it has been
+    replaced or removed (e.g. when the database is saved). It's mapped into memory, so
+    that segments are decrypted straight from the mapping, without copying them.
+    """
+
+    def __init__(self, path: str | os.PathLike, key: bytes):
+        self.key = key
+        self.file = open(path, "rb")
+        self.header = read_header(self.file)
+        self.reader = ContainerReader(self.file, key, self.header)
+        # the file only grows past the end of the mapping (see Database.save_changes),
+        # and only its header is overwritten (see `replace_header`), so the mapped
+        # segments never change
+        self.content = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.locations = self.reader.index(self.content)
+        # end of the last complete segment
+        self.end = self.reader.end
+
+    def is_file(self, path: str | os.PathLike) -> bool:
+        """
+        Checks whether the streams are read from given file (and not e.g. from the file
+        it has replaced).
+        """
+
+        try:
+            return os.path.samestat(os.fstat(self.file.fileno()), os.stat(path))
+        except FileNotFoundError:
+            return False
+
+    def raw_segments(self, stream: int) -> Iterator[Segment]:
+        """
+        Reads encrypted segments of given stream.
+        """
+
+        locations = self.locations.get(stream, [])
+        if not locations or not locations[-1].final:
+            raise CorruptedContainer("The file is truncated.")
+
+        for number, location in enumerate(locations):
+            if location.number != number:
+                raise CorruptedContainer("Segments of the file are out of order.")
+
+            yield Segment(
+                location.stream,
+                location.number,
+                location.final,
+                location.record_header,
+                memoryview(self.content)[location.offset:location.offset + location.length],
+            )
+
+    def read_stream(self, stream: int, workers: int = 1) -> Iterator[bytes]:
+        """
+        Decrypts and decompresses segments of given stream, yielding their content in order.
+
+        With several `workers` the segments are decrypted in parallel.
+        """
+
+        # the chunks are copied out of the reused buffers, since they may be kept
+        segments = self.raw_segments(stream)
+        plaintext = map(bytes, self.reader.decrypt_segments_into(segments, workers))
+        return decompress(plaintext, self.header.compression)
+
+    def read_records(self, stream: int, workers: int = 1) -> Iterator[bytes]:
+        """
+        Reads records of given stream, see `iter_records`.
+
+        Since records are copied out of the plaintext, the segments are decrypted into
+        reusable buffers instead of allocating new ones for every segment.
+        """
+
+        # the segments are decrypted ahead of the ones that were released
+        segments = self.released(self.raw_segments(stream), stream, workers * 2)
+        plaintext = self.reader.decrypt_segments_into(segments, workers)
+        return iter_records(decompress(plaintext, self.header.compression))
+
+    def released(self, segments: Iterable[Segment], stream: int, lag: int) -> Iterator[Segment]:
+        """
+        Passes segments of given stream through, releasing pages of the mapping that hold
+        the ones `lag` segments behind. The pages stay in the page cache and are read
+        again if needed, so reading a big stream doesn't grow the memory of the process
+        by its size.
+        """
+
+        locations = self.locations.get(stream, [])
+        released = 0
+        for number, segment in enumerate(segments):
+            yield segment
+            if number >= lag:
+                self.release(locations[released])
+                released += 1
+        for location in locations[released:]:
+            self.release(location)
+
+    def release(self, location: SegmentLocation):
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start = location.offset - location.offset % mmap.PAGESIZE
+        self.content.madvise(mmap.MADV_DONTNEED, start, location.offset + location.length - start)
+
+    def stream_size(self, stream: int) -> int:
+        """
+        :return: size in bytes the stream takes in the file.
+        """
+        return sum(SEGMENT_HEADER.size + location.length for location in self.locations[stream])
+
+    def close(self):
+        # segments that are still referenced (e.g. by an unfinished read_stream) keep
+        # the mapping, it's closed once they're gone
+        with suppress(BufferError):
+            self.content.close()
+        self.file.close()
+
+
+def decompress(chunks: Iterable[bytes], algorithm: str) -> Iterator[bytes]:
+    """
+    Decompresses stream of chunks as they arrive.
+    """
+
+    try:
+        _decompressor = decompressor(algorithm)
+        for chunk in chunks:
+            if data := _decompressor.decompress(chunk):
+                yield data
+    except (ValueError, zlib.error, lzma.LZMAError) as err:
+        raise CorruptedContainer("Can't decompress the file.") from err
+
+    if not _decompressor.eof:
+        raise CorruptedContainer("The file is truncated.")
+
+
+def iter_records(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Splits stream of chunks into length prefixed records written by StreamWriter.write_record.
+    """
+
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        position = 0
+        with memoryview(buffer) as view:
+            while len(buffer) - position >= RECORD_LENGTH.size:
+                (length,) = RECORD_LENGTH.unpack_from(buffer, position)
+                end = position + RECORD_LENGTH.size + length
+                if len(buffer) < end:
+                    break
+                yield bytes(view[position + RECORD_LENGTH.size:end])
+                position = end
+        del buffer[:position]
+
+    if buffer:
+        raise CorruptedContainer("The last record of the file is incomplete.")
@@ -15,17 +15,17 @@
 #  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-import base64
 import logging
 import platform
 import traceback
 import typing
 from pathlib import Path
 
-from gi.repository import Gdk, Gtk
+from gi.repository import Gdk, Gtk, GLib
 
-from core.database_utils import Account, Database
+from core.database_utils import Account, Attachment, Database
 from core.gtk_utils import (
+    Task,
     get_mime_icon,
     add_list_item,
     abc_list_sort,
@@ -43,6 +43,8 @@ CONFIRM_ATTACH_EXISTING_FILE = "File <b>{}</b> is already attached, replace?"
 SELECT_FILES_TO_DETACH = "Please select some files to detach."
 CONFIRM_FILES_DETACH = "Detach selected files?"
 ERROR_READING_FILE = "Error reading file <b>{}</b>."
+ERROR_ATTACHING_FILES = "Error attaching files!"
+ATTACHING_FILES = "Attaching files... {}%"
 ATTACH_FILE_TITLE = "Attach file"
 
 
@@ -79,6 +81,8 @@ class CreateAccount(CreateForm):
         self.database = database
         self.database_window = database_window
         self.attached_paths = {}
+        # percentage of the attached files read so far, see `show_progress`
+        self.attached_percent: int | None = None
 
         # allow dropping files onto attached_files list to attach them
         self.attached_files.drag_dest_set(
@@ -215,30 +219,69 @@ class CreateAccount(CreateForm):
             if Path(path).is_file():
                 self.attach_file(path)
 
-    def get_attached_files(self) -> dict[str, str]:
+    def read_attached_files(self, paths: dict[str, str]):
         """
-        Loads content of selected attached files handling errors.
-        :return: dict mapping file names to file content.
+        Attaches selected files in background, showing progress in statusbar.
+        The form is disabled until the files are read, see `on_files_attached`.
+        :param paths: paths of the files mapped by their names.
         """
 
-        attached_files = {}
-        for filename, path in self.attached_paths.items():
-            if not path:  # skip files that are already attached
-                continue
-
-            try:
-                with open(path, "rb") as file:
-                    data = file.read()
-                    encoded = base64.b64encode(data)
-                    attached_files[filename] = encoded.decode("ascii")
-            except Exception as err:
-                logging.error(traceback.format_exc())
-                ErrorDialog(ERROR_READING_FILE.format(filename), err).run()
-        return attached_files
-
-    def build_account(self) -> Account:
+        self.parent_widget.sensitive = False
+        self.attached_percent = None
+        self.show_progress(0, 0)
+        Task(
+            Attachment.from_files,
+            paths,
+            self.database._data_key,
+            # called from the worker threads
+            lambda done, total: GLib.idle_add(self.show_progress, done, total),
+            on_done=self.on_files_attached,
+            on_error=self.on_attach_error,
+        )
+
+    def show_progress(self, done: int, total: int) -> bool:
+        percent = done * 100 // total if total else 0
+        # update the statusbar only when the percentage changes
+        if percent != self.attached_percent:
+            self.attached_percent = percent
+            self.database_window.statusbar.message(ATTACHING_FILES.format(percent))
+        # returning False removes this callback from the main loop
+        return False
+
+    def on_files_attached(self, result: tuple[dict[str, Attachment], dict[str, Exception]]):
+        """
+        Creates the account once the files are read, showing errors of the files that
+        couldn't be attached.
+        """
+
+        # the database is being saved, apply changes when it's done
+        if self.database_window.writing:
+            GLib.timeout_add(100, self.on_files_attached, result)
+            return False
+
+        self.database_window.statusbar.clear()
+        self.parent_widget.sensitive = True
+        attached_files, errors = result
+        for filename, err in errors.items():
+            logging.error("".join(traceback.format_exception(err)))
+            ErrorDialog(ERROR_READING_FILE.format(filename), err).run()
+
+        # the form was closed meanwhile
+        if self.parent is None:
+            return False
+        self.apply_account(attached_files)
+        return False
+
+    def on_attach_error(self, err: Exception):
+        logging.error("".join(traceback.format_exception(err)))
+        self.database_window.statusbar.clear()
+        self.parent_widget.sensitive = True
+        ErrorDialog(ERROR_ATTACHING_FILES, err).run()
+
+    def build_account(self, attached_files: dict[str, Attachment]) -> Account:
         """
         Creates account using form data.
+        :param attached_files: files attached from disk, see `read_attached_files`.
         """
 
         return Account(
@@ -249,7 +292,7 @@ class CreateAccount(CreateForm):
             birthdate=self.birth_date.text,
             notes=notes_text(self.notes),
             copy_email=self.copy_email.active,
-            attached_files=self.get_attached_files(),
+            attached_files=attached_files,
         )
 
     @staticmethod
@@ -265,6 +308,14 @@ class CreateAccount(CreateForm):
         database_window.check_db_saved()
 
     def on_apply(self, _=None):
-        account = self.build_account()
+        # skip files that are already attached
+        paths = {filename: path for filename, path in self.attached_paths.items() if path}
+        if paths:
+            self.read_attached_files(paths)
+        else:
+            self.apply_account({})
+
+    def apply_account(self, attached_files: dict[str, Attachment]):
+        account = self.build_account(attached_files)
         self.create_account(account, self.database_window)
         self.destroy()
@@ -17,11 +17,13 @@ import logging
 import traceback
 import typing
 
-from gi.repository import Gtk, GdkPixbuf
+from gi.repository import Gtk
 
-from core.database_utils import Database
+from core import kdf
+from core.compression import Compression
+from core.database_utils import CONTAINER_ENGINE, Database
 from core.database_window import DatabaseWindow
-from core.gtk_utils import add_list_item
+from core.gtk_utils import Task
 from core.widgets import CreateForm, FilterDbNameMixin, ErrorDialog
 
 if typing.TYPE_CHECKING:
@@ -56,23 +58,41 @@ class CreateDatabase(CreateForm, FilterDbNameMixin):
 
     def on_apply(self, _=None):
         """
-        Creates database using form data and handling all errors.
+        Creates database in background using form data.
         """
 
+        self.apply.sensitive = False
         database = Database(self.name.text, self.password.text)
-        try:
-            database.create()
-        except Exception as err:
-            logging.error(traceback.format_exc())
-            ErrorDialog(ERROR_DB_CREATION, err).run()
-            return
+        Task(
+            self.create_database,
+            database,
+            self.main_window.config.get_compression(),
+            self.main_window.config.engine,
+            on_done=self.on_database_created,
+            on_error=self.on_apply_error,
+        )
 
-        self.main_window.databases.append(database)
-        self.main_window.databases.sort(key=lambda db: db.name)
+    @staticmethod
+    def create_database(
+            database: Database,
+            compression: Compression,
+            engine: str = CONTAINER_ENGINE,
+    ) -> Database:
+        # calibration takes a while, so it's done here in background
+        database.create(compression, kdf.calibrate(), engine=engine)
+        return database
 
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale("img/icon.svg", 50, 50, True)
-        add_list_item(self.main_window.db_list, pixbuf, database.name)
+    def on_apply_error(self, err: Exception):
+        logging.error("".join(traceback.format_exception(err)))
+        ErrorDialog(ERROR_DB_CREATION, err).run()
+        self.apply.sensitive = True
 
+    def on_database_created(self, database: Database):
+        """
+        Adds created database to the databases list and opens its window.
+        """
+
+        self.main_window.add_database(database)
         self.destroy()
         win = DatabaseWindow(database, self.main_window)
         self.main_window.windows[database.name] = win
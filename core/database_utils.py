@@ -21,27 +21,357 @@ Defines most fundamental classes for PyAccounts: Account and Database.
 from __future__ import annotations
 
 import base64
+import itertools
 import json
 import logging
 import os
+import sys
+import threading
+import time
 import traceback
-from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field, fields
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterable, Iterator
 
 from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 import core
+from core import container
+from core.compression import Compression
+from core.container import (
+    ACCOUNTS_STREAM,
+    ContainerWriter,
+    CorruptedContainer,
+    Header,
+    StreamSource,
+    StreamWriter,
+)
+from core.file_utils import atomic_write, backup_files
+from core.history import History, Revision
+from core.kdf import SALT_SIZE, KdfParams
+from core.sealed import OVERHEAD, SealedField, SealedFile, seal, unseal
+from core.serialization import CODECS, DEFAULT_CODEC, Codec
+from core.sqlite_storage import SqliteStorage, is_sqlite
 
 if TYPE_CHECKING:
     from typing import TypeAlias
     from core.database_window import DatabaseWindow
 
+# every change of any account gets a new number from here, so that a revision
+# uniquely identifies the state of an account
+_revisions = itertools.count()
 
-@dataclass
+# new versions of changed shards are written once the journal gets bigger than this part
+# of their size
+JOURNAL_SIZE_RATIO = 0.5
+# the .dba file is re-created once this part of it isn't used anymore
+GARBAGE_RATIO = 0.5
+
+# storage engines of .dba files: the container (see core.container) or SQLite database
+# (see core.sqlite_storage)
+CONTAINER_ENGINE = "container"
+SQLITE_ENGINE = "sqlite"
+ENGINES = (CONTAINER_ENGINE, SQLITE_ENGINE)
+
+# formats of .dba files, see `detect_format`
+LEGACY_FORMAT = "legacy"
+CONTAINER_FORMAT = "container"
+SQLITE_FORMAT = "sqlite"
+
+# files bigger than this can't be attached
+MAX_ATTACHMENT_SIZE = 1 << 30
+# attached files are read from and written to disk in chunks of this size
+FILE_CHUNK_SIZE = 1 << 20
+
+# called with the number of bytes processed so far and the total number of bytes
+Progress: TypeAlias = Callable[[int, int], None]
+
+
+class AttachmentError(Exception):
+    """
+    Raised when a file can't be attached because it's too big.
+    """
+
+
+class Attachment:
+    """
+    Content of an attached file.
+
+    Attachments of opened databases aren't kept in memory, they're decrypted from
+    the .dba file only when their content is needed. Likewise, files attached from disk
+    are copied in chunks to a temporary file, see `from_file`. Content that is kept in
+    memory (e.g. of legacy databases) or in the temporary file is encrypted with
+    the session key, see core.sealed.
+    """
+
+    def __init__(
+        self,
+        data: bytes | None = None,
+        source: StreamSource | SqliteStorage | None = None,
+        stream: int | None = None,
+    ):
+        self.data = data
+        self.source = source
+        self.stream = stream
+        # attached file that wasn't saved to a database yet, and the copy of its content
+        # made when it was attached
+        self.path: Path | None = None
+        self._copy: SealedFile | None = None
+        # data key and the digest of the content computed with it, see `digest`
+        self._digest: tuple[bytes, bytes] | None = None
+
+    @staticmethod
+    def from_file(
+            path: str | os.PathLike,
+            key: bytes | None = None,
+            progress: Progress | None = None,
+    ) -> "Attachment":
+        """
+        Attaches a file without loading it into memory.
+
+        The content is copied to a temporary file right away, so the database can be saved
+        even if the file is moved or changed later.
+
+        :param key: the data key of the database, when given the digest of the content
+         is computed while it's copied, see `digest`.
+        :param progress: called while the file is read.
+        :raises AttachmentError: if the file is bigger than MAX_ATTACHMENT_SIZE.
+        """
+
+        path = Path(path)
+        stat = path.stat()
+        if stat.st_size > MAX_ATTACHMENT_SIZE:
+            raise AttachmentError(
+                f"{path.name} is bigger than {MAX_ATTACHMENT_SIZE // 2 ** 20} MiB."
+            )
+
+        attachment = Attachment()
+        attachment.path = path
+        attachment._copy = SealedFile()
+        try:
+            with open(path, "rb") as file:
+                chunks = iter(lambda: file.read(FILE_CHUNK_SIZE), b"")
+                if progress:
+                    chunks = report_progress(chunks, stat.st_size, progress)
+                chunks = copy_chunks(chunks, attachment._copy)
+                if key is None:
+                    for _ in chunks:
+                        pass
+                else:
+                    attachment._digest = (key, container.attachment_digest(key, chunks))
+        except BaseException:
+            attachment._copy.close()
+            raise
+        return attachment
+
+    @staticmethod
+    def from_files(
+            paths: dict[str, str | os.PathLike],
+            key: bytes | None = None,
+            progress: Progress | None = None,
+    ) -> tuple[dict[str, "Attachment"], dict[str, Exception]]:
+        """
+        Attaches several files in parallel, see `from_file`.
+
+        :param paths: paths of the files mapped by names of attached files.
+        :param progress: called from the worker threads with the number of bytes read
+         from all files.
+        :return: attachments and errors of the files that couldn't be attached, both
+         mapped by names of attached files.
+        """
+
+        total = 0
+        for path in paths.values():
+            with suppress(OSError):
+                total += os.path.getsize(path)
+        done = 0
+        lock = threading.Lock()
+
+        def file_progress() -> Progress | None:
+            if not progress:
+                return None
+            read = 0
+
+            def update(file_done: int, _):
+                nonlocal done, read
+                with lock:
+                    done += file_done - read
+                    read = file_done
+                    progress(done, total)
+            return update
+
+        attached_files, errors = {}, {}
+        with ThreadPoolExecutor(os.cpu_count() or 1) as executor:
+            futures = {
+                name: executor.submit(Attachment.from_file, path, key, file_progress())
+                for name, path in paths.items()
+            }
+            for name, future in futures.items():
+                try:
+                    attached_files[name] = future.result()
+                except Exception as err:
+                    errors[name] = err
+        return attached_files, errors
+
+    @staticmethod
+    def from_base64(content: str) -> "Attachment":
+        return Attachment(base64.b64decode(content.encode()))
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.read()).decode("ascii")
+
+    def chunks(self) -> Iterator[bytes]:
+        """
+        Yields content of the attachment in chunks, without loading it into memory at once.
+        """
+
+        if self.source:
+            yield from self.source.read_stream(self.stream)
+        elif self._copy:
+            yield from self._copy.read()
+        else:
+            yield self.data
+
+    @property
+    def data(self) -> bytes | None:
+        return None if self._data is None else unseal(self._data)
+
+    @data.setter
+    def data(self, data: bytes | None):
+        self._data = None if data is None else seal(data)
+
+    def save(self, path: str | os.PathLike, progress: Progress | None = None):
+        """
+        Writes content of the attachment to given file in chunks, the file is replaced
+        atomically, so it isn't left half-written on errors.
+        :param progress: called after every written chunk.
+        """
+
+        chunks = self.chunks()
+        if progress:
+            chunks = report_progress(chunks, self.size(), progress)
+        with atomic_write(path) as file:
+            for chunk in chunks:
+                file.write(chunk)
+
+    def read(self) -> bytes:
+        return b"".join(self.chunks())
+
+    def copy(self) -> "Attachment":
+        """
+        Copies the content, so that the copy doesn't depend on the file the attachment
+        is stored in (e.g. when the account is pasted to another database).
+        """
+
+        if self._data is not None:
+            attachment = Attachment(self.data)
+        else:
+            attachment = Attachment()
+            attachment._copy = SealedFile()
+            for chunk in self.chunks():
+                attachment._copy.write(chunk)
+        attachment._digest = self._digest
+        return attachment
+
+    def digest(self, key: bytes) -> bytes:
+        """
+        Returns digest of the content, attachments with the same content have the same
+        digest, see core.container.attachment_digest.
+        :param key: the data key of the database.
+        """
+
+        if self._digest is None or self._digest[0] != key:
+            self._digest = (key, container.attachment_digest(key, self.chunks()))
+        return self._digest[1]
+
+    def size(self) -> int:
+        if self._copy:
+            return self._copy.size
+        if self._data is not None:
+            return len(self._data) - OVERHEAD
+        return sum(len(chunk) for chunk in self.chunks())
+
+    def store(self, source: StreamSource | SqliteStorage, stream: int):
+        """
+        Records where the attachment is stored, freeing its content from memory.
+        """
+
+        self.data = None
+        if self._copy:
+            self._copy.close()
+        self.path = self._copy = None
+        self.source = source
+        self.stream = stream
+
+    def __eq__(self, other):
+        if not isinstance(other, Attachment):
+            return NotImplemented
+        if self.source and self.source is other.source and self.stream == other.stream:
+            return True
+        return self.read() == other.read()
+
+    def __repr__(self):
+        if self.source:
+            return f"Attachment(stream={self.stream})"
+        if self.path:
+            return f"Attachment(path={str(self.path)!r})"
+        return f"Attachment(size={self.size()})"
+
+
+def detect_format(file: BinaryIO) -> str | None:
+    """
+    Recognises format of given .dba file without decrypting it, leaves file position unchanged.
+    :return: LEGACY_FORMAT, CONTAINER_FORMAT, SQLITE_FORMAT or None if the file isn't
+    a database.
+    """
+
+    if is_sqlite(file):
+        return SQLITE_FORMAT
+    if container.is_container(file):
+        return CONTAINER_FORMAT
+    if container.is_legacy(file):
+        return LEGACY_FORMAT
+    return None
+
+
+def copy_chunks(chunks: Iterable[bytes], copy: SealedFile) -> Iterator[bytes]:
+    """
+    Passes chunks through, writing them to `copy`.
+    """
+
+    for chunk in chunks:
+        copy.write(chunk)
+        yield chunk
+
+
+def report_progress(chunks: Iterable[bytes], total: int, progress: Progress) -> Iterator[bytes]:
+    """
+    Passes chunks through, calling `progress` with the number of bytes passed so far.
+    """
+
+    done = 0
+    for chunk in chunks:
+        yield chunk
+        done += len(chunk)
+        progress(done, total)
+
+
+@dataclass(slots=True)
 class Account:
+    """
+    Represents an account stored in a database.
+
+    Every time a field of the account is assigned, the account gets a new `revision`.
+    Databases use it to track unsaved changes, so don't modify the fields in place
+    (e.g. `attached_files`), assign a new value instead.
+
+    Accounts use slots instead of `__dict__`, because there can be a lot of them when
+    several big databases are opened. For the same reason `secret_fields` are stored
+    encrypted with the session key and decrypted every time they're read, see core.sealed.
+    """
+
     accountname: str
     username: str
     email: str
@@ -49,7 +379,8 @@ class Account:
     birthdate: str
     notes: str
     copy_email: bool = True
-    attached_files: dict[str, str] = field(default_factory=dict)
+    attached_files: dict[str, Attachment] = field(default_factory=dict)
+    revision: int = field(init=False, repr=False, compare=False)
 
     field_mapping = {
         "accountname": "account",
@@ -59,12 +390,55 @@ class Account:
         "attached_files": "attach_files",
     }
     reversed_mapping = {v: k for k, v in field_mapping.items()}
+    # fields that often have the same value in many accounts
+    interned_fields = ("username", "email", "birthdate")
+    secret_fields = ("password", "notes")
+
+    def __setattr__(self, name, value):
+        if name == "attached_files":
+            # legacy databases store attached files as base64 strings
+            value = {
+                file: Attachment.from_base64(content) if isinstance(content, str) else content
+                for file, content in value.items()
+            }
+
+        # zero argument super() doesn't work in slotted dataclasses
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, "revision", next(_revisions))
 
-    def to_dict(self) -> dict:
+    def intern(self) -> "Account":
+        """
+        Interns values of `interned_fields`, so that accounts with the same e.g. email
+        share one string instead of keeping their own copies.
+
+        The values stay the same, so it doesn't change the revision.
+        """
+
+        for name in self.interned_fields:
+            object.__setattr__(self, name, sys.intern(getattr(self, name)))
+        return self
+
+    def to_dict(self, attached_files: dict | None = None) -> dict:
         """
         Converts Account to dict renaming some fields.
+
+        :param attached_files: what to store instead of attached files, by default they
+        are stored as base64 strings.
         """
-        return {self.field_mapping.get(k, k): v for k, v in self.__dict__.items()}
+
+        if attached_files is None:
+            attached_files = {
+                file: attachment.to_base64()
+                for file, attachment in self.attached_files.items()
+            }
+
+        _dict = {
+            self.field_mapping.get(f.name, f.name): getattr(self, f.name)
+            for f in fields(self)
+            if f.init  # skip `revision`
+        }
+        _dict["attach_files"] = attached_files
+        return _dict
 
     @staticmethod
     def from_dict(_dict: dict) -> "Account":
@@ -79,15 +453,99 @@ class Account:
         args = {Account.reversed_mapping.get(k, k): v for k, v in _dict.items()}
         return Account(**args)
 
+    def utf8(self, name: str) -> bytes:
+        """
+        :return: value of a secret field utf-8 encoded, without decoding it into a string.
+        """
+        return getattr(Account, name).utf8(self)
+
+    def copy(self) -> "Account":
+        """
+        :return: copy of the account with copies of its attached files, see Attachment.copy.
+        """
+
+        values = {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+        values["attached_files"] = {
+            file: attachment.copy() for file, attachment in self.attached_files.items()
+        }
+        return Account(**values)
+
+
+# slots of the secret fields hold sealed values, the descriptors decrypt them on access
+for _name in Account.secret_fields:
+    setattr(Account, _name, SealedField(getattr(Account, _name)))
+
 
 Accounts: TypeAlias = dict[str, Account]
 
 
+@dataclass
+class Journal:
+    """
+    State of the journal of an opened .dba file, see `Database.save_changes`.
+    """
+
+    # ids of the streams containing current versions of the shards
+    shards: list[int]
+    # shards changed by the transactions written after the shards
+    dirty: set[int] = field(default_factory=set)
+    # the last transaction that listed the shards, the ones before it aren't replayed
+    folded: int = container.TRANSACTIONS - 1
+    # id of the stream containing current version of the index, files written before
+    # the index was introduced don't have it
+    index: int | None = None
+    # id of the stream containing current version of the digests of attachments
+    digests_stream: int | None = None
+    # digests of the attachments stored in the file mapped to their streams
+    digests: dict[bytes, int] = field(default_factory=dict)
+
+
+@dataclass
+class Deduplication:
+    """
+    Space saved by storing attachments with the same content once, see
+    `Database.deduplication`.
+    """
+
+    # number of attached files of all accounts
+    attachments: int
+    # number of attachments with distinct content, i.e. stored in the file
+    unique: int
+    # size in bytes of all attached files
+    size: int
+    # size in bytes of the attachments with distinct content
+    unique_size: int
+
+    @property
+    def saved(self) -> int:
+        return self.size - self.unique_size
+
+
 @dataclass(order=True)
 class Database:
     name: str
     password: str | None = None
     accounts: Accounts = field(default_factory=dict)
+    # password, KDF parameters and the key derived from them, kept while the database
+    # is opened so that we run the key derivation function only once per .dba file
+    _key_cache: tuple[str, KdfParams, bytes] | None = field(
+        default=None, repr=False, compare=False,
+    )
+    # random key the .dba file is encrypted with, it's stored in the file wrapped with
+    # the key derived from password, so changing password doesn't require re-encryption
+    _data_key: bytes | None = field(default=None, repr=False, compare=False)
+    # storage engine of the .dba file, see ENGINES
+    engine: str = field(default=CONTAINER_ENGINE, compare=False)
+    # state of the journal of the .dba file, see `save_changes`
+    _journal: Journal | None = field(default=None, repr=False, compare=False)
+    # SQLite database the accounts were read from, if the engine is SQLITE_ENGINE
+    _storage: SqliteStorage | None = field(default=None, repr=False, compare=False)
+    # the .dba file attachments of the accounts are read from, see `replace_source`
+    _source: StreamSource | None = field(default=None, repr=False, compare=False)
+    # revisions of the accounts at the moment the database was last opened or saved
+    _saved_revisions: dict[str, int] | None = field(
+        default=None, repr=False, compare=False,
+    )
 
     @property
     def dba_file(self) -> Path:
@@ -101,6 +559,13 @@ class Database:
         """
         return self.password is not None
 
+    @property
+    def revisions(self) -> dict[str, int]:
+        """
+        Maps names of the accounts to their revisions.
+        """
+        return {name: account.revision for name, account in self.accounts.items()}
+
     @property
     def saved(self) -> bool:
         """
@@ -109,17 +574,39 @@ class Database:
         Used to check whether database needs to be saved. It is needed when closing
         database. With it, we can determine whether to show confirmation dialog about unsaved
         data to user or not.
+
+        For opened or saved databases this compares revisions of the accounts with the ones
+        recorded by `mark_saved`, without reading or decrypting the .dba file.
         """
 
-        disk_db = Database(self.name)
+        if not self.dba_file.exists():
+            # if database on disk doesn't exist then it definitely
+            # differs from the one in memory
+            return False
+
+        if self._saved_revisions is not None:
+            return self.revisions == self._saved_revisions
+
+        # we have nothing to compare with, so compare with the database on disk
+        disk_db = Database(self.name, _key_cache=self._key_cache)
         try:
             disk_db.open(self.password)
+            return self.accounts == disk_db.accounts
         except FileNotFoundError:
-            # if database on disk doesn't exist then it definitely
-            # differs from the one in memory
             logging.error(traceback.format_exc())
             return False
-        return self.accounts == disk_db.accounts
+        finally:
+            disk_db.close()
+
+    def mark_saved(self, revisions: dict[str, int] | None = None):
+        """
+        Records revisions of the accounts that are now the same as on the disk.
+        :param revisions: revisions to record, current ones by default.
+        """
+
+        if revisions is None:
+            revisions = self.revisions
+        self._saved_revisions = revisions
 
     def loads(self, string: bytes | str):
         """
@@ -127,8 +614,11 @@ class Database:
         """
 
         accounts_dict = json.loads(string)
-        for accountname, account_dict in accounts_dict.items():
-            self.accounts[accountname] = Account.from_dict(account_dict)
+        # dicts are dropped one by one, so that their strings are freed as soon as
+        # the accounts take them (secret fields are encrypted, see core.sealed)
+        for accountname in list(accounts_dict):
+            account_dict = accounts_dict.pop(accountname)
+            self.accounts[accountname] = Account.from_dict(account_dict).intern()
 
     def dumps(self) -> str:
         """
@@ -139,34 +629,22 @@ class Database:
         }
         return json.dumps(accounts_dicts)
 
-    @staticmethod
-    def get_fernet(password: str, salt: bytes) -> Fernet:
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100_000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-        return Fernet(key)
-
-    @staticmethod
-    def encrypt(data: str, password: str, salt: bytes) -> bytes:
-        """
-        Encrypts given data using password and salt.
+    def key(self, kdf: KdfParams) -> bytes:
         """
+        Returns key derived from database password using given KDF parameters.
 
-        f = Database.get_fernet(password, salt)
-        return f.encrypt(data.encode())
-
-    @staticmethod
-    def decrypt(token: bytes, password: str, salt: bytes) -> bytes:
-        """
-        Decrypts given token using password and salt.
+        The key is derived only once and then reused for as long as neither
+        password nor KDF parameters change.
         """
 
-        f = Database.get_fernet(password, salt)
-        return f.decrypt(token)
+        if self._key_cache:
+            password, cached_kdf, key = self._key_cache
+            if password == self.password and cached_kdf == kdf:
+                return key
+
+        key = kdf.derive(self.password)
+        self._key_cache = (self.password, kdf, key)
+        return key
 
     def open(self, password: str):
         """
@@ -178,57 +656,1207 @@ class Database:
         :param password: password to open the database.
         """
 
+        self.password = password
+        # accounts are decoded into a new dict, so that they aren't left half-read on errors
+        accounts, self.accounts = self.accounts, {}
+        try:
+            with open(self.dba_file, "rb") as file:
+                file_format = detect_format(file)
+                if file_format == SQLITE_FORMAT:
+                    self.open_sqlite()
+                elif file_format == LEGACY_FORMAT:
+                    self.open_legacy(file)
+                elif file_format == CONTAINER_FORMAT:
+                    self.open_container(file)
+                else:
+                    raise CorruptedContainer("The file is not a database.")
+        except Exception:
+            self.accounts = accounts
+            # don't keep the key derived from a wrong password
+            self._key_cache = None
+            self._data_key = None
+            self._journal = None
+            self.replace_storage(None)
+            raise
+        self.mark_saved()
+
+    def read_index(self, password: str) -> list[str] | None:
+        """
+        Reads names of the accounts from the index of the .dba file.
+
+        The index is small compared to the accounts, so the names can be displayed long
+        before `open` decrypts the whole database. The derived key is cached, so `open`
+        doesn't run the key derivation function again.
+        :param password: password to open the database.
+        :return: names of the accounts, or None if the file has no index (e.g. legacy
+        files), then the database should be opened right away.
+        """
+
         self.password = password
         with open(self.dba_file, "rb") as file:
-            salt = file.read(16)
-            token = file.read()
+            if detect_format(file) != CONTAINER_FORMAT:
+                return None
+            header = container.read_header(file)
+        if header.index is None:
+            return None
 
-            data = self.decrypt(token, password, salt)
-            self.loads(data)
+        try:
+            source = StreamSource(self.dba_file, header.data_key(self.key(header.kdf)))
+        except Exception:
+            self._key_cache = None
+            raise
+
+        try:
+            codec = CODECS.get(header.codec)
+            if not codec:
+                raise CorruptedContainer(f"Unknown codec: {header.codec}.")
+
+            journal, transactions = self.read_journal(source, header, header.shard_streams)
+            index = source.read_records(journal.index)
+            names = dict.fromkeys(str(record, "utf-8") for record in index)
+            for records in transactions:
+                for record in records:
+                    kind, data = record[:1], record[1:]
+                    if kind == container.UPSERT:
+                        fields, _ = codec.decode(data)
+                        names[fields[0]] = None
+                    elif kind == container.DELETE:
+                        names.pop(data.decode(), None)
+        finally:
+            source.close()
+        return list(names)
+
+    def open_legacy(self, file: BinaryIO):
+        """
+        Reads legacy .dba file: a salt followed by Fernet token containing accounts json.
+        """
+
+        self.engine = CONTAINER_ENGINE
+        salt = file.read(16)
+        key = self.key(KdfParams(salt))
+        data = Fernet(base64.urlsafe_b64encode(key)).decrypt(file.read())
+        string = data.decode()
+        # don't keep the data while the accounts are parsed
+        del data
+        self.loads(string)
+
+    def open_container(self, file: BinaryIO):
+        """
+        Reads version 2 .dba file, decrypting and deserializing accounts one by one.
+        """
+
+        self.engine = CONTAINER_ENGINE
+        header = container.read_header(file)
+        key = header.data_key(self.key(header.kdf))
+        self._data_key = key
+        # attached files are decrypted from here when they're needed
+        source = StreamSource(self.dba_file, key)
+
+        try:
+            codec = CODECS.get(header.codec)
+            if not codec:
+                raise CorruptedContainer(f"Unknown codec: {header.codec}.")
+
+            journal, transactions = self.read_journal(source, header, header.shard_streams)
+            self.read_shards(source, codec, journal.shards)
+            if journal.digests_stream is not None:
+                for record in source.read_records(journal.digests_stream):
+                    stream, digest = container.decode_digest(record)
+                    journal.digests[digest] = stream
+            for records in transactions:
+                for record in records:
+                    self.replay_record(source, codec, journal, record)
+        except BaseException:
+            source.close()
+            raise
+        self._journal = journal
+        self.replace_source(source)
+        self.share_attachments({stream: digest for digest, stream in journal.digests.items()})
+
+    def open_sqlite(self):
+        """
+        Reads SQLite database, decrypting accounts row by row.
+        """
+
+        storage = SqliteStorage(self.dba_file)
+        try:
+            header = storage.header
+            key = header.data_key(self.key(header.kdf))
+            storage.unlock(key)
+
+            codec = CODECS.get(header.codec)
+            if not codec:
+                raise CorruptedContainer(f"Unknown codec: {header.codec}.")
+
+            for record in storage.records():
+                account = self.decode_account(codec, record, storage)
+                self.accounts[account.accountname] = account
+            digests = storage.digests()
+        except BaseException:
+            storage.close()
+            raise
+
+        self.engine = SQLITE_ENGINE
+        self._data_key = key
+        self.replace_storage(storage)
+        self.share_attachments(digests)
+
+    def share_attachments(self, digests: dict[int, bytes]):
+        """
+        Makes accounts referring to the same stored attachment share one Attachment object
+        and records digests of the attachments read from the file.
+        :param digests: digests of the attachments mapped by their stream ids.
+        """
+
+        shared = {}
+        for account in self.accounts.values():
+            files = account.attached_files
+            for file, attachment in files.items():
+                files[file] = attachment = shared.setdefault(attachment.stream, attachment)
+                if attachment.stream in digests:
+                    attachment._digest = (self._data_key, digests[attachment.stream])
+
+    def read_shards(self, source: StreamSource, codec: Codec, shards: list[int]):
+        """
+        Decrypts and deserializes shards of accounts, several shards are read in parallel.
+        """
+
+        workers = os.cpu_count() or 1
+        if len(shards) == 1:
+            # decrypt segments of the only shard in parallel instead
+            results = [self.read_shard(source, codec, shards[0], workers)]
+        else:
+            with ThreadPoolExecutor(min(workers, len(shards))) as executor:
+                results = executor.map(
+                    lambda stream: self.read_shard(source, codec, stream), shards,
+                )
+
+        for accounts in results:
+            for account in accounts:
+                self.accounts[account.accountname] = account
+
+    def read_shard(
+            self,
+            source: StreamSource,
+            codec: Codec,
+            stream: int,
+            workers: int = 1,
+    ) -> list[Account]:
+        records = source.read_records(stream, workers)
+        return [self.decode_account(codec, record, source) for record in records]
+
+    @staticmethod
+    def decode_account(
+            codec: Codec,
+            record: bytes,
+            source: StreamSource | SqliteStorage,
+    ) -> Account:
+        fields, streams = codec.decode(record)
+        attached_files = {
+            file: Attachment(source=source, stream=stream)
+            for file, stream in streams.items()
+        }
+        return Account(*fields, attached_files=attached_files).intern()
+
+    @staticmethod
+    def read_journal(
+            source: StreamSource,
+            header: Header,
+            shards: list[int],
+    ) -> tuple[Journal, list[list[bytes]]]:
+        """
+        Finds current shards and the transactions that should be replayed over them.
+
+        Transactions are read starting from the last one, until the one listing the shards.
+        :param shards: ids of the streams of shards listed in the header.
+        :return: state of the journal and records of the transactions to replay.
+        """
+
+        journal = Journal(list(shards), index=header.index, digests_stream=header.digests)
+        transactions = sorted(s for s in source.locations if s >= container.TRANSACTIONS)
+        if transactions and not source.locations[transactions[-1]][-1].final:
+            # saving was interrupted before the transaction was written completely
+            transactions.pop()
+
+        pending = []
+        for transaction in reversed(transactions):
+            records = list(source.read_records(transaction))
+            if records and records[0][:1] == container.SHARDS:
+                shards = container.decode_shards(records[0])
+                if len(shards) != len(journal.shards):
+                    raise CorruptedContainer("The journal is damaged.")
+                journal.shards = shards
+                journal.folded = transaction
+                for record in records[1:]:
+                    if record[:1] == container.INDEX:
+                        journal.index = container.decode_stream(record)
+                    elif record[:1] == container.DIGESTS:
+                        journal.digests_stream = container.decode_stream(record)
+                break
+            pending.append(records)
+
+        pending.reverse()
+        return journal, pending
+
+    def replay_record(self, source: StreamSource, codec: Codec, journal: Journal, record: bytes):
+        """
+        Applies change appended to the .dba file by `save_changes` to `accounts`.
+        """
+
+        kind, data = record[:1], record[1:]
+        if kind == container.UPSERT:
+            account = self.decode_account(codec, data, source)
+            self.accounts[account.accountname] = account
+            name = account.accountname
+        elif kind == container.DELETE:
+            name = data.decode()
+            self.accounts.pop(name, None)
+        elif kind == container.ATTACHMENT:
+            stream, digest = container.decode_digest(data)
+            journal.digests[digest] = stream
+            return
+        else:
+            raise CorruptedContainer("Unknown journal record.")
+        journal.dirty.add(container.shard_of(name, len(journal.shards)))
 
     def close(self):
         """
-        Clears `password` and `accounts` fields, effectively closing the database.
+        Clears `password`, `accounts` and the cached keys, effectively closing the database.
         """
 
         self.password = None
         self.accounts = {}
+        self.replace_source(None)
+        self.replace_storage(None)
+        self._key_cache = None
+        self._data_key = None
+        self._journal = None
+        self._saved_revisions = None
 
-    def create(self):
+    def create(
+            self,
+            compression: Compression = Compression(),
+            kdf: KdfParams | None = None,
+            backups: int = 0,
+            engine: str | None = None,
+    ):
         """
         Creates .dba file for database using its name and password.
+
+        The accounts are serialized, compressed and encrypted one by one, so that we never
+        have the whole database serialized in memory. Each attached file is stored in its
+        own stream of the file. The file is replaced atomically, so an existing .dba file
+        is never lost if saving fails.
+        :param compression: compression algorithm and level to use.
+        :param kdf: parameters of key derivation function (e.g. calibrated ones, see
+        core.kdf.calibrate), by default the ones of the current key are reused.
+        :param backups: how many previous versions of the .dba file to keep.
+        :param engine: storage engine to use, see ENGINES, by default the current one.
         """
 
-        with open(self.dba_file, "wb") as file:
-            salt = os.urandom(16)
-            file.write(salt)
+        engine = engine or self.engine
+        if engine not in ENGINES:
+            raise ValueError(f"Unsupported storage engine: {engine}")
+
+        # reuse the salt of the key we already have, so that saving the database
+        # doesn't require running the key derivation function again
+        if kdf is None and self._key_cache and self._key_cache[0] == self.password:
+            kdf = self._key_cache[1]
+        elif kdf is None:
+            kdf = KdfParams(os.urandom(SALT_SIZE))
+        key = self._data_key or os.urandom(container.DATA_KEY_SIZE)
+        wrapped_key = container.wrap_key(self.key(kdf), key)
 
-            data = self.dumps()
-            token = self.encrypt(data, self.password, salt)
-            file.write(token)
+        revisions = self.revisions
+        if engine == SQLITE_ENGINE:
+            self.create_sqlite(compression, kdf, key, wrapped_key, backups)
+        else:
+            self.create_container(compression, kdf, key, wrapped_key, backups)
+        self.engine = engine
+        self._data_key = key
+        self.mark_saved(revisions)
+
+    def create_container(
+            self,
+            compression: Compression,
+            kdf: KdfParams,
+            key: bytes,
+            wrapped_key: bytes,
+            backups: int,
+    ):
+        """
+        Writes accounts to a version 2 .dba file, see `create`.
+        """
+
+        attachments = {
+            id(attachment): attachment
+            for account in self.accounts.values()
+            for attachment in account.attached_files.values()
+        }
+        unique = self.unique_attachments(attachments.values(), key)
+        streams = self.attachment_streams(unique.values(), key)
+        digests = {digest: streams[id(attachment)] for digest, attachment in unique.items()}
+        for attachment in attachments.values():
+            streams[id(attachment)] = digests[attachment.digest(key)]
+
+        # write to a temporary file first, also because attachments that aren't loaded
+        # into memory may be stored in the .dba file we're replacing
+        with atomic_write(self.dba_file, backups) as file:
+            codec = CODECS[DEFAULT_CODEC]
+            shards = container.shard_count(len(self.accounts))
+            header = Header(
+                kdf,
+                codec=codec.name,
+                compression=compression.algorithm,
+                wrapped_key=wrapped_key,
+                shards=[container.SHARD_STREAMS + shard for shard in range(shards)],
+                index=container.INDEX_STREAMS,
+                digests=container.DIGEST_STREAMS,
+                file_id=os.urandom(container.FILE_ID_SIZE),
+            )
+            writer = ContainerWriter(file, key, header, compression.level)
+            # the index goes first, so that it's read right after the header
+            with writer.stream(header.index) as stream:
+                self.write_index(stream)
+            with writer.stream(header.digests) as stream:
+                self.write_digests(stream, digests)
+            for stream_id, accounts in zip(header.shards, self.split_shards(shards)):
+                with writer.stream(stream_id) as stream:
+                    self.write_accounts(stream, codec, accounts, streams)
+
+            for attachment in unique.values():
+                stream_id = streams[id(attachment)]
+                if isinstance(attachment.source, StreamSource) \
+                        and attachment.source.key == key \
+                        and attachment.stream == stream_id \
+                        and attachment.source.header.compression == compression.algorithm:
+                    # the attachment is already compressed the same way
+                    writer.copy_stream(attachment.source, stream_id)
+                    continue
+
+                with writer.stream(stream_id) as stream:
+                    for chunk in attachment.chunks():
+                        stream.write(chunk)
+
+        self._journal = Journal(
+            header.shards,
+            index=header.index,
+            digests_stream=header.digests,
+            digests=digests,
+        )
+
+        source = StreamSource(self.dba_file, key)
+        for attachment in attachments.values():
+            attachment.store(source, streams[id(attachment)])
+        self.replace_source(source)
+        self.replace_storage(None)
+
+    def create_sqlite(
+            self,
+            compression: Compression,
+            kdf: KdfParams,
+            key: bytes,
+            wrapped_key: bytes,
+            backups: int,
+    ):
+        """
+        Writes accounts to SQLite database, see `create`.
+        """
+
+        codec = CODECS[DEFAULT_CODEC]
+        # features of the container don't apply to SQLite databases
+        header = Header(
+            kdf,
+            codec=codec.name,
+            compression=compression.algorithm,
+            wrapped_key=wrapped_key,
+            features=[],
+        )
+        storage = SqliteStorage.create(self.dba_file, header, key)
+        try:
+            with storage.transaction():
+                streams = self.write_rows(storage, self.accounts.values(), compression.level)
+            storage.commit(backups)
+        except BaseException:
+            storage.rollback()
+            raise
+
+        self._journal = None
+        for attachment, stream in streams:
+            attachment.store(storage, stream)
+        self.replace_source(None)
+        self.replace_storage(storage)
+
+    @staticmethod
+    def write_rows(
+            storage: SqliteStorage,
+            accounts: Iterable[Account],
+            level: int,
+    ) -> list[tuple[Attachment, int]]:
+        """
+        Writes accounts to SQLite database, together with their attachments that
+        aren't stored in it yet, content that is already stored isn't written again.
+        :return: the attachments that weren't stored in the database and their ids.
+        """
+
+        codec = CODECS[storage.header.codec]
+        new = []
+        next_stream = storage.next_attachment()
+        for account in accounts:
+            files = {}
+            for file, attachment in account.attached_files.items():
+                if attachment.source is storage:
+                    files[file] = attachment.stream
+                    continue
+
+                digest = attachment.digest(storage.key)
+                stream = storage.find_attachment(digest)
+                if stream is None:
+                    stream = next_stream
+                    storage.add_attachment(
+                        stream, account.accountname, attachment.chunks(), digest, level,
+                    )
+                    next_stream += 1
+                new.append((attachment, stream))
+                files[file] = stream
+
+            record = codec.encode(account, files)
+            storage.upsert(account.accountname, account.email, record, files.values(), level)
+        return new
+
+    def split_shards(self, shards: int) -> list[list[Account]]:
+        """
+        Splits accounts into given number of shards.
+        """
+
+        accounts = [[] for _ in range(shards)]
+        for account in self.accounts.values():
+            accounts[container.shard_of(account.accountname, shards)].append(account)
+        return accounts
+
+    @staticmethod
+    def unique_attachments(
+            attachments: Iterable[Attachment], key: bytes,
+    ) -> dict[bytes, Attachment]:
+        """
+        Finds attachments with distinct content, only they need to be stored.
+
+        Of the attachments with the same content the one stored in a file encrypted with
+        the same key is preferred, so that it can be copied without decompressing it.
+        :return: dict mapping digests of the content to the attachments.
+        """
+
+        unique = {}
+        for attachment in attachments:
+            digest = attachment.digest(key)
+            stored = unique.get(digest)
+            if stored is None or isinstance(attachment.source, StreamSource) \
+                    and attachment.source.key == key \
+                    and not (isinstance(stored.source, StreamSource) and stored.source.key == key):
+                unique[digest] = attachment
+        return unique
+
+    @staticmethod
+    def write_digests(stream: StreamWriter, digests: dict[bytes, int]):
+        """
+        Writes digests of the attachments together with their stream ids to given stream.
+        """
+
+        for digest, stream_id in digests.items():
+            stream.write_record(container.encode_digest(stream_id, digest))
+
+    def write_index(self, stream: StreamWriter):
+        """
+        Writes names of the accounts to given stream.
+        """
+
+        for name in self.accounts:
+            stream.write_record(name.encode())
+
+    @staticmethod
+    def write_accounts(
+            stream: StreamWriter,
+            codec: Codec,
+            accounts: Iterable[Account],
+            streams: dict[int, int],
+    ):
+        """
+        Serializes accounts to given stream.
+        :param streams: dict mapping `id()` of attachments to their stream ids.
+        """
+
+        for account in accounts:
+            files = {
+                file: streams[id(attachment)]
+                for file, attachment in account.attached_files.items()
+            }
+            stream.write_record(codec.encode(account, files))
+
+    @staticmethod
+    def attachment_streams(attachments: Iterable[Attachment], key: bytes) -> dict[int, int]:
+        """
+        Chooses ids of streams to store attachments in.
+
+        Attachments already stored in a file encrypted with the same key keep their stream
+        ids, so that they can be copied to the new file without decompressing them.
+        :return: dict mapping `id()` of the attachments to their stream ids.
+        """
+
+        streams = {}
+        used = {ACCOUNTS_STREAM}
+        new = []
+        for attachment in attachments:
+            # attachments appended by the journal get new ids, so the new file has no journal
+            if attachment.source and attachment.source.key == key \
+                    and attachment.stream < container.INDEX_STREAMS \
+                    and attachment.stream not in used:
+                streams[id(attachment)] = attachment.stream
+                used.add(attachment.stream)
+            else:
+                new.append(attachment)
+
+        next_stream = max(used) + 1
+        for attachment in new:
+            streams[id(attachment)] = next_stream
+            next_stream += 1
+        return streams
+
+    def save_changes(self, compression: Compression = Compression(), backups: int = 0):
+        """
+        Saves changes made to accounts since the database was opened or saved, recording
+        them as a new revision of the history, see `record_history`.
+        :param compression: compression to use.
+        :param backups: how many previous versions of the .dba file to keep when it's
+        re-created, see `write_changes`.
+        """
+
+        if self._saved_revisions is None:
+            changed, deleted = None, []
+        else:
+            _, changed, deleted = self.changes()
+        self.write_changes(compression, backups)
+
+        try:
+            self.record_history(changed, deleted, compression)
+        except Exception:
+            # the database is saved already, failing to record its history shouldn't
+            # look like failing to save it
+            logging.error(traceback.format_exc())
+
+    def write_changes(self, compression: Compression, backups: int):
+        """
+        Writes changes made to accounts since the database was opened or saved.
+
+        Changed and deleted accounts are appended as a transaction to the journal at the end
+        of the .dba file, so that saving takes time proportional to the changes rather than
+        to the size of the database. Once the journal gets bigger than JOURNAL_SIZE_RATIO of
+        the shards it changes, new versions of only those shards are appended (see
+        `fold_journal`). The file is re-created instead when GARBAGE_RATIO of it isn't used
+        anymore, and when the journal can't be used (e.g. for legacy files).
+        :param compression: compression to use, only the level is used when appending
+        to the journal, the algorithm is the one the file already has.
+        :param backups: how many previous versions of the .dba file to keep when it's
+        re-created; appending to the journal keeps no backups, since that would mean
+        copying the whole file.
+        """
+
+        if self.engine == SQLITE_ENGINE:
+            self.save_rows(compression, backups)
+            return
+
+        source = self.journal_source()
+        if not source:
+            self.create(compression, backups=backups)
+            return
+
+        key = self._data_key
+        journal = self._journal
+        revisions, changed, deleted = self.changes()
+        if not changed and not deleted:
+            source.close()
+            return
+
+        attachments = {
+            id(attachment): attachment
+            for account in changed
+            for attachment in account.attached_files.values()
+        }
+        streams = {}
+        new = []
+        for attachment in attachments.values():
+            if self.stored_in(attachment, source):
+                streams[id(attachment)] = attachment.stream
+            else:
+                new.append(attachment)
+
+        next_stream = self.next_stream(
+            source, container.JOURNAL_ATTACHMENTS, container.TRANSACTIONS,
+        )
+
+        codec = CODECS[source.header.codec]
+        # digests of the attachments with new content mapped to their streams
+        added = {}
+        with self.append_to(source, compression) as writer:
+            for attachment in new:
+                digest = attachment.digest(key)
+                if digest in added:
+                    streams[id(attachment)] = added[digest]
+                elif journal.digests.get(digest) in source.locations:
+                    # the same content is already stored in the file
+                    streams[id(attachment)] = journal.digests[digest]
+                else:
+                    streams[id(attachment)] = added[digest] = next_stream
+                    with writer.stream(next_stream) as stream:
+                        for chunk in attachment.chunks():
+                            stream.write(chunk)
+                    next_stream += 1
+
+            with writer.stream(self.next_transaction(source)) as stream:
+                for account in changed:
+                    files = {
+                        file: streams[id(attachment)]
+                        for file, attachment in account.attached_files.items()
+                    }
+                    stream.write_record(container.UPSERT + codec.encode(account, files))
+                for name in deleted:
+                    stream.write_record(container.DELETE + name.encode())
+                for digest, stream_id in added.items():
+                    record = container.encode_digest(stream_id, digest)
+                    stream.write_record(container.ATTACHMENT + record)
+
+        journal.digests.update(added)
+        for name in [account.accountname for account in changed] + deleted:
+            journal.dirty.add(container.shard_of(name, len(journal.shards)))
+        self.mark_saved(revisions)
+
+        source.close()
+        source = StreamSource(self.dba_file, key)
+        for attachment in new:
+            attachment.store(source, streams[id(attachment)])
+        self.replace_source(source)
+
+        unfolded = sum(
+            source.stream_size(stream)
+            for stream in source.locations
+            if stream > journal.folded
+        )
+        dirty = sum(source.stream_size(journal.shards[shard]) for shard in journal.dirty)
+        if unfolded > JOURNAL_SIZE_RATIO * dirty:
+            self.fold_journal(source, compression)
+
+    def changes(self) -> tuple[dict[str, int], list[Account], list[str]]:
+        """
+        :return: current revisions of the accounts, accounts changed and names of accounts
+        deleted since the database was opened or saved.
+        """
+
+        revisions = self.revisions
+        changed = [
+            self.accounts[name]
+            for name, revision in revisions.items()
+            if self._saved_revisions.get(name) != revision
+        ]
+        deleted = [name for name in self._saved_revisions if name not in revisions]
+        return revisions, changed, deleted
+
+    def save_rows(self, compression: Compression, backups: int):
+        """
+        Saves changes of SQLite database, only rows of changed and deleted accounts
+        are written. The database is re-created when it isn't the one we opened.
+        """
+
+        storage = self._storage
+        if storage is None or self._saved_revisions is None \
+                or not storage.is_file(self.dba_file):
+            self.create(compression, backups=backups)
+            return
+
+        revisions, changed, deleted = self.changes()
+        with storage.transaction():
+            new = self.write_rows(storage, changed, compression.level)
+            for name in deleted:
+                storage.delete(name)
+
+            # attachments no longer used by any account, the content of an attachment
+            # can be shared by several accounts, so all of them are checked
+            used = {
+                attachment.stream
+                for account in self.accounts.values()
+                for attachment in account.attached_files.values()
+                if attachment.source is storage
+            }
+            used.update(stream for _, stream in new)
+            storage.delete_attachments(storage.digests().keys() - used)
+
+        self.mark_saved(revisions)
+        for attachment, stream in new:
+            attachment.store(storage, stream)
+
+    def fold_journal(self, source: StreamSource, compression: Compression):
+        """
+        Appends new versions of the shards changed by the journal and a transaction
+        listing all shards, so that the journal before it isn't replayed anymore.
+
+        Must be called right after saving, when `accounts` are the same as in the file.
+        """
+
+        journal = self._journal
+        shards = self.split_shards(len(journal.shards))
+        attachments = [
+            attachment
+            for shard in journal.dirty
+            for account in shards[shard]
+            for attachment in account.attached_files.values()
+        ]
+        if not all(self.stored_in(attachment, source) for attachment in attachments):
+            self.create(compression)
+            return
+
+        next_stream = self.next_stream(
+            source, container.SHARD_STREAMS, container.JOURNAL_ATTACHMENTS,
+        )
+        streams = {id(attachment): attachment.stream for attachment in attachments}
+        new_shards = list(journal.shards)
+        index = digests = None
+        if journal.index is not None:
+            index = self.next_stream(source, container.INDEX_STREAMS, container.DIGEST_STREAMS)
+        if journal.digests_stream is not None:
+            digests = self.next_stream(source, container.DIGEST_STREAMS, container.SHARD_STREAMS)
+
+        codec = CODECS[source.header.codec]
+        transaction = self.next_transaction(source)
+        with self.append_to(source, compression) as writer:
+            for shard in sorted(journal.dirty):
+                with writer.stream(next_stream) as stream:
+                    self.write_accounts(stream, codec, shards[shard], streams)
+                new_shards[shard] = next_stream
+                next_stream += 1
+
+            if index is not None:
+                with writer.stream(index) as stream:
+                    self.write_index(stream)
+            if digests is not None:
+                with writer.stream(digests) as stream:
+                    self.write_digests(stream, journal.digests)
+
+            with writer.stream(transaction) as stream:
+                stream.write_record(container.encode_shards(new_shards))
+                if index is not None:
+                    stream.write_record(container.encode_stream(container.INDEX, index))
+                if digests is not None:
+                    stream.write_record(container.encode_stream(container.DIGESTS, digests))
+
+        self._journal = Journal(
+            new_shards,
+            folded=transaction,
+            index=index,
+            digests_stream=digests,
+            digests=journal.digests,
+        )
+
+    @contextmanager
+    def append_to(
+            self,
+            source: StreamSource,
+            compression: Compression,
+    ) -> Iterator[ContainerWriter]:
+        """
+        Context manager to append streams to the .dba file.
+        """
+
+        with open(self.dba_file, "r+b") as file:
+            # drop whatever was left by interrupted saving
+            file.truncate(source.end)
+            file.seek(source.end)
+            yield ContainerWriter(
+                file, self._data_key, source.header, compression.level, append=True,
+            )
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def next_transaction(source: StreamSource) -> int:
+        transactions = [s for s in source.locations if s >= container.TRANSACTIONS]
+        return max(transactions, default=container.TRANSACTIONS - 1) + 1
+
+    @staticmethod
+    def next_stream(source: StreamSource, first: int, end: int) -> int:
+        """
+        :return: id for a new stream from the range of ids [first, end).
+        """
+
+        streams = [stream for stream in source.locations if first <= stream < end]
+        return max(streams, default=first - 1) + 1
+
+    def replace_source(self, source: StreamSource | None):
+        """
+        Makes attachments of the .dba file read from `source`, closing the previous source.
+
+        Appending to the file doesn't change the streams that are already there, so
+        attachments still read from the previous source of the same file are moved to
+        the new one. The previous source is kept open if some of them can't be moved
+        (e.g. the file was replaced by another one meanwhile).
+        """
+
+        old, self._source = self._source, source
+        if old is None or old is source:
+            return
+
+        same_file = source is not None and source.key == old.key and old.is_file(self.dba_file)
+        for account in self.accounts.values():
+            for attachment in account.attached_files.values():
+                if attachment.source is not old:
+                    continue
+                if not same_file:
+                    return
+                attachment.source = source
+        old.close()
+
+    def replace_storage(self, storage: SqliteStorage | None):
+        """
+        Makes the database use `storage`, closing connection of the previous one unless
+        some attachments are still read from it (see `replace_source`).
+        """
+
+        old, self._storage = self._storage, storage
+        if old is None or old is storage:
+            return
+
+        for account in self.accounts.values():
+            for attachment in account.attached_files.values():
+                if attachment.source is old:
+                    return
+        old.close()
+
+    def stored_in(self, attachment: Attachment, source: StreamSource) -> bool:
+        """
+        Checks whether the attachment is stored in the file `source` reads from.
+        """
+
+        return attachment.source is not None and attachment.source.key == source.key \
+            and attachment.source.is_file(self.dba_file) \
+            and attachment.stream in source.locations
+
+    def journal_source(self) -> StreamSource | None:
+        """
+        Opens the .dba file to append changes to its journal.
+        :return: None if the journal can't be used and the file should be re-created.
+        """
+
+        if self._saved_revisions is None or self._data_key is None \
+                or self._journal is None or not self.dba_file.exists():
+            return None
+        with open(self.dba_file, "rb") as file:
+            if detect_format(file) != CONTAINER_FORMAT:
+                return None
+
+        source = StreamSource(self.dba_file, self._data_key)
+        journal_complete = all(
+            locations[-1].final
+            for stream, locations in source.locations.items()
+            if stream >= container.TRANSACTIONS
+        )
+        try:
+            # the file may have been replaced by another one since we opened it
+            header = source.header
+            same_key = header.data_key(self.key(header.kdf)) == self._data_key
+        except CorruptedContainer:
+            same_key = False
+
+        if not same_key or not journal_complete \
+                or self.garbage(source) > GARBAGE_RATIO * source.end:
+            source.close()
+            return None
+        return source
+
+    def garbage(self, source: StreamSource) -> int:
+        """
+        :return: size in bytes of the streams of the file that aren't used anymore
+        (e.g. old versions of shards).
+        """
+
+        used = set(self._journal.shards)
+        used.add(self._journal.index)
+        used.add(self._journal.digests_stream)
+        used.update(s for s in source.locations if s > self._journal.folded)
+        used.update(
+            attachment.stream
+            for account in self.accounts.values()
+            for attachment in account.attached_files.values()
+            if self.stored_in(attachment, source)
+        )
+        return sum(source.stream_size(stream) for stream in source.locations if stream not in used)
+
+    def deduplication(self) -> Deduplication:
+        """
+        Computes how much space is saved by storing attachments with the same content once.
+        """
+
+        # the key only needs to be the same for all attachments, a database that
+        # wasn't opened or created yet doesn't have one
+        key = self._data_key or os.urandom(32)
+        sizes = {}
+        attachments = size = 0
+        for account in self.accounts.values():
+            for attachment in account.attached_files.values():
+                digest = attachment.digest(key)
+                if digest not in sizes:
+                    sizes[digest] = attachment.size()
+                attachments += 1
+                size += sizes[digest]
+        return Deduplication(attachments, len(sizes), size, sum(sizes.values()))
+
+    @property
+    def history_file(self) -> Path:
+        return core.SRC_DIR / f"{self.name}.history"
+
+    def history(self) -> History:
+        """
+        Opens revision history of the database, see core.history.
+        :raises ValueError: if the database wasn't saved in the current format yet, so
+        it has no data key to encrypt the history with.
+        """
+
+        if self._data_key is None:
+            raise ValueError("The database has no history yet.")
+        return History(self.history_file, self._data_key)
+
+    def corrupt_history_files(self) -> list[Path]:
+        """
+        :return: histories that couldn't be read, moved aside by `record_history`.
+        """
+
+        files = []
+        path = self.history_file.with_name(f"{self.name}.history.corrupt")
+        while path.exists():
+            files.append(path)
+            path = self.history_file.with_name(f"{self.name}.history.corrupt.{len(files)}")
+        return files
+
+    def corrupt_history_file(self) -> Path:
+        """
+        :return: path to move the history that can't be read to, so that it isn't lost.
+        """
+
+        number = len(self.corrupt_history_files())
+        suffix = f".{number}" if number else ""
+        return self.history_file.with_name(f"{self.name}.history.corrupt{suffix}")
+
+    def files(self) -> list[Path]:
+        """
+        :return: existing files of the database: the .dba file, its backups (see
+        core.file_utils.rotate_backups), the history and the histories that couldn't be read.
+        """
+
+        files = [self.dba_file, *backup_files(self.dba_file), self.history_file]
+        return [path for path in files if path.exists()] + self.corrupt_history_files()
+
+    def record_history(
+            self,
+            changed: list[Account] | None,
+            deleted: list[str],
+            compression: Compression = Compression(),
+    ) -> Revision | None:
+        """
+        Appends changed and deleted accounts to the history as a new revision. Every
+        CHECKPOINT_INTERVAL revisions (see core.history) all accounts are recorded instead,
+        then the revisions before the last KEEP_CHECKPOINTS checkpoints are dropped.
+        :param changed: accounts changed by the save, None if it isn't known what changed.
+        :param deleted: names of the accounts deleted by the save.
+        :return: the recorded revision, None if nothing changed.
+        """
+
+        history = None
+        try:
+            history = self.history()
+            history.revisions()
+        except CorruptedContainer:
+            # none of the history can be read, e.g. it was written with another data key;
+            # damaged revisions are only skipped, see `History.revisions`
+            if history:
+                history.close()
+            corrupt = self.corrupt_history_file()
+            logging.warning(
+                f"Starting new history of {self.name}, the old one can't be read and is "
+                f"moved to {corrupt}."
+            )
+            os.replace(self.history_file, corrupt)
+            history = self.history()
+
+        number, checkpoint = history.next_revision()
+        if checkpoint or changed is None:
+            revision = Revision(number, time.time(), True, list(self.accounts), [])
+            changed = list(self.accounts.values())
+        elif changed or deleted:
+            names = [account.accountname for account in changed]
+            revision = Revision(number, time.time(), False, names, deleted)
+        else:
+            history.close()
+            return None
+
+        codec = history.codec
+        with history.append(compression) as writer:
+            accounts = [
+                (account, {
+                    file: writer.attachment(attachment.digest(self._data_key), attachment.chunks)
+                    for file, attachment in account.attached_files.items()
+                })
+                for account in changed
+            ]
+            records = itertools.chain(
+                (container.UPSERT + codec.encode(account, files) for account, files in accounts),
+                (container.DELETE + name.encode() for name in deleted),
+            )
+            writer.revision(revision, records)
+        if revision.checkpoint:
+            history.prune()
+        history.close()
+        return revision
+
+    def revision_accounts(self, number: int) -> Accounts:
+        """
+        Reads accounts the database had at given revision of its history.
+        :raises KeyError: if there is no such revision.
+        """
+
+        history = self.history()
+        codec = history.codec
+        accounts = {}
+        for record in history.records(number):
+            kind, data = record[:1], record[1:]
+            if kind == container.UPSERT:
+                account = self.decode_account(codec, data, history.source)
+                accounts[account.accountname] = account
+            else:
+                accounts.pop(data.decode(), None)
+        return accounts
+
+    def restore(self, number: int):
+        """
+        Replaces accounts with the ones the database had at given revision of its history.
+        Like any other change, it's written to disk once the database is saved.
+        :raises KeyError: if there is no such revision.
+        """
+
+        self.accounts = self.revision_accounts(number)
+
+    def restore_account(self, number: int, name: str):
+        """
+        Replaces account with the one the database had at given revision of its history.
+        :raises KeyError: if there is no such revision or the account didn't exist then.
+        """
+
+        accounts = self.revision_accounts(number)
+        if name not in accounts:
+            raise KeyError(f"There is no account {name} in revision {number}.")
+        self.accounts[name] = accounts[name]
 
     def rename(self, name: str):
         """
-        Renames .dba file associated with this Database instance.
+        Renames .dba file associated with this Database instance, together with its
+        backups and history (see `files`).
         :param name: new database name.
         """
 
+        files = [path for path in self.files() if path != self.dba_file]
         self.dba_file.rename(core.SRC_DIR / f"{name}.dba")
+        for path in files:
+            path.rename(path.with_name(name + path.name.removeprefix(self.name)))
         self.name = name
 
-    def save(self, name: str, password: str, accounts: Accounts) -> "Database":
+    def delete(self):
+        """
+        Deletes .dba file of the database together with its backups and history.
         """
-        Deletes old database and creates new one, i.e. it replaces
-        old database with a new one.
+
+        files = [path for path in self.files() if path != self.dba_file]
+        self.dba_file.unlink()
+        for path in files:
+            path.unlink(missing_ok=True)
+
+    def change_password(
+            self,
+            password: str,
+            compression: Compression = Compression(),
+            kdf: KdfParams | None = None,
+    ):
+        """
+        Changes password of the .dba file associated with this Database instance.
+
+        Version 2 and SQLite files aren't re-encrypted, only the data key in their header is wrapped
+        with a key derived from the new password (see `container.replace_header`), the file
+        and its streams stay the same, so attachments are still read from it. Note, that
+        the data key stays the same, so a copy of the old file together with the old
+        password are enough to decrypt the new file.
+
+        Legacy files are converted to version 2, keeping the accounts they have on disk.
+        :param password: new password for the database.
+        :param compression: compression to use when converting legacy file.
+        :param kdf: parameters of key derivation function for the new password.
+        """
+
+        kdf = kdf or KdfParams(os.urandom(SALT_SIZE))
+
+        with open(self.dba_file, "rb") as file:
+            file_format = detect_format(file)
+            sqlite = file_format == SQLITE_FORMAT
+            legacy = file_format == LEGACY_FORMAT
+            header = None if legacy or sqlite else container.read_header(file)
+        storage = SqliteStorage(self.dba_file) if sqlite else None
+        if storage:
+            header = storage.header
+
+        if legacy:
+            disk_db = Database(self.name, _key_cache=self._key_cache)
+            disk_db.open(self.password)
+            disk_db.password = password
+            disk_db.create(compression, kdf)
+            data_key, key_cache = disk_db._data_key, disk_db._key_cache
+            disk_db.close()
+        else:
+            data_key = header.data_key(self.key(header.kdf))
+            key = kdf.derive(password)
+            header.kdf = kdf
+            header.wrapped_key = container.wrap_key(key, data_key)
+            if storage:
+                storage.replace_header(header)
+                storage.close()
+            else:
+                container.replace_header(self.dba_file, header)
+            key_cache = (password, kdf, key)
+
+        self.password = password
+        self._key_cache = key_cache
+        self._data_key = data_key
+
+    def save(
+            self,
+            name: str,
+            password: str,
+            accounts: Accounts,
+            compression: Compression = Compression(),
+    ) -> "Database":
+        """
+        Replaces old database with a new one, renaming the old one first if the name
+        changed, so that its backups and history are kept (see `rename`).
 
         :param name: new name for the database.
         :param password: new password for the database.
         :param accounts: new `accounts` dict for the database.
+        :param compression: compression algorithm and level to use.
         """
 
-        self.dba_file.unlink()
-        db = Database(name, password, accounts)
-        db.create()
+        if name != self.name:
+            self.rename(name)
+        db = Database(
+            name,
+            password,
+            accounts,
+            engine=self.engine,
+            _key_cache=self._key_cache,
+            _data_key=self._data_key,
+        )
+        db.create(compression)
         return db
 
 
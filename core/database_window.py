@@ -16,16 +16,18 @@
 import logging
 import os
 import traceback
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable
 
-from gi.repository import Gdk, Gtk, GdkPixbuf
+from gi.repository import Gdk, Gtk, GdkPixbuf, GLib
 
+from core.backup import auto_backup
 from core.create_account import CreateAccount
 from core.database_utils import Database, AccountClipboard
 from core.display_account import DisplayAccount
 from core.edit_account import EditAccount
 from core.gtk_utils import (
     GladeTemplate,
+    Task,
     load_icon,
     abc_list_sort,
     add_list_item,
@@ -46,8 +48,12 @@ CONFIRM_QUIT = (
     "Are you sure you want to close the database?\n"
     "Any unsaved changes will be lost!"
 )
+SAVING_DB = "Saving the database..."
 SUCCESS_DB_SAVED = "Database saved successfully!"
 ERROR_DB_SAVE = "Error saving the database!"
+LOADING_ACCOUNTS = "Loading accounts..."
+DB_BEING_WRITTEN = "Please wait until the database is saved."
+ERROR_DB_LOADING = "Error loading the database!"
 
 SUCCESS_CUTTING_ACCOUNTS = "Cut account(s)."
 SUCCESS_COPYING_ACCOUNTS = "Copied account(s)."
@@ -79,12 +85,27 @@ class DatabaseWindow(Window):
         )
     ]
 
-    def __init__(self, database: Database, main_window: "MainWindow"):
+    def __init__(
+            self,
+            database: Database,
+            main_window: "MainWindow",
+            names: Iterable[str] | None = None,
+    ):
+        """
+        :param names: names of the accounts read from the index of the database,
+        when given, the accounts are loaded in background (see `Database.read_index`).
+        """
+
         GladeTemplate.__init__(self, "database_window")
         Window.__init__(self)
 
         self.main_window = main_window
         self.database = database
+        self.save_task: Task | None = None
+        self.load_task: Task | None = None
+        self.loading = names is not None
+        # the database is being written in background, see `set_writing`
+        self.writing = False
 
         self.config = main_window.config
         self.load_separator()
@@ -111,8 +132,10 @@ class DatabaseWindow(Window):
             self.on_save,
         )
 
-        self.load_accounts()
+        self.load_accounts(names)
         self.title = database.name
+        if self.loading:
+            self.start_loading()
 
     def keypress(self, _, event: Gdk.EventKey):
         """ Allow selecting multiple accounts when Ctrl or Shift is held. """
@@ -132,6 +155,8 @@ class DatabaseWindow(Window):
             self.shift_held = False
 
     def on_account_right_click(self, _, event: Gdk.EventButton):
+        if self.loading or self.writing:
+            return
         if event.button == Gdk.BUTTON_SECONDARY and event.type == Gdk.EventType.BUTTON_PRESS:
             menu = Gtk.Menu()
 
@@ -172,6 +197,10 @@ class DatabaseWindow(Window):
         if clipboard.db_window == self:
             self.main_window.account_clipboard = None
             return
+        if clipboard.is_cut and clipboard.db_window.writing:
+            # the cut accounts would be deleted from the database while it's written
+            self.statusbar.warning(DB_BEING_WRITTEN)
+            return
 
         for name in clipboard.account_names:
             if name in self.database.accounts:
@@ -181,7 +210,9 @@ class DatabaseWindow(Window):
                 else:
                     continue
 
-            account = clipboard.db_window.database.accounts[name]
+            # the copy doesn't depend on the .dba file of the other database, which is
+            # closed along with it
+            account = clipboard.db_window.database.accounts[name].copy()
             CreateAccount.create_account(account, self)
             if clipboard.is_cut:
                 clipboard.db_window.delete_account(name)
@@ -208,18 +239,54 @@ class DatabaseWindow(Window):
         prefix = '' if self.database.saved else '*'
         self.title = f"{prefix}{self.database.name}"
 
-    def load_accounts(self):
+    def load_accounts(self, names: Iterable[str] | None = None):
         """
         Populates accounts_list with items.
+        :param names: names of the accounts, by default the ones of the database.
         """
 
         self.accounts_list.sort_func = abc_list_sort
-        for account_name in self.database.accounts:
+        if names is None:
+            names = self.database.accounts
+        for account_name in names:
             icon = self.load_account_icon(account_name)
             item = add_list_item(self.accounts_list, icon.pixbuf, account_name)
             item.add_events(Gdk.EventMask.POINTER_MOTION_MASK)
             item.connect("motion-notify-event", self.on_account_motion)
 
+    def start_loading(self):
+        """
+        Loads the accounts in background, the actions that need them are disabled
+        until they're loaded.
+        """
+
+        self.menubar_toolbar.sensitive = False
+        self.statusbar.message(LOADING_ACCOUNTS)
+        self.load_task = Task(
+            self.database.open,
+            self.database.password,
+            on_done=self.on_accounts_loaded,
+            on_error=self.on_load_error,
+        )
+
+    def on_accounts_loaded(self, _):
+        self.loading = False
+        self.menubar_toolbar.sensitive = True
+        self.statusbar.clear()
+
+        # show the account that was selected while loading
+        row = self.accounts_list.selected_row
+        if row:
+            self.on_account_selected(self.accounts_list, row)
+
+    def on_load_error(self, err: Exception):
+        logging.error("".join(traceback.format_exception(err)))
+        self.statusbar.clear()
+        ErrorDialog(ERROR_DB_LOADING, err).run()
+        self.loading = False
+        self.database.close()
+        self.destroy()
+
     def load_account_icon(self, accountname: str):
         """
         Returns account icon associated with given [accountname].
@@ -235,20 +302,51 @@ class DatabaseWindow(Window):
                 return Gtk.Image.new_from_pixbuf(pixbuf)
         return icon
 
+    def set_writing(self, writing: bool):
+        """
+        Disables the actions that change the accounts while the database is written in
+        background, so that it isn't changed halfway through writing it.
+        """
+
+        self.writing = writing
+        self.menubar_toolbar.sensitive = not writing
+        self.form_box.sensitive = not writing
+
+    def save_database(self):
+        """
+        Saves changes of the database to its .dba file, then backs up SRC_DIR if
+        automatic backups are enabled (see core.backup).
+        """
+        self.database.save_changes(self.config.get_compression(), self.config.backups)
+        auto_backup()
+
     def on_save(self, *args):
         """
-        Saves database to disk.
+        Saves database to disk in background.
         On success displays success message in statusbar, on error – error message.
         """
 
-        try:
-            self.database.dba_file.unlink(missing_ok=True)
-            self.database.create()
-            self.statusbar.success(SUCCESS_DB_SAVED)
-            self.check_db_saved()
-        except Exception as err:
-            logging.error(traceback.format_exc())
-            ErrorDialog(ERROR_DB_SAVE, err).run()
+        if self.loading or self.writing:
+            return
+
+        self.set_writing(True)
+        self.statusbar.message(SAVING_DB)
+        self.save_task = Task(
+            self.save_database,
+            on_done=self.on_saved,
+            on_error=self.on_save_error,
+        )
+
+    def on_saved(self, _):
+        self.set_writing(False)
+        self.statusbar.success(SUCCESS_DB_SAVED)
+        self.check_db_saved()
+
+    def on_save_error(self, err: Exception):
+        self.set_writing(False)
+        logging.error("".join(traceback.format_exception(err)))
+        self.statusbar.clear()
+        ErrorDialog(ERROR_DB_SAVE, err).run()
 
     def do_delete_event(self, event):
         """
@@ -263,6 +361,21 @@ class DatabaseWindow(Window):
         :returns: True to prevent quiting and False to allow it.
         """
 
+        if self.loading:
+            # nothing could have been changed yet, but the database can't be interrupted
+            # while it's being opened, so we close it as soon as it's done
+            self.load_task.cancel()
+            self.load_task.future.add_done_callback(
+                lambda _: GLib.idle_add(self.close_database),
+            )
+            return False
+
+        if self.writing and not (self.save_task and self.save_task.running):
+            # the database is being edited (see EditDatabase), closing it meanwhile
+            # would interfere with the password change or renaming
+            self.statusbar.warning(DB_BEING_WRITTEN)
+            return True
+
         if self.database.saved:
             response = Gtk.ResponseType.OK
         else:
@@ -279,16 +392,36 @@ class DatabaseWindow(Window):
         if response == Gtk.ResponseType.CANCEL:
             return True
 
+        if self.save_task and self.save_task.running:
+            # let the save that's in progress finish before closing the database
+            try:
+                self.save_task.wait()
+            except Exception as err:
+                self.on_save_error(err)
+                return True
+            finally:
+                self.save_task.cancel()
+
         if response == Gtk.ResponseType.ACCEPT:
-            self.on_save()
+            try:
+                self.save_database()
+            except Exception as err:
+                self.on_save_error(err)
+                return True
+
+        self.close_database()
+        return False
+
+    def close_database(self):
+        """
+        Closes the database and hides EditDatabase form if the database is being edited.
+        """
 
         self.database.close()
         for db in self.main_window.databases:
             if db.name == self.database.name:
                 db.close()
 
-        # hide EditDatabase form if the database we're closing
-        # is being edited
         if self.main_window.form_box.children:
             form = self.main_window.form_box.children[0]
             if all((
@@ -297,8 +430,6 @@ class DatabaseWindow(Window):
             )):
                 form.destroy()
 
-        return False
-
     def on_account_selected(self, _, row: Gtk.ListBoxRow):
         # when an account is selected and Ctrl is not held,
         # set accounts_list's selection mode to SINGLE
@@ -308,6 +439,9 @@ class DatabaseWindow(Window):
             # so here we select the row again
             self.accounts_list.select_row(row)
 
+        if self.loading:
+            # the account is displayed once it's loaded, see `on_accounts_loaded`
+            return
         account = self.database.accounts[item_name(row)]
         self.show_form(DisplayAccount(account, self))
 
@@ -13,16 +13,14 @@
 #
 #  You should have received a copy of the GNU General Public License
 #  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
-import base64
 import logging
 import platform
 import traceback
-from pathlib import Path
 from typing import TYPE_CHECKING
 
 from gi.repository import Gtk, Gdk
 
-from core.database_utils import Account
+from core.database_utils import Account, Attachment
 from core.gtk_utils import GladeTemplate, abc_list_sort, item_name
 from core.widgets import AttachedFilesMixin, ErrorDialog
 
@@ -124,18 +122,16 @@ class DisplayAccount(GladeTemplate, AttachedFilesMixin):
         self.database_window.main_window.safe_clipboard = self.account.notes
         self.database_window.statusbar.success(SUCCESS_NOTES_COPY)
 
-    def save_attached_file(self, path: str, content: str):
+    def save_attached_file(self, path: str, attachment: Attachment):
         """
         Saves given attached file handling all errors.
 
         :param path: where to save the file.
-        :param content: file content to save.
+        :param attachment: attached file to save.
         """
 
         try:
-            data = content.encode()
-            content = base64.b64decode(data)
-            Path(path).write_bytes(content)
+            attachment.save(path)
             self.database_window.statusbar.success(SUCCESS_SAVING_FILE)
         except Exception as err:
             logging.error(traceback.format_exc())
@@ -18,7 +18,7 @@ import typing
 from gi.repository import Gtk
 
 from core.create_account import CreateAccount
-from core.database_utils import Account, Database
+from core.database_utils import Account, Attachment, Database
 from core.gtk_utils import delete_list_item
 from core.widgets import AttachedFilesMixin
 
@@ -85,19 +85,19 @@ class EditAccount(CreateAccount, AttachedFilesMixin):
         self.notes.buffer.text = self.account.notes
         self.load_attached_files(self.account.attached_files)
 
-    def build_account(self) -> Account:
+    def build_account(self, attached_files: dict[str, Attachment]) -> Account:
         """
         Creates account using form data.
         """
 
-        account = super().build_account()
+        account = super().build_account(attached_files)
         for filename, path in self.attached_paths.items():
             if path is None:
                 content = self.account.attached_files[filename]
                 account.attached_files[filename] = content
         return account
 
-    def on_apply(self, _=None):
+    def apply_account(self, attached_files: dict[str, Attachment]):
         """
         Saves changes done to account.
         """
@@ -107,4 +107,4 @@ class EditAccount(CreateAccount, AttachedFilesMixin):
             self.database_window.accounts_list,
             self.account.accountname,
         )
-        super().on_apply()
+        super().apply_account(attached_files)
@@ -17,11 +17,13 @@ import logging
 import traceback
 import typing
 
-from gi.repository import Gtk, GdkPixbuf
+from gi.repository import Gtk
 
 from core.create_database import CreateDatabase
+from core import kdf
 from core.database_utils import Database
-from core.gtk_utils import delete_list_item, add_list_item
+from core.database_window import DB_BEING_WRITTEN, DatabaseWindow
+from core.gtk_utils import Task
 from core.widgets import ErrorDialog
 
 if typing.TYPE_CHECKING:
@@ -56,41 +58,81 @@ class EditDatabase(CreateDatabase):
     def __init__(self, database: Database, main_window: "MainWindow"):
         super().__init__(main_window)
         self.database = database
+        # old and new name of the database, see `MainWindow.pending_renames`
+        self.pending_rename: tuple[str, str] | None = None
         self.title.markup = EDIT_DB_TITLE.format(database.name)
 
         self.name.text = database.name
         self.password.text = database.password
         self.repeat_password.text = database.password
 
+    @property
+    def db_window(self) -> DatabaseWindow | None:
+        """
+        Window of the database if it's opened.
+        """
+
+        if not self.database.opened:
+            return None
+        return self.main_window.windows.get(self.database.name)
+
     def on_apply(self, _=None):
         """
-        Applies changes to database using form data.
+        Applies changes to database in background using form data, the window of the
+        database can't change it meanwhile (see `DatabaseWindow.set_writing`).
         """
 
-        try:
-            db = self.database.save(
-                self.name.text,
-                self.password.text,
-                self.database.accounts,
-            )
-        except Exception as err:
-            logging.error(traceback.format_exc())
-            ErrorDialog(ERROR_EDITING_DB, err).run()
+        win = self.db_window
+        if win and win.writing:
+            self.main_window.statusbar.warning(DB_BEING_WRITTEN)
             return
 
-        self.main_window.databases.remove(self.database)
-        self.main_window.databases.append(db)
-        self.main_window.databases.sort(key=lambda db: db.name)
+        self.apply.sensitive = False
+        if win:
+            win.set_writing(True)
+        # so that the events of the renaming aren't taken for a rename by another program
+        self.pending_rename = (self.database.name, self.name.text)
+        self.main_window.pending_renames.add(self.pending_rename)
+        Task(
+            self.edit_database,
+            self.name.text,
+            self.password.text,
+            on_done=self.on_database_edited,
+            on_error=self.on_apply_error,
+        )
+
+    def edit_database(self, name: str, password: str) -> str:
+        """
+        Changes password and name of the database.
 
-        delete_list_item(self.main_window.db_list, self.database.name)
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale("img/icon.svg", 50, 50, True)
-        add_list_item(self.main_window.db_list, pixbuf, db.name)
+        Neither of them requires re-encrypting the accounts, the password change
+        replaces only the header of the .dba file.
+        :return: old name of the database.
+        """
 
-        self.destroy()
-        win = self.main_window.windows[self.database.name]
-        del self.main_window.windows[self.database.name]
-        self.main_window.windows[db.name] = win
+        old_name = self.database.name
+        if password != self.database.password:
+            compression = self.main_window.config.get_compression()
+            self.database.change_password(password, compression, kdf.calibrate())
+        if name != old_name:
+            self.database.rename(name)
+        return old_name
+
+    def on_apply_error(self, err: Exception):
+        self.main_window.pending_renames.discard(self.pending_rename)
+        logging.error("".join(traceback.format_exception(err)))
+        if self.db_window:
+            self.db_window.set_writing(False)
+        ErrorDialog(ERROR_EDITING_DB, err).run()
+        self.apply.sensitive = True
+
+    def on_database_edited(self, old_name: str):
+        """
+        Updates databases list and the window of the database.
+        """
 
-        win.title = db.name
-        win.database.name = db.name
-        win.database.password = db.password
+        self.main_window.pending_renames.discard(self.pending_rename)
+        self.main_window.database_renamed(old_name, self.database)
+        if self.db_window:
+            self.db_window.set_writing(False)
+        self.destroy()
@@ -0,0 +1,141 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Helpers to write files without losing their previous content on crashes.
+"""
+
+import os
+import secrets
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    import msvcrt
+    fcntl = None
+
+
+@contextmanager
+def atomic_write(path: str | os.PathLike, backups: int = 0) -> Iterator[BinaryIO]:
+    """
+    Context manager to replace a file atomically.
+
+    The content is written to a temporary file in the same directory, which is flushed
+    to disk and then renamed over `path`. So if anything goes wrong (a crash, full disk)
+    `path` keeps either its old or its new content. On errors the temporary file is removed.
+    The temporary file has a unique name ending with `.tmp`, so that several writers of
+    the same file don't mix their content.
+    :param backups: how many previous versions of the file to keep, see `rotate_backups`.
+    """
+
+    path = Path(path)
+    tmp_file = path.with_name(f"{path.name}.{secrets.token_hex(4)}.tmp")
+    try:
+        with open(tmp_file, "wb") as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+
+    rotate_backups(path, backups)
+    os.replace(tmp_file, path)
+    fsync_directory(path.parent)
+
+
+def rotate_backups(path: Path, backups: int):
+    """
+    Keeps current version of the file as `<name>.1`, shifting older versions to
+    `<name>.2`, `<name>.3` and so on, at most `backups` versions are kept.
+
+    The file itself stays in place, so that it can be atomically replaced afterwards.
+    """
+
+    if backups <= 0 or not path.exists():
+        return
+
+    versions = [path.with_name(f"{path.name}.{number}") for number in range(1, backups + 1)]
+    versions[-1].unlink(missing_ok=True)
+    for newer, older in reversed(list(zip(versions, versions[1:]))):
+        if newer.exists():
+            os.replace(newer, older)
+
+    try:
+        os.link(path, versions[0])
+    except OSError:
+        # the file system doesn't support hard links
+        shutil.copy2(path, versions[0])
+
+
+@contextmanager
+def locked(path: Path) -> Iterator[None]:
+    """
+    Context manager holding an exclusive lock of given file (it's created if it doesn't
+    exist), so that processes and threads using the same lock file take turns.
+    """
+
+    with open(path, "a+b") as file:
+        if fcntl:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            while True:
+                try:
+                    # retries for 10 seconds before giving up
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def backup_files(path: Path) -> list[Path]:
+    """
+    :return: previous versions of the file kept by `rotate_backups`, newest first.
+    """
+
+    prefix = f"{path.name}."
+    backups = [
+        file
+        for file in path.parent.iterdir()
+        if file.name.startswith(prefix) and file.name[len(prefix):].isdigit()
+    ]
+    return sorted(backups, key=lambda file: int(file.name[len(prefix):]))
+
+
+def fsync_directory(path: Path):
+    """
+    Flushes directory entries (e.g. after renaming a file in it) to disk.
+    """
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -24,8 +24,9 @@ import contextlib
 import logging
 import time
 import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntEnum
-from typing import Callable
+from typing import Any, Callable
 
 from gi.repository import GObject, Gtk, Gio, GdkPixbuf, GLib
 
@@ -236,9 +237,27 @@ def get_mime_icon(path: str) -> Gtk.Image:
 
     file = Gio.File.new_for_path(path)
     info = file.query_info("standard::*", Gio.FileQueryInfoFlags.NONE, None)
+    return load_mime_icon(info.icon.names)
+
+
+def get_mime_icon_by_name(filename: str) -> Gtk.Image:
+    """
+    Returns mime icon guessed from file name, without reading the file.
+    :param filename: name of the file icon of which we want to get.
+    """
+
+    content_type, _ = Gio.content_type_guess(filename, None)
+    icon = Gio.content_type_get_icon(content_type)
+    return load_mime_icon(icon.names)
+
+
+def load_mime_icon(icon_names: list[str]) -> Gtk.Image:
+    """
+    Returns the first icon from [icon_names] that exists in the theme.
+    """
 
     icon = None
-    for icon_name in info.icon.names:
+    for icon_name in icon_names:
         try:
             icon = load_icon(icon_name, 64, allow_fail=True)
             break
@@ -253,6 +272,75 @@ def get_mime_icon(path: str) -> Gtk.Image:
     return icon
 
 
+# runs slow operations (such as encrypting and writing databases) in background
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="PyAccounts")
+
+
+class Task:
+    """
+    A function running in a background thread.
+
+    When the function finishes, its result (or exception it raised) is passed to
+    `on_done` (or `on_error`) callback on the GTK main loop, so the callbacks can safely
+    update widgets.
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        *args,
+        on_done: Callable[[Any], None] | None = None,
+        on_error: Callable[[Exception], None] | None = None,
+    ):
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = False
+
+        self.future = executor.submit(func, *args)
+        self.future.add_done_callback(self._finished)
+
+    @property
+    def running(self) -> bool:
+        return not self.future.done()
+
+    def cancel(self):
+        """
+        Cancels the task, none of its callbacks will be called.
+
+        Note that the function can't be interrupted if it's already running,
+        it will run to completion and its result will be discarded.
+        """
+
+        self.cancelled = True
+        self.future.cancel()
+
+    def wait(self) -> Any:
+        """
+        Blocks until the task finishes, returns its result or raises its exception.
+        """
+        return self.future.result()
+
+    def _finished(self, future: Future):
+        # this is called from the worker thread, pass the result to the main loop
+        GLib.idle_add(self._dispatch, future)
+
+    def _dispatch(self, future: Future) -> bool:
+        if self.cancelled or future.cancelled():
+            return False
+
+        err = future.exception()
+        if err:
+            if self.on_error:
+                self.on_error(err)
+            else:
+                logging.error("".join(traceback.format_exception(err)))
+        elif self.on_done:
+            self.on_done(future.result())
+
+        # returning False removes this callback from the main loop
+        return False
+
+
 def wait_until(callback: Callable[[], bool], timeout=5):
     """
     Waits until the return value from callback becomes True, or until timeout expires.
@@ -0,0 +1,363 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Revision history of databases.
+
+Every save of a database is recorded in `<name>.history` file next to its .dba file as a
+revision. A revision contains only the accounts changed and deleted by the save, so the
+history grows by the size of the changes. Every CHECKPOINT_INTERVAL revisions one of them
+contains all the accounts instead (a checkpoint), so that accounts of any revision are
+restored by replaying at most CHECKPOINT_INTERVAL revisions.
+
+Only the last KEEP_CHECKPOINTS checkpoints and the revisions after them are kept, the
+older revisions are dropped when a checkpoint is recorded, see `History.prune`.
+
+The history file is a version 2 container (see core.container) encrypted with a key
+derived from the data key of the database. Revision `n` is stored in stream
+REVISION_STREAMS + n, its records are:
+* REVISION record with the metadata of the revision as json, see `Revision`;
+* ATTACHMENT records with digests of the attached files the revision refers to and ids of
+  the streams they are stored in, content of every attached file is stored once;
+* UPSERT records of the changed accounts and DELETE records of the deleted ones.
+
+Accounts are serialized the same way as in .dba files, see core.serialization, while
+converting them to records and back is left to core.database_utils.Database.
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from core import container
+from core.compression import Compression
+from core.container import ContainerWriter, Header, StreamSource
+from core.file_utils import atomic_write
+from core.kdf import SALT_SIZE, KdfParams
+from core.serialization import CODECS, DEFAULT_CODEC, Codec
+
+# every this many revisions one contains all accounts of the database
+CHECKPOINT_INTERVAL = 32
+# revisions before this many last checkpoints are dropped
+KEEP_CHECKPOINTS = 8
+# streams of revisions start from here, streams below contain attached files
+REVISION_STREAMS = container.TRANSACTIONS
+# kind of the record with metadata of a revision, other kinds are the ones of the journal
+REVISION = b"\x07"
+
+
+@dataclass
+class Revision:
+    """
+    Metadata of a revision of the history.
+    """
+
+    number: int
+    # when the revision was saved, seconds since the epoch
+    time: float
+    # whether the revision contains all accounts rather than only the changed ones
+    checkpoint: bool
+    # names of the accounts changed and deleted by the revision
+    changed: list[str]
+    deleted: list[str]
+
+    @property
+    def stream(self) -> int:
+        return REVISION_STREAMS + self.number
+
+
+class HistoryWriter:
+    """
+    Appends a revision to the history file, see `History.append`.
+
+    Attached files should be added before the revision itself is written.
+    """
+
+    def __init__(self, writer: ContainerWriter, stored: dict[bytes, int], next_stream: int):
+        """
+        :param stored: digests of the attached files already stored in the history that
+        the revision can refer to, mapped to their streams.
+        :param next_stream: id of the stream for the next attached file.
+        """
+
+        self.writer = writer
+        self.stored = stored
+        self.next_stream = next_stream
+        # digests of the attached files the revision refers to mapped to their streams
+        self.digests = {}
+
+    def attachment(self, digest: bytes, chunks: Callable[[], Iterable[bytes]]) -> int:
+        """
+        Stores content of an attached file, unless the history already has it.
+        :param digest: digest of the content, see core.container.attachment_digest.
+        :param chunks: called to read the content when it needs to be stored.
+        :return: id of the stream the content is stored in.
+        """
+
+        stream_id = self.digests.get(digest) or self.stored.get(digest)
+        if stream_id is None:
+            stream_id = self.next_stream
+            self.next_stream += 1
+            with self.writer.stream(stream_id) as stream:
+                for chunk in chunks():
+                    stream.write(chunk)
+        self.digests[digest] = stream_id
+        return stream_id
+
+    def revision(self, revision: Revision, records: Iterable[bytes]):
+        """
+        Writes the revision.
+        :param records: UPSERT and DELETE records of the revision.
+        """
+
+        with self.writer.stream(revision.stream) as stream:
+            stream.write_record(REVISION + json.dumps(asdict(revision)).encode())
+            for digest, stream_id in self.digests.items():
+                stream.write_record(
+                    container.ATTACHMENT + container.encode_digest(stream_id, digest)
+                )
+            for record in records:
+                stream.write_record(record)
+
+
+class History:
+    """
+    Reads and appends revisions of the history file of a database.
+    """
+
+    def __init__(self, path: Path, key: bytes):
+        """
+        :param key: the data key of the database, the history is encrypted with a key
+        derived from it.
+        """
+
+        self.path = path
+        self.key = container.derive_subkey(key, b"history")
+        self.source = StreamSource(path, self.key) if path.exists() else None
+        self._revisions: list[Revision] | None = None
+        # numbers of the revisions that can't be decrypted, found by `revisions`
+        self._damaged: list[int] = []
+
+    @property
+    def codec(self) -> Codec:
+        return CODECS[self.source.header.codec if self.source else DEFAULT_CODEC]
+
+    def revisions(self) -> list[Revision]:
+        """
+        :return: revisions of the history from the oldest to the newest, revisions that
+        weren't written completely (e.g. because saving was interrupted) are skipped, and
+        so are the damaged ones (see `damaged`).
+        :raises CorruptedContainer: if none of the revisions can be decrypted (e.g. the
+        history was written with another data key).
+        """
+
+        if self._revisions is None:
+            streams = sorted(
+                stream
+                for stream, locations in self.source.locations.items()
+                if stream >= REVISION_STREAMS and locations[-1].final
+            ) if self.source else []
+
+            revisions, damaged = [], []
+            for stream in streams:
+                try:
+                    revisions.append(self.read_revision(stream))
+                except container.CorruptedContainer:
+                    damaged.append(stream - REVISION_STREAMS)
+            if damaged and not revisions:
+                raise container.CorruptedContainer("Can't decrypt the history.")
+            self._revisions, self._damaged = revisions, damaged
+        return self._revisions
+
+    def damaged(self) -> list[int]:
+        """
+        :return: numbers of the revisions that were written completely but can't be read.
+        """
+
+        self.revisions()
+        return self._damaged
+
+    def read_revision(self, stream: int) -> Revision:
+        record = next(self.source.read_records(stream))
+        if record[:1] != REVISION:
+            raise container.CorruptedContainer("The history is damaged.")
+        return Revision(**json.loads(record[1:]))
+
+    def revision(self, number: int) -> Revision:
+        """
+        :raises KeyError: if there is no such revision.
+        """
+
+        for revision in self.revisions():
+            if revision.number == number:
+                return revision
+        raise KeyError(f"There is no revision {number} in the history.")
+
+    def next_revision(self) -> tuple[int, bool]:
+        """
+        :return: number of the revision to append and whether it should be a checkpoint.
+        """
+
+        # revisions that weren't written completely still take their numbers, since
+        # their streams are still in the file
+        streams = [s for s in self.source.locations if s >= REVISION_STREAMS] \
+            if self.source else []
+        number = max(streams, default=REVISION_STREAMS) - REVISION_STREAMS + 1
+        since_checkpoint = self.since_checkpoint(self.revisions())
+        if not since_checkpoint or len(since_checkpoint) >= CHECKPOINT_INTERVAL:
+            return number, True
+        # revisions after a damaged one can't be restored until the next checkpoint
+        checkpoint = since_checkpoint[0].number
+        return number, any(damaged > checkpoint for damaged in self.damaged())
+
+    @staticmethod
+    def since_checkpoint(revisions: list[Revision]) -> list[Revision]:
+        """
+        :return: the last checkpoint of given revisions and the revisions after it.
+        """
+
+        for position in range(len(revisions) - 1, -1, -1):
+            if revisions[position].checkpoint:
+                return revisions[position:]
+        return []
+
+    def stored(self) -> dict[bytes, int]:
+        """
+        Finds attached files the next revision can refer to without storing them again,
+        i.e. the ones referred to by the revisions since the last checkpoint.
+        :return: dict mapping digests of the attached files to their streams.
+        """
+
+        digests = {}
+        for revision in self.since_checkpoint(self.revisions()):
+            digests.update(self.attachments(revision))
+        return digests
+
+    def attachments(self, revision: Revision) -> dict[bytes, int]:
+        """
+        :return: digests of the attached files the revision refers to mapped to their streams.
+        """
+
+        digests = {}
+        for record in self.source.read_records(revision.stream):
+            kind = record[:1]
+            if kind == container.ATTACHMENT:
+                stream_id, digest = container.decode_digest(record[1:])
+                digests[digest] = stream_id
+            elif kind != REVISION:
+                # attached files are listed before the accounts
+                break
+        return digests
+
+    def records(self, number: int) -> Iterator[bytes]:
+        """
+        Reads records to replay to get accounts of given revision, starting from the
+        checkpoint before it.
+        :return: UPSERT and DELETE records.
+        :raises KeyError: if there is no such revision.
+        :raises CorruptedContainer: if a revision that has to be replayed is damaged.
+        """
+
+        self.revision(number)
+        revisions = [revision for revision in self.revisions() if revision.number <= number]
+        revisions = self.since_checkpoint(revisions)
+        for damaged in self.damaged():
+            if revisions[0].number < damaged < number:
+                raise container.CorruptedContainer(f"Revision {damaged} is damaged.")
+        for revision in revisions:
+            for record in self.source.read_records(revision.stream):
+                if record[:1] in (container.UPSERT, container.DELETE):
+                    yield record
+
+    @contextmanager
+    def append(self, compression: Compression) -> Iterator[HistoryWriter]:
+        """
+        Context manager to append a revision to the history file, the file is created if
+        it doesn't exist.
+        :param compression: compression to use, only the level is used when appending,
+        the algorithm is the one the file already has.
+        """
+
+        if self.source:
+            stored = self.stored()
+            attachments = [s for s in self.source.locations if s < REVISION_STREAMS]
+            with open(self.path, "r+b") as file:
+                # drop whatever was left by interrupted saving
+                file.truncate(self.source.end)
+                file.seek(self.source.end)
+                writer = ContainerWriter(
+                    file, self.key, self.source.header, compression.level, append=True,
+                )
+                yield HistoryWriter(writer, stored, max(attachments, default=0) + 1)
+                file.flush()
+                os.fsync(file.fileno())
+        else:
+            # the history key is derived from the data key, so the KDF isn't used
+            header = Header(
+                KdfParams(bytes(SALT_SIZE)),
+                codec=DEFAULT_CODEC,
+                compression=compression.algorithm,
+                file_id=os.urandom(container.FILE_ID_SIZE),
+                features=[container.FILE_ID_FEATURE],
+            )
+            with atomic_write(self.path) as file:
+                writer = ContainerWriter(file, self.key, header, compression.level)
+                yield HistoryWriter(writer, {}, 1)
+
+        self.close()
+        self.source = StreamSource(self.path, self.key)
+
+    def prune(self):
+        """
+        Drops the revisions before the last KEEP_CHECKPOINTS checkpoints, together with the
+        attached files only they refer to, so that the history doesn't grow without limit.
+
+        The history file is replaced with a new one, the kept streams are copied to it
+        without decompressing them.
+        """
+
+        checkpoints = [revision.number for revision in self.revisions() if revision.checkpoint]
+        if len(checkpoints) <= KEEP_CHECKPOINTS:
+            return
+
+        oldest = checkpoints[-KEEP_CHECKPOINTS]
+        attachments = set()
+        for revision in self.revisions():
+            if revision.number >= oldest:
+                attachments.update(self.attachments(revision).values())
+        # damaged revisions are kept too, so that the ones after them aren't restored
+        # without them, see `records`
+        revisions = [
+            stream
+            for stream, locations in self.source.locations.items()
+            if stream >= REVISION_STREAMS + oldest and locations[-1].final
+        ]
+
+        with atomic_write(self.path) as file:
+            writer = ContainerWriter(file, self.key, self.source.header)
+            for stream in sorted(attachments) + sorted(revisions):
+                writer.copy_stream(self.source, stream)
+
+        self.close()
+        self.source = StreamSource(self.path, self.key)
+
+    def close(self):
+        if self.source:
+            self.source.close()
+        self._revisions = None
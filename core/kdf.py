@@ -0,0 +1,147 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Key derivation functions used to derive database keys from passwords.
+
+Parameters of the KDF are stored in the header of each .dba file, new files get
+parameters calibrated to take about TARGET_UNLOCK_TIME on this machine.
+"""
+
+from __future__ import annotations
+
+import base64
+import functools
+import os
+import time
+from dataclasses import dataclass, replace
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+KDF_ALGORITHMS = ("pbkdf2-sha256", "scrypt")
+DEFAULT_ALGORITHM = "scrypt"
+# how long it should take to derive the key when opening a database, in seconds
+TARGET_UNLOCK_TIME = 0.25
+
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+# calibration never picks weaker parameters than these
+MIN_ITERATIONS = 100_000
+MIN_SCRYPT_N = 2 ** 14
+# scrypt takes 128 * n * r bytes of memory, don't go beyond 128 MiB with r = 8
+MAX_SCRYPT_N = 2 ** 17
+
+
+@dataclass(frozen=True)
+class KdfParams:
+    """
+    Parameters of key derivation function used to derive database key from password.
+
+    `iterations` are used by PBKDF2, `n`, `r` and `p` by scrypt.
+    """
+
+    salt: bytes
+    algorithm: str = "pbkdf2-sha256"
+    iterations: int = 100_000
+    n: int = MIN_SCRYPT_N
+    r: int = 8
+    p: int = 1
+
+    def __post_init__(self):
+        if self.algorithm not in KDF_ALGORITHMS:
+            raise ValueError(f"Unsupported key derivation function: {self.algorithm}")
+
+    def derive(self, password: str) -> bytes:
+        """
+        Derives 32 byte key from given password.
+        """
+
+        if self.algorithm == "scrypt":
+            kdf = Scrypt(salt=self.salt, length=KEY_SIZE, n=self.n, r=self.r, p=self.p)
+        else:
+            kdf = PBKDF2HMAC(
+                algorithm=hashes.SHA256(),
+                length=KEY_SIZE,
+                salt=self.salt,
+                iterations=self.iterations,
+            )
+        return kdf.derive(password.encode())
+
+    def to_dict(self) -> dict:
+        _dict = {
+            "algorithm": self.algorithm,
+            "salt": base64.b64encode(self.salt).decode("ascii"),
+        }
+        if self.algorithm == "scrypt":
+            _dict.update(n=self.n, r=self.r, p=self.p)
+        else:
+            _dict["iterations"] = self.iterations
+        return _dict
+
+    @staticmethod
+    def from_dict(_dict: dict) -> "KdfParams":
+        params = {name: _dict[name] for name in ("iterations", "n", "r", "p") if name in _dict}
+        return KdfParams(
+            salt=base64.b64decode(_dict["salt"]),
+            algorithm=_dict["algorithm"],
+            **params,
+        )
+
+
+def measure(params: KdfParams) -> float:
+    """
+    :return: time in seconds it takes to derive a key with given parameters.
+    """
+
+    start = time.perf_counter()
+    params.derive("calibration")
+    return time.perf_counter() - start
+
+
+@functools.cache
+def calibrated_params(algorithm: str, target: float) -> KdfParams:
+    """
+    Finds parameters of the KDF that take about `target` seconds on this machine.
+
+    The result is cached, because calibration takes about as long as unlocking
+    a database a few times.
+    """
+
+    salt = os.urandom(SALT_SIZE)
+    if algorithm == "pbkdf2-sha256":
+        params = KdfParams(salt, algorithm, iterations=MIN_ITERATIONS // 10)
+        elapsed = min(measure(params) for _ in range(3))
+        iterations = int(params.iterations * target / elapsed) // 1000 * 1000
+        return replace(params, iterations=max(iterations, MIN_ITERATIONS))
+
+    # scrypt takes time proportional to n * p, but memory only grows with n
+    params = KdfParams(salt, algorithm, n=MIN_SCRYPT_N)
+    elapsed = min(measure(params) for _ in range(3))
+    n = MIN_SCRYPT_N
+    while n < MAX_SCRYPT_N and elapsed * 2 <= target:
+        n *= 2
+        elapsed *= 2
+    return replace(params, n=n, p=max(int(target / elapsed), 1))
+
+
+def calibrate(algorithm: str = DEFAULT_ALGORITHM, target: float = TARGET_UNLOCK_TIME) -> KdfParams:
+    """
+    Returns calibrated parameters of the KDF (see `calibrated_params`) with a new salt.
+    """
+    return replace(calibrated_params(algorithm, target), salt=os.urandom(SALT_SIZE))
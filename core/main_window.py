@@ -15,7 +15,6 @@
 #  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-import glob
 import logging
 import os
 import platform
@@ -24,14 +23,22 @@ import tempfile
 import traceback
 from pathlib import Path
 
-from gi.repository import Gtk, Gdk, GdkPixbuf
+from gi.repository import Gtk, Gdk, GdkPixbuf, Gio
 
 import core
 from core.create_database import CreateDatabase
-from core.database_utils import Database, AccountClipboard
+from core.database_utils import (
+    CONTAINER_FORMAT,
+    LEGACY_FORMAT,
+    SQLITE_FORMAT,
+    AccountClipboard,
+    Database,
+    detect_format,
+)
 from core.database_window import DatabaseWindow
 from core.edit_database import EditDatabase
 from core.gtk_utils import GladeTemplate, abc_list_sort, delete_list_item, add_list_item, item_name
+from core.manifest import DatabaseManifest
 from core.open_database import OpenDatabase
 from core.rename_database import RenameDatabase
 from core.settings import Config
@@ -42,7 +49,7 @@ SUCCESS_DB_IMPORT = "Database imported successfully!"
 WARNING_DB_EXISTS = "The database you are trying to import already exists!"
 WARNING_DB_CORRUPTED = (
     "The database you are trying to import is probably corrupted.\n"
-    "It's file size should be no smaller than 116 bytes."
+    "It's not a PyAccounts database file."
 )
 ERROR_DB_IMPORT = "Error importing database!"
 
@@ -59,6 +66,14 @@ CONFIRM_DB_DELETION = "Delete <b>{}</b> database?"
 SUCCESS_DB_DELETED = "Database deleted successfully!"
 ERROR_DB_DELETION = "Error deleting the database!"
 
+# shown in tooltips of the databases list together with size of the .dba files
+FORMAT_NAMES = {
+    LEGACY_FORMAT: "Legacy database",
+    CONTAINER_FORMAT: "Database",
+    SQLITE_FORMAT: "SQLite database",
+    None: "Not a database",
+}
+
 
 class MainWindow(Gtk.ApplicationWindow, Window):
     # <editor-fold>
@@ -87,14 +102,18 @@ class MainWindow(Gtk.ApplicationWindow, Window):
 
         self.main_window = self
         self.windows: dict[str, DatabaseWindow] = {}
+        # old and new names of the databases being renamed by EditDatabase
+        self.pending_renames: set[tuple[str, str]] = set()
 
         self.config = Config()
         self.load_css()
         self.load_separator()
 
+        self.manifest = DatabaseManifest(core.SRC_DIR)
         self.get_databases()
         self.load_databases()
         self.select_main_database()
+        self.watch_src_dir()
 
         # Ctrl+I to import database
         self.shortcuts.connect(
@@ -139,15 +158,10 @@ class MainWindow(Gtk.ApplicationWindow, Window):
 
     def get_databases(self):
         """
-        Builds a sorted list of databases residing in SRC_DIR folder.
+        Builds a sorted list of databases residing in SRC_DIR folder, see core.manifest.
         """
 
-        dbs = []
-        for file in glob.glob(f"{core.SRC_DIR}/*.dba"):
-            name = Path(file).stem
-            dbs.append(Database(name))
-        dbs.sort()
-        self.databases = dbs
+        self.databases = [Database(name) for name in self.manifest.load()]
 
     def load_databases(self):
         """
@@ -158,7 +172,147 @@ class MainWindow(Gtk.ApplicationWindow, Window):
         pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale("img/icon.svg", 50, 50, True)
 
         for db in self.databases:
-            add_list_item(self.db_list, pixbuf, db.name)
+            add_list_item(self.db_list, pixbuf, db.name, self.database_tooltip(db.name))
+
+    def database_tooltip(self, name: str) -> str:
+        """
+        Describes the .dba file of the database using its metadata cached in the manifest.
+        """
+
+        info = self.manifest.files.get(name)
+        if not info:
+            return ""
+        return f"{FORMAT_NAMES.get(info.format, FORMAT_NAMES[None])}, {info.size / 1024:.0f} KiB"
+
+    def update_tooltip(self, name: str):
+        for row in self.db_list.children:
+            if item_name(row) == name:
+                row.children[0].children[0].tooltip_text = self.database_tooltip(name)
+
+    def watch_src_dir(self):
+        """
+        Keeps the databases list up to date when .dba files are created, removed or
+        renamed in SRC_DIR, including by other programs.
+        """
+
+        directory = Gio.File.new_for_path(str(core.SRC_DIR))
+        self.monitor = directory.monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        self.monitor.connect("changed", self.on_src_dir_changed)
+
+    @staticmethod
+    def database_name(file: Gio.File | None) -> str | None:
+        """
+        :return: name of the database if the file is a .dba file in SRC_DIR.
+        """
+
+        if file is None:
+            return None
+        path = Path(file.get_path())
+        return path.stem if path.suffix == ".dba" and path.parent == core.SRC_DIR else None
+
+    def on_src_dir_changed(
+            self,
+            _monitor: Gio.FileMonitor,
+            file: Gio.File,
+            other_file: Gio.File | None,
+            event: Gio.FileMonitorEvent,
+    ):
+        """
+        Applies changes of SRC_DIR to the databases list.
+
+        Changes made by the app itself are already applied when their events come, so
+        applying a change is a no-op when the list already reflects it. Renaming done by
+        EditDatabase in background is applied when it finishes, see `pending_renames`.
+        """
+
+        name = self.database_name(file)
+        new_name = self.database_name(other_file)
+        if not name and not new_name:
+            # other files don't change the list, but they change the modification time
+            # of SRC_DIR
+            self.manifest.refresh()
+            return
+
+        if event == Gio.FileMonitorEvent.RENAMED:
+            database = self.find_database(name)
+            if name:
+                self.manifest.update(name)
+            if (name, new_name) in self.pending_renames:
+                # the list is updated once the renaming is done
+                self.manifest.update(new_name)
+                return
+            if database and new_name and not self.find_database(new_name):
+                # renamed by another program
+                old_name = database.name
+                database.name = new_name
+                self.database_renamed(old_name, database)
+            elif database and not database.opened:
+                self.remove_database(name)
+            if new_name:
+                self.manifest.update(new_name)
+                self.add_database(Database(new_name))
+                self.update_tooltip(new_name)
+        elif event in (Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.MOVED_IN):
+            self.manifest.update(name)
+            self.add_database(Database(name))
+        elif event in (Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_OUT):
+            self.manifest.update(name)
+            database = self.find_database(name)
+            # opened databases stay, saving them creates the file again
+            if database and not database.opened:
+                self.remove_database(name)
+        elif event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+            self.manifest.update(name)
+            self.update_tooltip(name)
+
+    def find_database(self, name: str | None) -> Database | None:
+        for database in self.databases:
+            if database.name == name:
+                return database
+        return None
+
+    def add_database(self, database: Database):
+        """
+        Adds database to the databases list, unless there already is one with its name.
+        """
+
+        if self.find_database(database.name):
+            return
+
+        self.databases.append(database)
+        self.databases.sort(key=lambda db: db.name)
+        if database.name not in self.manifest.files:
+            self.manifest.update(database.name)
+
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale("img/icon.svg", 50, 50, True)
+        add_list_item(self.db_list, pixbuf, database.name, self.database_tooltip(database.name))
+        self.db_list.show_all()
+
+    def remove_database(self, name: str):
+        """
+        Removes database from the databases list, if it's there.
+        """
+
+        database = self.find_database(name)
+        if database:
+            self.databases.remove(database)
+            delete_list_item(self.db_list, name)
+
+    def database_renamed(self, old_name: str, database: Database):
+        """
+        Updates the databases list and the window of the database after it was renamed.
+        """
+
+        self.databases.sort(key=lambda db: db.name)
+        delete_list_item(self.db_list, old_name)
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale("img/icon.svg", 50, 50, True)
+        add_list_item(self.db_list, pixbuf, database.name, self.database_tooltip(database.name))
+        self.db_list.show_all()
+
+        win = self.windows.pop(old_name, None)
+        if win:
+            self.windows[database.name] = win
+            win.title = database.name
 
     def select_main_database(self):
         """
@@ -200,7 +354,15 @@ class MainWindow(Gtk.ApplicationWindow, Window):
             IconDialog("Warning!", WARNING_DB_EXISTS, "dialog-warning").run()
             return
 
-        if os.path.getsize(path) < 116:
+        try:
+            with open(path, "rb") as file:
+                file_format = detect_format(file)
+        except Exception as err:
+            logging.error(traceback.format_exc())
+            ErrorDialog(ERROR_DB_IMPORT, err).run()
+            return
+
+        if file_format is None:
             IconDialog("Warning!", WARNING_DB_CORRUPTED, "dialog-warning").run()
             return
 
@@ -211,14 +373,7 @@ class MainWindow(Gtk.ApplicationWindow, Window):
             ErrorDialog(ERROR_DB_IMPORT, err).run()
             return
 
-        db = Database(Path(path).stem)
-        self.databases.append(db)
-        self.databases.sort()
-
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale("img/icon.svg", 50, 50, True)
-        add_list_item(self.db_list, pixbuf, db.name)
-        self.db_list.show_all()
-
+        self.add_database(Database(Path(path).stem))
         self.statusbar.success(SUCCESS_DB_IMPORT)
 
     def on_import_database(self, *args):
@@ -355,14 +510,13 @@ class MainWindow(Gtk.ApplicationWindow, Window):
         """
 
         try:
-            database.dba_file.unlink()
+            database.delete()
         except Exception as err:
             logging.error(traceback.format_exc())
             ErrorDialog(ERROR_DB_DELETION, err).run()
             return
 
-        self.databases.remove(database)
-        delete_list_item(self.db_list, database.name)
+        self.remove_database(database.name)
 
         self.form_box.foreach(self.form_box.remove)
         self.statusbar.success(SUCCESS_DB_DELETED)
@@ -0,0 +1,164 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Cache of metadata of .dba files in SRC_DIR, so that the databases are listed at startup
+without listing SRC_DIR or reading the files.
+
+The manifest remembers the modification time of SRC_DIR itself. It changes whenever
+files are created, removed or renamed in the directory, so while it stays the same the
+cached list of the databases is up to date. Otherwise the directory is scanned again,
+reading only the files whose size or modification time changed. Changes of other files
+(e.g. history of the databases) are recorded as they happen, see `refresh`, so that they
+don't cause the scan.
+
+Modification times have limited resolution, so the directory could change again without
+its modification time changing while the manifest was written. The cache is trusted only
+if the manifest was written later than the directory was last modified.
+"""
+
+import json
+import logging
+import os
+import traceback
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from core.database_utils import detect_format
+
+MANIFEST_FILE = ".databases.json"
+
+
+@dataclass
+class FileInfo:
+    """
+    Metadata of a .dba file.
+    """
+
+    size: int
+    mtime_ns: int
+    # format of the file, see core.database_utils.detect_format
+    format: str | None
+
+
+class DatabaseManifest:
+    """
+    Metadata of .dba files in a directory, mapped by names of the databases.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.path = directory / MANIFEST_FILE
+        self.files: dict[str, FileInfo] = {}
+        # modification time of the directory the files were listed at
+        self.directory_mtime_ns: int | None = None
+
+    def load(self) -> list[str]:
+        """
+        Loads the manifest, scanning the directory if it changed since the manifest
+        was saved.
+        :return: sorted names of the databases.
+        """
+
+        directory_mtime_ns = os.stat(self.directory).st_mtime_ns
+        try:
+            with open(self.path, "rb") as file:
+                written_ns = os.fstat(file.fileno()).st_mtime_ns
+                manifest = json.load(file)
+            files = {name: FileInfo(**info) for name, info in manifest["files"].items()}
+            saved_mtime_ns = manifest["directory_mtime_ns"]
+        except FileNotFoundError:
+            files, saved_mtime_ns, written_ns = {}, None, 0
+        except (ValueError, KeyError, TypeError):
+            logging.error(traceback.format_exc())
+            files, saved_mtime_ns, written_ns = {}, None, 0
+
+        self.files = files
+        if saved_mtime_ns != directory_mtime_ns or written_ns <= directory_mtime_ns:
+            self.scan(directory_mtime_ns)
+        self.directory_mtime_ns = directory_mtime_ns
+        return sorted(self.files)
+
+    def scan(self, directory_mtime_ns: int):
+        """
+        Lists .dba files of the directory, reading only new and changed ones.
+        :param directory_mtime_ns: modification time of the directory before listing it.
+        """
+
+        cached = self.files
+        self.files = {}
+        for path in self.directory.glob("*.dba"):
+            info = cached.get(path.stem)
+            stat = path.stat()
+            if info and (info.size, info.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                self.files[path.stem] = info
+            else:
+                self.files[path.stem] = self.read_info(path)
+        self.directory_mtime_ns = directory_mtime_ns
+        self.save()
+
+    @staticmethod
+    def read_info(path: Path) -> FileInfo:
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            return FileInfo(stat.st_size, stat.st_mtime_ns, detect_format(file))
+
+    def update(self, name: str) -> FileInfo | None:
+        """
+        Updates metadata of the database after its file was created, changed or removed.
+        :return: the new metadata, None if the file doesn't exist.
+        """
+
+        directory_mtime_ns = os.stat(self.directory).st_mtime_ns
+        try:
+            info = self.files[name] = self.read_info(self.directory / f"{name}.dba")
+        except FileNotFoundError:
+            self.files.pop(name, None)
+            info = None
+        self.directory_mtime_ns = directory_mtime_ns
+        self.save()
+        return info
+
+    def refresh(self):
+        """
+        Records the modification time of the directory after files other than .dba files
+        were changed in it (e.g. history, backups or temporary files), they don't change
+        the list of the databases, so the directory doesn't need to be scanned because
+        of them.
+        """
+
+        directory_mtime_ns = os.stat(self.directory).st_mtime_ns
+        if directory_mtime_ns != self.directory_mtime_ns:
+            self.directory_mtime_ns = directory_mtime_ns
+            self.save()
+
+    def save(self):
+        """
+        Writes the manifest in place, errors are only logged since it's just a cache.
+
+        Replacing the file would change the modification time of the directory, then
+        it would have to be scanned on every load.
+        """
+
+        manifest = {
+            "directory_mtime_ns": self.directory_mtime_ns,
+            "files": {name: asdict(info) for name, info in self.files.items()},
+        }
+        try:
+            with open(self.path, "w") as file:
+                json.dump(manifest, file)
+        except OSError:
+            logging.error(traceback.format_exc())
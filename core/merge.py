@@ -0,0 +1,217 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Three-way merge of diverged copies of a database.
+
+Two versions of a database (ours and theirs) are merged using the version both of them
+come from (base), e.g. a revision from the history (see core.history). Accounts changed
+on one side only are taken as they are. Accounts changed on both sides are merged field
+by field, fields changed differently on both sides are conflicts and keep our values.
+
+Accounts are compared by their digests (keyed hashes of the serialized accounts, where
+attached files are represented by digests of their content), so that every account is
+serialized once and merging takes time linear in the number of accounts. Fields are
+compared only for accounts changed on both sides.
+"""
+
+import hashlib
+import itertools
+import os
+from dataclasses import dataclass, field
+
+from core import container
+from core.database_utils import Account, Accounts, Attachment
+from core.serialization import BinaryCodec
+
+# fields merged separately, apart from the name of the account and attached files
+MERGED_FIELDS = ("username", "email", "password", "birthdate", "notes", "copy_email")
+
+
+@dataclass
+class Conflict:
+    """
+    Change made differently to the same account in both versions.
+    """
+
+    account: str
+    # the conflicting field, None if the account was deleted in one version and changed
+    # in the other
+    field: str | None = None
+    # name of the conflicting attached file, when the field is `attached_files`
+    file: str | None = None
+
+
+@dataclass
+class Merge:
+    """
+    Result of merging two versions of a database.
+    """
+
+    accounts: Accounts
+    conflicts: list[Conflict] = field(default_factory=list)
+    # names of the accounts that differ from ours after merging
+    changed: list[str] = field(default_factory=list)
+
+
+class Merger:
+    """
+    Merges two versions of a database, see `merge`.
+    """
+
+    codec = BinaryCodec()
+
+    def __init__(self, key: bytes):
+        self.key = key
+        # the accounts with their digests mapped by `id()` of the accounts, keeping the
+        # accounts alive so that their ids aren't reused
+        self.digests: dict[int, tuple[Account, bytes]] = {}
+
+    def digest(self, account: Account | None) -> bytes | None:
+        """
+        :return: keyed hash of the account, accounts with the same fields and attached
+        files with the same content have the same digest.
+        """
+
+        if account is None:
+            return None
+        if id(account) in self.digests:
+            return self.digests[id(account)][1]
+        mac = hashlib.blake2b(self.codec.encode(account, {}), key=self.key)
+        for file, attachment in sorted(account.attached_files.items()):
+            name = file.encode()
+            mac.update(container.RECORD_LENGTH.pack(len(name)) + name)
+            mac.update(attachment.digest(self.key))
+        self.digests[id(account)] = (account, mac.digest())
+        return self.digests[id(account)][1]
+
+    def merge(self, base: Accounts, ours: Accounts, theirs: Accounts) -> Merge:
+        result = Merge({})
+        for name in dict.fromkeys(itertools.chain(ours, theirs, base)):
+            account, changed = self.merge_account(
+                name, base.get(name), ours.get(name), theirs.get(name), result.conflicts,
+            )
+            if account is not None:
+                result.accounts[name] = account
+            if changed:
+                result.changed.append(name)
+        return result
+
+    def merge_account(
+            self,
+            name: str,
+            base: Account | None,
+            ours: Account | None,
+            theirs: Account | None,
+            conflicts: list[Conflict],
+    ) -> tuple[Account | None, bool]:
+        """
+        :return: the merged account (None if it's deleted) and whether it differs from ours.
+        """
+
+        if ours is theirs:
+            return ours, False
+        ours_digest, theirs_digest = self.digest(ours), self.digest(theirs)
+        if ours_digest == theirs_digest:
+            return ours, False
+        base_digest = self.digest(base)
+        if ours_digest == base_digest:
+            return theirs, True
+        if theirs_digest == base_digest:
+            return ours, False
+
+        if ours is None or theirs is None:
+            # deleted in one version and changed in the other, keep the changes
+            conflicts.append(Conflict(name))
+            return ours or theirs, ours is None
+
+        values = {}
+        for field_name in MERGED_FIELDS:
+            values[field_name] = self.merge_value(
+                name,
+                field_name,
+                self.value(base, field_name),
+                self.value(ours, field_name),
+                self.value(theirs, field_name),
+                conflicts,
+            )
+        values["attached_files"] = self.merge_files(name, base, ours, theirs, conflicts)
+        return Account(name, **values), True
+
+    @staticmethod
+    def value(account: Account | None, field_name: str):
+        if account is None:
+            return None
+        if field_name in Account.secret_fields:
+            # compare secret fields without decoding them into strings
+            return account.utf8(field_name)
+        return getattr(account, field_name)
+
+    @staticmethod
+    def merge_value(
+            name: str,
+            field_name: str,
+            base,
+            ours,
+            theirs,
+            conflicts: list[Conflict],
+            file: str | None = None,
+    ):
+        if ours == theirs or theirs == base:
+            return ours
+        if ours == base:
+            return theirs
+        conflicts.append(Conflict(name, field_name, file))
+        return ours
+
+    def merge_files(
+            self,
+            name: str,
+            base: Account | None,
+            ours: Account,
+            theirs: Account,
+            conflicts: list[Conflict],
+    ) -> dict[str, Attachment]:
+        versions = (base.attached_files if base else {}, ours.attached_files, theirs.attached_files)
+        merged = {}
+        for file in dict.fromkeys(itertools.chain(ours.attached_files, theirs.attached_files)):
+            base_file, ours_file, theirs_file = (
+                files[file].digest(self.key) if file in files else None for files in versions
+            )
+            digest = self.merge_value(
+                name, "attached_files", base_file, ours_file, theirs_file, conflicts, file,
+            )
+            if digest is not None:
+                # conflicts keep the attachment from ours
+                files = ours.attached_files if digest == ours_file else theirs.attached_files
+                merged[file] = files[file]
+        return merged
+
+
+def merge(
+        base: Accounts,
+        ours: Accounts,
+        theirs: Accounts,
+        key: bytes | None = None,
+) -> Merge:
+    """
+    Merges two versions of a database using the version both of them come from.
+    :param key: key to compute digests with, the data key of the database is preferred,
+    since digests of attached files stored in the .dba file are already known for it.
+    :return: merged accounts, conflicts and names of the accounts that differ from ours.
+    """
+
+    return Merger(key or os.urandom(container.DATA_KEY_SIZE)).merge(base, ours, theirs)
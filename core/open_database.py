@@ -22,7 +22,7 @@ from gi.repository import Gtk, GLib
 
 from core.database_utils import Database
 from core.database_window import DatabaseWindow
-from core.gtk_utils import GladeTemplate
+from core.gtk_utils import GladeTemplate, Task
 from core.widgets import ErrorDialog
 
 if typing.TYPE_CHECKING:
@@ -39,6 +39,8 @@ class OpenDatabase(GladeTemplate):
     open_button: Gtk.Button
     incorrect_password: Gtk.Label
     password: Gtk.Entry
+    spinner: Gtk.Spinner
+    cancel_button: Gtk.Button
     # </editor-fold>
 
     def __init__(self, database: Database, main_window: "MainWindow"):
@@ -46,6 +48,8 @@ class OpenDatabase(GladeTemplate):
         self.vexpand = True
         self.database = database
         self.main_window = main_window
+        self.task: Task | None = None
+        self.connect("destroy", self.on_cancel)
 
         self.title.markup = OPEN_DB_TITLE.format(database.name)
         # wait for password field to get mapped and make it focused
@@ -54,28 +58,97 @@ class OpenDatabase(GladeTemplate):
 
     def on_open_database(self, _=None):
         """
-        Tries to open database with password from password field,
-        if there is an error decrypting the database – displays incorrect_password tip.
-        Opens database window on success.
+        Opens database in background with password from password field.
+
+        Names of the accounts are read first, so that the database window can display
+        them while the accounts are loaded.
         """
 
-        try:
-            self.database.open(self.password.text)
-        except InvalidToken:
-            self.incorrect_password.show()
-            self.database.password = None
+        if self.task and self.task.running:
             return
-        except Exception as err:
-            logging.error(traceback.format_exc())
-            ErrorDialog(ERROR_DB_OPENING, err).run()
-            self.database.password = None
+
+        self.set_busy(True)
+        self.task = Task(
+            self.database.read_index,
+            self.password.text,
+            on_done=self.on_index_read,
+            on_error=self.on_open_error,
+        )
+
+    def on_index_read(self, names: list[str] | None):
+        """
+        Opens database window with the names of the accounts, if the database has no
+        index (e.g. legacy databases) – opens the whole database first.
+        """
+
+        if names is not None:
+            self.on_database_opened(names)
             return
 
+        self.task = Task(
+            self.database.open,
+            self.database.password,
+            on_done=self.on_database_opened,
+            on_error=self.on_open_error,
+        )
+
+    def on_database_opened(self, names: list[str] | None):
+        """
+        Opens database window when the database (or its index) is opened.
+        :param names: names of the accounts if the database window should load them.
+        """
+
+        self.set_busy(False)
         self.destroy()
-        win = DatabaseWindow(self.database, self.main_window)
+        win = DatabaseWindow(self.database, self.main_window, names)
         self.main_window.windows[self.database.name] = win
         win.present()
 
+    def on_open_error(self, err: Exception):
+        """
+        If there is an error decrypting the database – displays incorrect_password tip,
+        on any other error – displays error dialog.
+        """
+
+        self.set_busy(False)
+        self.database.password = None
+
+        if isinstance(err, InvalidToken):
+            self.incorrect_password.show()
+            return
+
+        logging.error("".join(traceback.format_exception(err)))
+        ErrorDialog(ERROR_DB_OPENING, err).run()
+
+    def on_cancel(self, _=None):
+        """
+        Cancels opening of the database.
+        """
+
+        if not self.task or not self.task.running:
+            return
+
+        task = self.task
+        task.cancel()
+        # the database can't be interrupted while it's being opened,
+        # so we close it as soon as it's done
+        task.future.add_done_callback(lambda _: GLib.idle_add(self.database.close))
+        self.set_busy(False)
+
+    def set_busy(self, busy: bool):
+        """
+        Shows spinner and cancel button while the database is being opened.
+        """
+
+        self.password.sensitive = not busy
+        self.open_button.sensitive = not busy
+        self.spinner.visible = busy
+        self.cancel_button.visible = busy
+        if busy:
+            self.spinner.start()
+        else:
+            self.spinner.stop()
+
     def on_password_changed(self, _):
         """
         Hides incorrect_password error when the user starts typing.
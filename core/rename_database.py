@@ -17,10 +17,10 @@ import logging
 import traceback
 import typing
 
-from gi.repository import Gtk, GLib, GdkPixbuf
+from gi.repository import Gtk, GLib
 
 from core.database_utils import Database
-from core.gtk_utils import GladeTemplate, delete_list_item, add_list_item
+from core.gtk_utils import GladeTemplate
 from core.widgets import FilterDbNameMixin, ValidateNameMixin, ErrorDialog
 
 if typing.TYPE_CHECKING:
@@ -81,10 +81,5 @@ class RenameDatabase(GladeTemplate, FilterDbNameMixin, ValidateNameMixin):
             logging.error(traceback.format_exc())
             ErrorDialog(ERROR_RENAMING_DB, err).run()
             return
-        self.main_window.databases.sort(key=lambda db: db.name)
-
-        delete_list_item(self.main_window.db_list, old_name)
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale("img/icon.svg", 50, 50, True)
-        add_list_item(self.main_window.db_list, pixbuf, self.database.name)
-
+        self.main_window.database_renamed(old_name, self.database)
         self.destroy()
@@ -0,0 +1,131 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Keeps secrets of opened databases encrypted in memory.
+
+Passwords and notes of accounts and the content of attached files that aren't stored in
+a .dba file yet are encrypted with a key generated once per session (i.e. when the
+application starts) and decrypted only when they're read. So an opened database doesn't
+hold all of its secrets in memory as plaintext, and the fields nobody looks at are never
+decoded into strings. Files attached from disk are copied to an anonymous temporary
+file the same way, see SealedFile.
+
+Note, that the key is in memory too, so this doesn't protect against someone who can
+read memory of the process. It limits plaintext to the secrets in use instead.
+"""
+
+import itertools
+import struct
+import tempfile
+import threading
+from typing import Iterator
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# a counter is enough for nonces, since the key is never reused after the session
+NONCE = struct.Struct("<Q4x")
+TAG_SIZE = 16
+# how much bigger sealed data is than the data itself
+OVERHEAD = NONCE.size + TAG_SIZE
+
+_cipher = AESGCM(AESGCM.generate_key(256))
+_nonces = itertools.count()
+
+
+def seal(data: bytes) -> bytes:
+    """
+    Encrypts data with the session key.
+    """
+
+    nonce = NONCE.pack(next(_nonces))
+    return nonce + _cipher.encrypt(nonce, data, None)
+
+
+def unseal(sealed: bytes) -> bytes:
+    """
+    Decrypts data encrypted by `seal`.
+    """
+    return _cipher.decrypt(sealed[:NONCE.size], sealed[NONCE.size:], None)
+
+
+class SealedField:
+    """
+    Descriptor of a string field stored in a slot encrypted with the session key.
+
+    The value can also be assigned as utf-8 encoded bytes, so that codecs don't need
+    to create a string just to encrypt it.
+    """
+
+    def __init__(self, slot):
+        """
+        :param slot: descriptor of the slot that holds the sealed value.
+        """
+        self.slot = slot
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return self.utf8(instance).decode()
+
+    def __set__(self, instance, value: str | bytes):
+        if isinstance(value, str):
+            value = value.encode()
+        self.slot.__set__(instance, seal(value))
+
+    def utf8(self, instance) -> bytes:
+        """
+        :return: the value utf-8 encoded.
+        """
+        return unseal(self.slot.__get__(instance))
+
+
+class SealedFile:
+    """
+    Anonymous temporary file holding data encrypted with the session key in chunks.
+
+    The file is removed as soon as it's closed, or the process exits. Chunks are
+    appended with `write` and read back with `read`, possibly from several threads.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        # offsets and sizes of the sealed chunks
+        self._chunks: list[tuple[int, int]] = []
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def write(self, data: bytes):
+        sealed = seal(data)
+        with self._lock:
+            offset = self._file.seek(0, 2)
+            self._file.write(sealed)
+            self._chunks.append((offset, len(sealed)))
+        self.size += len(data)
+
+    def read(self) -> Iterator[bytes]:
+        """
+        Yields the written chunks decrypted.
+        """
+
+        for offset, size in self._chunks:
+            with self._lock:
+                self._file.seek(offset)
+                sealed = self._file.read(size)
+            yield unseal(sealed)
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,137 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Codecs used to serialize accounts stored in version 2 .dba files.
+
+Every account is serialized into a separate record. Attached files aren't part of the
+record, only their names and ids of the streams they are stored in.
+"""
+
+from __future__ import annotations
+
+import json
+import struct
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from core.database_utils import Account
+
+# fields of an account in the same order as Account constructor arguments
+# (except attached files), with names used in json
+ACCOUNT_FIELDS = ("account", "name", "email", "password", "date", "comment", "copy_email")
+# fields that Account keeps encrypted in memory, they can be passed to it as utf-8 bytes
+SECRET_FIELDS = ("password", "comment")
+
+# account fields together with ids of attached files streams
+AccountRecord = tuple[tuple, dict[str, int]]
+
+
+class Codec(ABC):
+    """
+    Converts accounts to records and back.
+    """
+
+    name: str
+
+    @abstractmethod
+    def encode(self, account: "Account", attached_files: dict[str, int]) -> bytes:
+        ...
+
+    @abstractmethod
+    def decode(self, record: bytes) -> AccountRecord:
+        """
+        :return: a tuple of account fields (suitable as Account constructor arguments)
+        and dict mapping names of attached files to their stream ids.
+        """
+
+
+class JsonCodec(Codec):
+    """
+    Stores account as json object, same as legacy .dba files do.
+    """
+
+    name = "json"
+
+    def encode(self, account: "Account", attached_files: dict[str, int]) -> bytes:
+        return json.dumps(account.to_dict(attached_files=attached_files)).encode()
+
+    def decode(self, record: bytes) -> AccountRecord:
+        account_dict = json.loads(record)
+        fields = tuple(account_dict[name] for name in ACCOUNT_FIELDS)
+        return fields, account_dict["attach_files"]
+
+
+class BinaryCodec(Codec):
+    """
+    Stores account as length prefixed utf-8 strings.
+
+    The record starts with lengths of string fields, `copy_email` flag and number of
+    attached files, followed by the strings, then the name length and stream id of every
+    attached file followed by its name.
+    """
+
+    name = "binary"
+
+    HEADER = struct.Struct("<6IBI")
+    FILE = struct.Struct("<II")
+    # which of the string fields are secret, they're decoded by Account when needed
+    SECRET = tuple(name in SECRET_FIELDS for name in ACCOUNT_FIELDS[:6])
+
+    def encode(self, account: "Account", attached_files: dict[str, int]) -> bytes:
+        strings = [
+            account.accountname.encode(),
+            account.username.encode(),
+            account.email.encode(),
+            account.utf8("password"),
+            account.birthdate.encode(),
+            account.utf8("notes"),
+        ]
+        parts = [
+            self.HEADER.pack(*map(len, strings), account.copy_email, len(attached_files)),
+            *strings,
+        ]
+        for file, stream in attached_files.items():
+            name = file.encode()
+            parts.append(self.FILE.pack(len(name), stream))
+            parts.append(name)
+        return b"".join(parts)
+
+    def decode(self, record: bytes) -> AccountRecord:
+        *lengths, copy_email, files_count = self.HEADER.unpack_from(record)
+        view = memoryview(record)
+        position = self.HEADER.size
+
+        fields = []
+        for length, secret in zip(lengths, self.SECRET):
+            end = position + length
+            fields.append(bytes(view[position:end]) if secret else str(view[position:end], "utf-8"))
+            position = end
+        fields.append(bool(copy_email))
+
+        attached_files = {}
+        for _ in range(files_count):
+            length, stream = self.FILE.unpack_from(record, position)
+            position += self.FILE.size
+            end = position + length
+            attached_files[str(view[position:end], "utf-8")] = stream
+            position = end
+        return tuple(fields), attached_files
+
+
+CODECS: dict[str, Codec] = {codec.name: codec for codec in (JsonCodec(), BinaryCodec())}
+DEFAULT_CODEC = BinaryCodec.name
@@ -25,6 +25,8 @@ from typing import TYPE_CHECKING
 from gi.repository import Gtk
 
 from core import SRC_DIR
+from core.compression import DEFAULT_ALGORITHM, DEFAULT_LEVEL, Compression
+from core.database_utils import CONTAINER_ENGINE
 from core.gtk_utils import GladeTemplate
 
 if TYPE_CHECKING:
@@ -37,6 +39,10 @@ class SettingsDialog(GladeTemplate):
     general_font: Gtk.FontButton
     mono_font: Gtk.FontButton
     main_db: Gtk.Switch
+    compression: Gtk.ComboBoxText
+    compression_level: Gtk.SpinButton
+    backups: Gtk.SpinButton
+    engine: Gtk.ComboBoxText
     # </editor-fold>
 
     def __init__(self, main_window: "MainWindow"):
@@ -67,13 +73,21 @@ class SettingsDialog(GladeTemplate):
         self.general_font.font = self.gtk_font(config.general_font)
         self.mono_font.font = self.gtk_font(config.monospace_font)
         self.main_db.active = config.main_db
+        self.compression.active_id = config.compression
+        self.compression_level.value = config.compression_level
+        self.backups.value = config.backups
+        self.engine.active_id = config.engine
 
     def on_save(self, _=None):
-        """ Saves fonts to settings.json and applies changes. """
+        """ Saves settings to settings.json and applies changes. """
         config = self.main_window.config
         config.general_font = self.css_font(self.general_font)
         config.monospace_font = self.css_font(self.mono_font)
         config.main_db = self.main_db.active
+        config.compression = self.compression.active_id
+        config.compression_level = int(self.compression_level.value)
+        config.backups = int(self.backups.value)
+        config.engine = self.engine.active_id
 
         config.save()
         self.main_window.load_css()
@@ -90,6 +104,12 @@ class Config:
     main_db = False
     general_font = '30px "Ubuntu"'
     monospace_font = '35px "Ubuntu Mono"'
+    compression = DEFAULT_ALGORITHM
+    compression_level = DEFAULT_LEVEL
+    # how many previous versions of .dba files to keep
+    backups = 0
+    # storage engine of new databases, see core.database_utils.ENGINES
+    engine = CONTAINER_ENGINE
 
     def __post_init__(self):
         self.load()
@@ -109,6 +129,14 @@ class Config:
 
         self.__dict__ = settings
 
+    def get_compression(self) -> Compression:
+        """ Returns compression to save databases with. """
+        try:
+            return Compression(self.compression, self.compression_level)
+        except ValueError:
+            logging.error(traceback.format_exc())
+            return Compression()
+
     def save(self):
         """ Saves settings to settings.json """
         path = Path(SRC_DIR) / "settings.json"
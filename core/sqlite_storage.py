@@ -0,0 +1,376 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Stores databases in SQLite files, as an alternative to the .dba container.
+
+The header (the same as the one of the container, see core.container.Header) is kept
+as json in the `meta` table. Every account is a row of the `accounts` table encrypted
+separately with AES-GCM, so that a changed account is written without touching the rest
+of the database. Attached files are split into chunks, every chunk is a row of
+the `attachments` table. The first chunk also holds the digest of the content (see
+core.container.attachment_digest), attachments with the same content are stored once.
+
+Names and emails of the accounts are stored only as blind indexes: HMAC of the value
+keyed with a key derived from the data key. They reveal nothing about the values except
+whether two of them are equal, while the name still identifies the row of the account,
+so that a changed or deleted account is written without decrypting other rows.
+
+SQLite files keep the .dba extension, `is_sqlite` tells them apart from containers.
+"""
+
+from __future__ import annotations
+
+import hmac
+import json
+import os
+import sqlite3
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from core.compression import DEFAULT_LEVEL, Compression, decompressor
+from core.container import NONCE_SIZE, CorruptedContainer, Header, derive_subkey
+from core.file_utils import fsync_directory, rotate_backups
+
+SQLITE_MAGIC = b"SQLite format 3\x00"
+CHUNK_SIZE = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE accounts (
+    name BLOB PRIMARY KEY,
+    email BLOB NOT NULL,
+    record BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX accounts_email ON accounts (email);
+CREATE TABLE attachments (
+    id INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    final INTEGER NOT NULL,
+    account BLOB NOT NULL,
+    digest BLOB,
+    content BLOB NOT NULL,
+    PRIMARY KEY (id, number)
+);
+CREATE INDEX attachments_account ON attachments (account);
+CREATE INDEX attachments_digest ON attachments (digest);
+"""
+
+# associated data of attachment chunks: attachment id, chunk number and final flag
+CHUNK_AAD = struct.Struct("<QI?")
+
+
+def is_sqlite(file: BinaryIO) -> bool:
+    """
+    Checks whether given file is an SQLite database, leaves file position unchanged.
+    """
+
+    position = file.tell()
+    magic = file.read(len(SQLITE_MAGIC))
+    file.seek(position)
+    return magic == SQLITE_MAGIC
+
+
+class SqliteStorage:
+    """
+    Reads and writes accounts of an SQLite database.
+
+    The connection is kept open, so that attached files can be read even after the file
+    has been replaced (e.g. when the database is re-created). It can be used from several
+    threads, but only from one at a time.
+    """
+
+    def __init__(self, path: str | os.PathLike, key: bytes | None = None):
+        """
+        :param key: the data key, without it only the header can be read.
+        """
+
+        self.path = Path(path)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.stat = os.stat(self.path)
+        self.key = None
+        if key is not None:
+            self.unlock(key)
+
+    def unlock(self, key: bytes):
+        """
+        Prepares the keys needed to read and write accounts.
+        :param key: the data key.
+        """
+
+        self.key = key
+        self.cipher = AESGCM(derive_subkey(key, b"records"))
+        self.index_key = derive_subkey(key, b"blind index")
+        # the compression algorithm never changes, so the header is read only once
+        self.algorithm = self.header.compression
+
+    @staticmethod
+    def create(path: str | os.PathLike, header: Header, key: bytes) -> "SqliteStorage":
+        """
+        Creates an empty SQLite database in a temporary file next to `path`, once it's
+        filled call `commit` to replace `path` with it.
+        """
+
+        path = Path(path)
+        tmp_file = path.with_name(f"{path.name}.tmp")
+        tmp_file.unlink(missing_ok=True)
+
+        storage = SqliteStorage(tmp_file)
+        with storage.transaction():
+            storage.connection.executescript(SCHEMA)
+            storage.connection.execute(
+                "INSERT INTO meta VALUES ('header', ?)", (json.dumps(header.to_dict()),),
+            )
+        storage.unlock(key)
+        storage.target = path
+        return storage
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Context manager that commits changes made inside it at once, or rolls them back
+        on errors.
+        """
+
+        with self.lock, self.connection:
+            yield
+
+    def commit(self, backups: int = 0):
+        """
+        Replaces the file given to `create` with the created database.
+        :param backups: how many previous versions of the file to keep.
+        """
+
+        self.connection.commit()
+        self.connection.close()
+        with open(self.path, "rb") as file:
+            os.fsync(file.fileno())
+
+        rotate_backups(self.target, backups)
+        os.replace(self.path, self.target)
+        fsync_directory(self.target.parent)
+
+        self.path = self.target
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.stat = os.stat(self.path)
+
+    def rollback(self):
+        """
+        Removes database created by `create`.
+        """
+
+        self.connection.close()
+        self.path.unlink(missing_ok=True)
+
+    @property
+    def header(self) -> Header:
+        try:
+            with self.lock:
+                row = self.connection.execute(
+                    "SELECT value FROM meta WHERE name = 'header'",
+                ).fetchone()
+            return Header.from_dict(json.loads(row[0]))
+        except (sqlite3.DatabaseError, TypeError, ValueError, KeyError) as err:
+            raise CorruptedContainer("The header of the file is damaged.") from err
+
+    def replace_header(self, header: Header):
+        with self.transaction():
+            self.connection.execute(
+                "UPDATE meta SET value = ? WHERE name = 'header'",
+                (json.dumps(header.to_dict()),),
+            )
+
+    def is_file(self, path: str | os.PathLike) -> bool:
+        """
+        Checks whether the storage reads from given file (and not e.g. from the file
+        it has replaced).
+        """
+
+        try:
+            return os.path.samestat(self.stat, os.stat(path))
+        except FileNotFoundError:
+            return False
+
+    def blind_index(self, value: str) -> bytes:
+        return hmac.digest(self.index_key, value.encode(), "sha256")
+
+    def encrypt(self, data: bytes, aad: bytes) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self.cipher.encrypt(nonce, data, aad)
+
+    def decrypt(self, data: bytes, aad: bytes) -> bytes:
+        try:
+            return self.cipher.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], aad)
+        except InvalidTag as err:
+            raise CorruptedContainer("The database is damaged.") from err
+
+    def compress(self, data: bytes, level: int) -> bytes:
+        compressor = Compression(self.algorithm, level).compressor()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        return decompressor(self.algorithm).decompress(data)
+
+    def records(self) -> Iterator[bytes]:
+        """
+        Decrypts serialized accounts one by one.
+        """
+
+        with self.lock:
+            rows = self.connection.execute("SELECT name, record FROM accounts").fetchall()
+        for name, record in rows:
+            yield self.decompress(self.decrypt(record, name))
+
+    def upsert(
+            self,
+            name: str,
+            email: str,
+            record: bytes,
+            attachments: Iterable[int],
+            level: int = DEFAULT_LEVEL,
+    ):
+        """
+        Writes serialized account, replacing the one with the same name.
+        :param attachments: ids of the attachments the account refers to.
+        :param level: compression level.
+        """
+
+        index = self.blind_index(name)
+        record = self.encrypt(self.compress(record, level), index)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)",
+                (index, self.blind_index(email), record),
+            )
+            self.connection.executemany(
+                "UPDATE attachments SET account = ? WHERE id = ?",
+                ((index, attachment) for attachment in attachments),
+            )
+
+    def delete(self, name: str):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM accounts WHERE name = ?", (self.blind_index(name),),
+            )
+
+    def add_attachment(
+            self,
+            stream: int,
+            account: str,
+            chunks: Iterable[bytes],
+            digest: bytes,
+            level: int = DEFAULT_LEVEL,
+    ):
+        """
+        Writes content of attached file of given account.
+        :param stream: id of the attachment, see `next_attachment`.
+        :param digest: digest of the content.
+        """
+
+        index = self.blind_index(account)
+        buffer = bytearray()
+        number = 0
+        with self.lock:
+            for chunk in chunks:
+                buffer += chunk
+                while len(buffer) > CHUNK_SIZE:
+                    data = bytes(buffer[:CHUNK_SIZE])
+                    del buffer[:CHUNK_SIZE]
+                    self._write_chunk(stream, number, False, index, digest, data, level)
+                    number += 1
+            self._write_chunk(stream, number, True, index, digest, bytes(buffer), level)
+
+    def _write_chunk(
+            self,
+            stream: int,
+            number: int,
+            final: bool,
+            account: bytes,
+            digest: bytes,
+            data: bytes,
+            level: int,
+    ):
+        content = self.encrypt(self.compress(data, level), CHUNK_AAD.pack(stream, number, final))
+        self.connection.execute(
+            "INSERT INTO attachments VALUES (?, ?, ?, ?, ?, ?)",
+            (stream, number, final, account, digest if number == 0 else None, content),
+        )
+
+    def find_attachment(self, digest: bytes) -> int | None:
+        """
+        :return: id of the attachment with given digest of the content, if there is one.
+        """
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id FROM attachments WHERE digest = ?", (digest,),
+            ).fetchone()
+        return row and row[0]
+
+    def digests(self) -> dict[int, bytes]:
+        """
+        :return: digests of the attachments mapped by their ids.
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, digest FROM attachments WHERE number = 0",
+            ).fetchall()
+        return dict(rows)
+
+    def next_attachment(self) -> int:
+        with self.lock:
+            row = self.connection.execute("SELECT MAX(id) FROM attachments").fetchone()
+        return (row[0] or 0) + 1
+
+    def delete_attachments(self, attachments: Iterable[int]):
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM attachments WHERE id = ?",
+                ((attachment,) for attachment in attachments),
+            )
+
+    def read_stream(self, stream: int, workers: int = 1) -> Iterator[bytes]:
+        """
+        Decrypts content of the attachment chunk by chunk.
+
+        Has the same signature as core.container.StreamSource.read_stream, so that
+        attachments can be read from either of them.
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT number, final, content FROM attachments WHERE id = ? ORDER BY number",
+                (stream,),
+            ).fetchall()
+        if not rows or not rows[-1][1]:
+            raise CorruptedContainer("The attached file is damaged.")
+
+        for expected, (number, final, content) in enumerate(rows):
+            if number != expected:
+                raise CorruptedContainer("The attached file is damaged.")
+            aad = CHUNK_AAD.pack(stream, number, bool(final))
+            yield self.decompress(self.decrypt(content, aad))
+
+    def close(self):
+        self.connection.close()
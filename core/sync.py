@@ -0,0 +1,359 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Synchronizes .dba files with a target: a directory (e.g. a mounted network share) or an
+HTTP server that supports GET, PUT and HEAD requests.
+
+Files are split into chunks at boundaries defined by their content (see `split`), so
+that a change in a file changes only the chunks around it. Saving a database usually
+appends to its file (see core.database_utils.Database.save_changes), then only the
+chunks at the end of the file are new. Only chunks the other side doesn't have are
+transferred.
+
+The target stores every chunk once, named by its SHA-256 digest, together with a
+manifest of every file listing its chunks. Chunks are checked against their digests
+when they arrive, and the whole file against the digest from the manifest. The files
+are encrypted, so the target never sees the accounts.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+import core
+from core.file_utils import atomic_write
+
+# a chunk boundary is put after a byte where both rolling hashes ending at it are zero,
+# which happens every 64 KiB on average; a hash XORs together the values its table in
+# HASH_TABLES maps the last bytes (as many as its HASH_WINDOWS) to; the windows differ in
+# length so that a run of repeated bytes, which cancel out in an even window, isn't a boundary
+HASH_TABLES = tuple(hashlib.shake_256(b"PyAccounts chunks %d" % i).digest(256) for i in range(2))
+HASH_WINDOWS = (32, 31)
+HASH_WINDOW = max(HASH_WINDOWS)
+# the hashes are computed for this many bytes at once
+SCAN_SIZE = 64 * 1024
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+CHUNKS_DIR = "chunks"
+HTTP_TIMEOUT = 30
+
+
+class SyncError(Exception):
+    """
+    Raised when data received from the target is damaged.
+    """
+
+
+def split(content: bytes | mmap.mmap) -> Iterator[tuple[int, int]]:
+    """
+    Splits content into chunks at boundaries defined by the content itself, so inserting
+    or appending data changes only the chunks around it.
+    :return: offsets and sizes of the chunks.
+    """
+
+    start = 0
+    size = len(content)
+    while start < size:
+        end = min(start + MAX_CHUNK_SIZE, size)
+        boundary = find_boundary(content, start + MIN_CHUNK_SIZE - 1, end)
+        if boundary != -1:
+            end = boundary
+        yield start, end - start
+        start = end
+
+
+def find_boundary(content: bytes | mmap.mmap, start: int, end: int) -> int:
+    """
+    Finds the first chunk boundary after a byte in content[start:end], `start` must be
+    at least HASH_WINDOW - 1.
+
+    The hashes are computed for SCAN_SIZE bytes at once with operations on the whole part
+    of the content (see `window_xor`), rather than byte by byte.
+    :return: offset of the boundary, -1 if there is none.
+    """
+
+    for scan in range(start, end, SCAN_SIZE):
+        # bytes before the scanned ones are needed to hash the first of them
+        part = content[scan - HASH_WINDOW + 1:min(scan + SCAN_SIZE, end)]
+
+        hashes = 0
+        for table, length in zip(HASH_TABLES, HASH_WINDOWS):
+            hashes |= window_xor(int.from_bytes(part.translate(table), "big"), length)
+        found = hashes.to_bytes(len(part), "big").find(b"\x00", HASH_WINDOW - 1)
+        if found != -1:
+            return scan - HASH_WINDOW + 1 + found + 1
+    return -1
+
+
+def window_xor(values: int, length: int) -> int:
+    """
+    XORs every byte with `length - 1` bytes before it, taking O(log(length)) operations.
+    :param values: bytes as a big-endian integer, so that earlier bytes are higher.
+    :return: the results as a big-endian integer of the same size; the first `length - 1`
+    bytes of it are XORs of fewer bytes.
+    """
+
+    result = 0
+    # number of bytes XORed into result so far and into every byte of `values`
+    done = 0
+    width = 1
+    while length:
+        if length & 1:
+            result ^= values >> (8 * done)
+            done += width
+        length >>= 1
+        if length:
+            values ^= values >> (8 * width)
+            width *= 2
+    return result
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@dataclass
+class Manifest:
+    """
+    Lists chunks of a file.
+    """
+
+    # digests and sizes of the chunks in order
+    chunks: list[tuple[str, int]] = field(default_factory=list)
+    # digest of the whole file
+    digest: str = ""
+
+    @property
+    def size(self) -> int:
+        return sum(size for _, size in self.chunks)
+
+    def dumps(self) -> bytes:
+        return json.dumps({"chunks": self.chunks, "digest": self.digest}).encode()
+
+    @staticmethod
+    def loads(data: bytes) -> "Manifest":
+        try:
+            _dict = json.loads(data)
+            chunks = [(str(chunk), int(size)) for chunk, size in _dict["chunks"]]
+            return Manifest(chunks, str(_dict["digest"]))
+        except (ValueError, KeyError, TypeError) as err:
+            raise SyncError("The manifest is damaged.") from err
+
+
+class LocalFile:
+    """
+    Chunks of a local file, the file is mapped into memory while it's open.
+    """
+
+    def __init__(self, path: Path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.content = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if size else b""
+        self.chunks: dict[str, tuple[int, int]] = {}
+        self.manifest = Manifest()
+
+        file_digest = hashlib.sha256()
+        for start, size in split(self.content):
+            chunk = self.content[start:start + size]
+            file_digest.update(chunk)
+            chunk_digest = digest(chunk)
+            self.chunks.setdefault(chunk_digest, (start, size))
+            self.manifest.chunks.append((chunk_digest, size))
+        self.manifest.digest = file_digest.hexdigest()
+
+    def chunk(self, chunk_digest: str) -> bytes:
+        start, size = self.chunks[chunk_digest]
+        return self.content[start:start + size]
+
+    def close(self):
+        if isinstance(self.content, mmap.mmap):
+            self.content.close()
+        self.file.close()
+
+    def __enter__(self) -> "LocalFile":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Target(ABC):
+    """
+    Place databases are synchronized with, stores objects by their names.
+    """
+
+    @abstractmethod
+    def get(self, name: str) -> bytes | None:
+        """
+        :return: content of the object, None if it doesn't exist.
+        """
+
+    @abstractmethod
+    def put(self, name: str, data: bytes):
+        ...
+
+    @abstractmethod
+    def exists(self, name: str) -> bool:
+        ...
+
+
+class DirectoryTarget(Target):
+    """
+    Stores objects as files in a directory.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+
+    def get(self, name: str) -> bytes | None:
+        try:
+            return (self.path / name).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, name: str, data: bytes):
+        path = self.path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(path) as file:
+            file.write(data)
+
+    def exists(self, name: str) -> bool:
+        return (self.path / name).exists()
+
+
+class HttpTarget(Target):
+    """
+    Stores objects on an HTTP server, objects are read with GET requests and written
+    with PUT requests to their names relative to the base url.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def request(self, method: str, name: str, data: bytes | None = None) -> bytes | None:
+        request = urllib.request.Request(f"{self.url}/{name}", data, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT) as response:
+                return response.read()
+        except urllib.error.HTTPError as err:
+            if err.code == 404:
+                return None
+            raise
+
+    def get(self, name: str) -> bytes | None:
+        return self.request("GET", name)
+
+    def put(self, name: str, data: bytes):
+        self.request("PUT", name, data)
+
+    def exists(self, name: str) -> bool:
+        return self.request("HEAD", name) is not None
+
+
+@dataclass
+class SyncResult:
+    """
+    What was transferred while synchronizing a database.
+    """
+
+    # size of the file
+    size: int = 0
+    # number of chunks and bytes transferred
+    chunks: int = 0
+    transferred: int = 0
+
+
+def chunk_name(chunk_digest: str) -> str:
+    return f"{CHUNKS_DIR}/{chunk_digest}"
+
+
+def manifest_name(name: str) -> str:
+    return f"{name}.manifest"
+
+
+def push(name: str, target: Target) -> SyncResult:
+    """
+    Sends .dba file of the database from SRC_DIR to the target, sending only chunks
+    the target doesn't have.
+    """
+
+    remote = target.get(manifest_name(name))
+    remote_chunks = {chunk for chunk, _ in Manifest.loads(remote).chunks} if remote else set()
+
+    with LocalFile(core.SRC_DIR / f"{name}.dba") as local:
+        result = SyncResult(local.manifest.size)
+        for chunk_digest in local.chunks:
+            if chunk_digest in remote_chunks or target.exists(chunk_name(chunk_digest)):
+                continue
+            chunk = local.chunk(chunk_digest)
+            target.put(chunk_name(chunk_digest), chunk)
+            result.chunks += 1
+            result.transferred += len(chunk)
+        # the manifest is written last, so the target never lists missing chunks
+        target.put(manifest_name(name), local.manifest.dumps())
+    return result
+
+
+def pull(name: str, target: Target, backups: int = 0) -> SyncResult:
+    """
+    Receives .dba file of the database from the target to SRC_DIR, receiving only chunks
+    the local file doesn't have. The local file is replaced atomically.
+    :param backups: how many previous versions of the local file to keep.
+    :raises SyncError: if the target doesn't have the database or the received data
+    is damaged.
+    """
+
+    remote = target.get(manifest_name(name))
+    if remote is None:
+        raise SyncError(f"There is no database {name} to pull.")
+    manifest = Manifest.loads(remote)
+    result = SyncResult(manifest.size)
+
+    path = core.SRC_DIR / f"{name}.dba"
+    local = LocalFile(path) if path.exists() else None
+    try:
+        if local and local.manifest == manifest:
+            return result
+
+        file_digest = hashlib.sha256()
+        with atomic_write(path, backups) as file:
+            for chunk_digest, size in manifest.chunks:
+                if local and chunk_digest in local.chunks:
+                    chunk = local.chunk(chunk_digest)
+                else:
+                    chunk = target.get(chunk_name(chunk_digest))
+                    if chunk is None or len(chunk) != size or digest(chunk) != chunk_digest:
+                        raise SyncError(f"Chunk {chunk_digest} of {name} is damaged.")
+                    result.chunks += 1
+                    result.transferred += len(chunk)
+                file_digest.update(chunk)
+                file.write(chunk)
+            if file_digest.hexdigest() != manifest.digest:
+                raise SyncError(f"The file of {name} is damaged.")
+    finally:
+        if local:
+            local.close()
+    return result
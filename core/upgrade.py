@@ -0,0 +1,161 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Upgrades legacy .dba files to the current format.
+
+Run from the project root:
+    python -m core.upgrade [directory]
+
+Asks for passwords of the legacy databases found in the directory (SRC_DIR by default),
+then converts them in parallel. Every file is replaced atomically, keeping the legacy
+file as `<name>.dba.1`. The converted file is opened again and compared with the legacy
+one, if they differ the legacy file is put back.
+"""
+
+import getpass
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import core
+from core.compression import Compression
+from core.database_utils import LEGACY_FORMAT, Accounts, Database, detect_format
+
+
+class UpgradeError(Exception):
+    """
+    Raised when the converted file doesn't match the legacy one.
+    """
+
+
+def legacy_databases(directory: Path) -> list[str]:
+    """
+    :return: names of the legacy databases in given directory.
+    """
+
+    names = []
+    for path in sorted(directory.glob("*.dba")):
+        with open(path, "rb") as file:
+            if detect_format(file) == LEGACY_FORMAT:
+                names.append(path.stem)
+    return names
+
+
+def attachment_digests(accounts: Accounts) -> dict[tuple[str, str], bytes]:
+    """
+    :return: digests of the content of attached files mapped by names of the accounts and
+    the files.
+    """
+
+    digests = {}
+    for account in accounts.values():
+        for file, attachment in account.attached_files.items():
+            digest = hashlib.sha256()
+            for chunk in attachment.chunks():
+                digest.update(chunk)
+            digests[account.accountname, file] = digest.digest()
+    return digests
+
+
+def upgrade_database(name: str, password: str, compression: Compression = Compression()):
+    """
+    Converts legacy database from SRC_DIR to the current format, keeping the legacy file
+    as a backup.
+    :raises UpgradeError: if the converted file doesn't match the legacy one, the legacy
+    file is restored then.
+    """
+
+    db = Database(name)
+    db.open(password)
+    # once the file is converted the attachments are read from it, so they're compared
+    # with the content read from the legacy file
+    digests = attachment_digests(db.accounts)
+    db.create(compression, backups=1)
+    backup = db.dba_file.with_name(f"{db.dba_file.name}.1")
+
+    converted = Database(name, _key_cache=db._key_cache)
+    try:
+        converted.open(password)
+        if converted.accounts != db.accounts \
+                or attachment_digests(converted.accounts) != digests:
+            raise UpgradeError(f"Converted database {name} doesn't match the legacy one.")
+    except Exception:
+        os.replace(backup, db.dba_file)
+        raise
+    finally:
+        converted.close()
+        db.close()
+
+
+def set_src_dir(directory: Path):
+    core.SRC_DIR = directory
+
+
+def upgrade_databases(
+        directory: Path,
+        passwords: dict[str, str],
+        workers: int | None = None,
+) -> dict[str, Exception | None]:
+    """
+    Converts legacy databases in parallel, see `upgrade_database`.
+    :param passwords: passwords of the databases mapped by their names.
+    :return: errors of the databases that weren't converted (None for the ones that were)
+    mapped by their names.
+    """
+
+    results = {}
+    with ProcessPoolExecutor(workers, initializer=set_src_dir, initargs=(directory,)) as executor:
+        futures = {
+            name: executor.submit(upgrade_database, name, password)
+            for name, password in passwords.items()
+        }
+        for name, future in futures.items():
+            try:
+                future.result()
+                results[name] = None
+            except Exception as err:
+                results[name] = err
+    return results
+
+
+def main(argv: list[str]) -> int:
+    directory = Path(argv[1]) if len(argv) > 1 else core.SRC_DIR
+    names = legacy_databases(directory)
+    if not names:
+        print(f"There are no legacy databases in {directory}.")
+        return 0
+
+    passwords = {}
+    for name in names:
+        password = getpass.getpass(f"Password of {name} (leave empty to skip): ")
+        if password:
+            passwords[name] = password
+
+    status = 0
+    for name, error in upgrade_databases(directory, passwords).items():
+        if error is None:
+            print(f"{name}: upgraded, the legacy file is kept as {name}.dba.1")
+        else:
+            print(f"{name}: not upgraded, {type(error).__name__}: {error}")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -17,11 +17,7 @@
 """
 Contains custom GTK widgets.
 """
-import base64
-import logging
 import re
-import tempfile
-import traceback
 import typing
 from datetime import datetime
 
@@ -30,7 +26,7 @@ from gi.repository import Gtk, Gdk, GLib
 from core.about import AboutDialog
 from core.database_utils import Database
 from core.generate_password import GenPassDialog
-from core.gtk_utils import GladeTemplate, load_icon, add_list_item, get_mime_icon
+from core.gtk_utils import GladeTemplate, load_icon, add_list_item, get_mime_icon_by_name
 from core.settings import SettingsDialog, Config
 
 if typing.TYPE_CHECKING:
@@ -295,19 +291,12 @@ class AttachedFilesMixin:
     def load_attached_files(self, attached_files: dict[str, typing.Any]):
         """
         Populates attached_files list with attached files.
+
+        Icons are chosen by file names, so that the attached files aren't decrypted.
         """
 
         for file in attached_files:
-            tmp = tempfile.NamedTemporaryFile("wb")
-            try:
-                data = attached_files[file].encode()
-                content = base64.b64decode(data)
-                tmp.write(content)
-                tmp.flush()
-            except Exception:
-                logging.error(traceback.format_exc())
-
-            icon = get_mime_icon(tmp.name)
+            icon = get_mime_icon_by_name(file)
             add_list_item(self.attached_files, icon.pixbuf, file)
 
 
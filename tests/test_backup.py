@@ -0,0 +1,205 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from core.backup import (
+    KEY_FILE,
+    BackupError,
+    Repository,
+    auto_backup,
+    main,
+)
+from core.container import CorruptedContainer
+from core.database_utils import Account, Database
+from core.kdf import KdfParams
+
+# cheap key derivation, so that the tests don't take long
+KDF = KdfParams(bytes(16), "pbkdf2-sha256", iterations=1000)
+
+
+@pytest.fixture
+def db(src_dir) -> Database:
+    accounts = {
+        f"account{i}": Account(
+            f"account{i}", "user", "user@example.com", os.urandom(8).hex(), "01.01.2000",
+            os.urandom(100).hex(), False, {},
+        )
+        for i in range(10_000)
+    }
+    Database("main", "123", accounts).create()
+    (src_dir / "settings.json").write_text("{}")
+    db = Database("main")
+    db.open("123")
+    return db
+
+
+def change_account(db: Database):
+    db.accounts["account1"] = Account("account1", os.urandom(8).hex(), "", "", "", "", False, {})
+    db.save_changes()
+
+
+@pytest.fixture
+def repository(tmp_path) -> Repository:
+    return Repository.init(tmp_path / "repository", "secret", KDF)
+
+
+def chunk_files(repository: Repository) -> list:
+    return list((repository.path / "chunks").glob("*/*"))
+
+
+def test_open(repository):
+    assert Repository.open(repository.path, "secret").key == repository.key
+    with pytest.raises(CorruptedContainer):
+        Repository.open(repository.path, "wrong")
+    with pytest.raises(BackupError):
+        Repository.init(repository.path, "secret", KDF)
+    with pytest.raises(BackupError):
+        Repository.open(repository.path / "missing", "secret")
+
+
+def test_backup_restore(db, repository, src_dir, tmp_path):
+    snapshot = repository.backup()
+    assert set(snapshot.files) == {"main.dba", "settings.json"}
+    assert snapshot.added_size == snapshot.size
+
+    # nothing is stored in the clear
+    content = db.dba_file.read_bytes()
+    for path in chunk_files(repository):
+        assert path.read_bytes()[12:] not in content
+
+    restored = tmp_path / "restored"
+    repository.restore(snapshot.name, restored)
+    assert (restored / "main.dba").read_bytes() == content
+    assert (restored / "settings.json").read_text() == "{}"
+
+    with pytest.raises(BackupError):
+        repository.restore(snapshot.name, restored, ["missing.dba"])
+    with pytest.raises(BackupError):
+        repository.restore("missing", restored)
+
+
+def test_incremental_backup(db, repository):
+    # the first save starts the history of the database
+    change_account(db)
+    first = repository.backup()
+    second = repository.backup()
+    assert second.added_size == 0
+    assert second.files == first.files
+
+    change_account(db)
+    # only the newest snapshot is read
+    with patch.object(Repository, "snapshot", wraps=repository.snapshot) as snapshot:
+        third = repository.backup()
+    snapshot.assert_called_once_with(second.name)
+    # chunks at the end of the database and its history are stored again
+    assert 0 < third.added_size < third.size / 4
+    assert repository.snapshot_names() == [first.name, second.name, third.name]
+
+
+def test_restore_damaged(db, repository, tmp_path):
+    snapshot = repository.backup()
+    path = chunk_files(repository)[0]
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 1
+    path.write_bytes(data)
+
+    with pytest.raises(BackupError):
+        repository.restore(snapshot.name, tmp_path / "restored")
+
+
+def test_prune(db, repository, tmp_path):
+    repository.backup()
+    change_account(db)
+    repository.backup()
+
+    db.create()
+    last = repository.backup()
+    removed, chunks = repository.prune(keep=1)
+    assert len(removed) == 2
+    assert chunks > 0
+    assert [s.name for s in repository.snapshots()] == [last.name]
+    # only the chunks of the remaining snapshot are kept
+    assert len(chunk_files(repository)) == len({
+        chunk for entry in last.files.values() for chunk in entry.chunks
+    })
+    repository.restore(last.name, tmp_path / "restored")
+    assert (tmp_path / "restored" / "main.dba").read_bytes() == db.dba_file.read_bytes()
+
+    with pytest.raises(BackupError):
+        repository.prune(keep=0)
+    # snapshots taken after pruning still come after the kept ones
+    after = repository.backup()
+    assert repository.snapshot_names() == [last.name, after.name]
+
+
+def test_concurrent_backups(db, repository, tmp_path):
+    repository.backup()
+    change_account(db)
+    with ThreadPoolExecutor(3) as executor:
+        backups = [executor.submit(repository.backup) for _ in range(2)]
+        executor.submit(repository.prune, 1).result()
+        names = {future.result().name for future in backups}
+
+    assert len(names) == 2
+    assert not list(repository.path.rglob("*.tmp"))
+    # chunks of the kept snapshots are never pruned
+    for name in repository.snapshot_names():
+        repository.restore(name, tmp_path / name)
+
+
+def test_auto_backup(db, repository, src_dir):
+    assert auto_backup() is None
+
+    repository.save_key()
+    snapshot = auto_backup()
+    assert KEY_FILE not in snapshot.files
+    assert repository.snapshots() == [snapshot]
+
+    # errors are only logged
+    (src_dir / KEY_FILE).write_text('{"repository": "/missing", "key": ""}')
+    assert auto_backup() is None
+
+
+def test_auto_backup_prune(db, repository):
+    repository.save_key(keep=2)
+    names = [auto_backup().name for _ in range(3)]
+    assert repository.snapshot_names() == names
+
+    # the oldest snapshots are pruned once there are twice as many as kept
+    names.append(auto_backup().name)
+    assert repository.snapshot_names() == names[2:]
+
+    with pytest.raises(BackupError):
+        repository.save_key(keep=0)
+
+
+def test_main(db, tmp_path, capsys):
+    path = str(tmp_path / "repository")
+    with patch("getpass.getpass", return_value="secret"), \
+            patch("core.backup.calibrate", return_value=KDF):
+        assert main(["backup", "init", path]) == 0
+        assert main(["backup", "backup", path]) == 0
+        assert main(["backup", "list", path]) == 0
+        assert "2 files" in capsys.readouterr().out
+        assert main(["backup", "prune", path, "1"]) == 0
+        assert main(["backup", "prune", path, "0"]) == 1
+
+    with patch("getpass.getpass", return_value="wrong"):
+        assert main(["backup", "list", path]) == 1
@@ -0,0 +1,41 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import os
+
+import pytest
+
+from core.compression import COMPRESSION_ALGORITHMS, Compression, decompressor
+
+
+@pytest.mark.parametrize("algorithm", COMPRESSION_ALGORITHMS)
+def test_compress_decompress(algorithm):
+    data = os.urandom(100) * 100
+    compressor = Compression(algorithm).compressor()
+    compressed = compressor.compress(data[:5000]) + compressor.compress(data[5000:])
+    compressed += compressor.flush()
+
+    _decompressor = decompressor(algorithm)
+    assert _decompressor.decompress(compressed) == data
+    assert _decompressor.eof
+
+
+def test_invalid_compression():
+    with pytest.raises(ValueError):
+        Compression("bzip2")
+    with pytest.raises(ValueError):
+        Compression("zlib", 10)
+    with pytest.raises(ValueError):
+        decompressor("bzip2")
@@ -0,0 +1,455 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import os
+import tempfile
+import zlib
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+from core import container
+from core.container import (
+    ContainerWriter,
+    CorruptedContainer,
+    Header,
+    KdfParams,
+    StreamSource,
+    iter_records,
+)
+
+KEY = bytes(range(32))
+
+
+@pytest.fixture
+def header():
+    return Header(KdfParams(b"0123456789abcdef"), segment_size=16)
+
+
+def write_container(header: Header, streams: dict[int, list[bytes]]) -> io.BytesIO:
+    file = io.BytesIO()
+    writer = ContainerWriter(file, KEY, header)
+    for stream_id, records in streams.items():
+        with writer.stream(stream_id) as stream:
+            for record in records:
+                stream.write_record(record)
+    file.seek(0)
+    return file
+
+
+@contextmanager
+def stream_source(data: bytes, key=KEY) -> Iterator[StreamSource]:
+    """
+    Reads container from given bytes, StreamSource needs a file to map into memory.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "main.dba")
+        with open(path, "wb") as file:
+            file.write(data)
+        source = StreamSource(path, key)
+        try:
+            yield source
+        finally:
+            source.close()
+
+
+def read_records(file: BinaryIO, stream: int, key=KEY, workers=1) -> list[bytes]:
+    file.seek(0)
+    with stream_source(file.read(), key) as source:
+        return list(iter_records(source.read_stream(stream, workers)))
+
+
+def test_header_roundtrip(header):
+    file = io.BytesIO(header.dumps())
+    assert not container.is_legacy(file)
+    assert container.is_container(file)
+    assert container.read_header(file) == header
+
+
+def test_header_is_padded(header):
+    data = header.dumps()
+    assert len(data) % container.HEADER_ALIGNMENT == 0
+
+    with pytest.raises(ValueError):
+        header.dumps(length=10)
+
+
+def test_wrap_key():
+    data_key = os.urandom(32)
+    wrapped_key = container.wrap_key(KEY, data_key)
+    assert container.unwrap_key(KEY, wrapped_key) == data_key
+
+    with pytest.raises(CorruptedContainer):
+        container.unwrap_key(os.urandom(32), wrapped_key)
+
+
+def test_header_data_key(header):
+    # files without wrapped key are encrypted with the key derived from password
+    assert header.data_key(KEY) == KEY
+
+    data_key = os.urandom(32)
+    header.wrapped_key = container.wrap_key(KEY, data_key)
+    header = Header.from_dict(header.to_dict())
+    assert header.data_key(KEY) == data_key
+
+
+def test_replace_header(tmp_path, header):
+    """
+    The new header is written to the slot that isn't in use, the segments stay the same.
+    """
+
+    path = tmp_path / "main.dba"
+    content = write_container(header, {0: [b"record"]}).getvalue()
+    path.write_bytes(content)
+    inode = path.stat().st_ino
+    slot = (len(header.dumps()) - container.PREAMBLE.size) // 2
+
+    for sequence in (1, 2):
+        header.kdf = KdfParams(os.urandom(16))
+        container.replace_header(path, header)
+        new_content = path.read_bytes()
+        assert path.stat().st_ino == inode
+        assert new_content[container.PREAMBLE.size + 2 * slot:] == \
+               content[container.PREAMBLE.size + 2 * slot:]
+
+        with open(path, "rb") as file:
+            assert read_records(file, 0) == [b"record"]
+            file.seek(0)
+            new_header = container.read_header(file)
+            assert new_header == header
+            assert new_header.sequence == sequence
+
+
+def test_interrupted_replace_header(tmp_path, header):
+    """
+    If writing the new header is interrupted, the previous one is used.
+    """
+
+    path = tmp_path / "main.dba"
+    path.write_bytes(write_container(header, {0: [b"record"]}).getvalue())
+    old_kdf = header.kdf
+    header.kdf = KdfParams(os.urandom(16))
+    container.replace_header(path, header)
+
+    # damage the slot written by replace_header
+    slot = (len(header.dumps()) - container.PREAMBLE.size) // 2
+    with open(path, "r+b") as file:
+        file.seek(container.PREAMBLE.size + slot + 20)
+        file.write(b"0" * 10)
+
+    with open(path, "rb") as file:
+        assert container.read_header(file).kdf == old_kdf
+        file.seek(0)
+        assert read_records(file, 0) == [b"record"]
+
+    # both slots are damaged
+    with open(path, "r+b") as file:
+        file.seek(container.PREAMBLE.size + 20)
+        file.write(b"0" * 10)
+    with open(path, "rb") as file, pytest.raises(CorruptedContainer):
+        container.read_header(file)
+
+
+@pytest.mark.parametrize("iterations", (1, 10 ** 600))
+def test_replace_header_without_slots(tmp_path, header, iterations):
+    """
+    Files without slots, or with slots too short for the new header, are copied once.
+    """
+
+    path = tmp_path / "main.dba"
+    if iterations == 1:
+        header.features = [f for f in header.features if f != container.SLOTS_FEATURE]
+    path.write_bytes(write_container(header, {0: [b"record"]}).getvalue())
+    inode = path.stat().st_ino
+
+    header.kdf = KdfParams(os.urandom(16), iterations=iterations)
+    container.replace_header(path, header)
+    assert path.stat().st_ino != inode
+
+    with open(path, "rb") as file:
+        assert read_records(file, 0) == [b"record"]
+        file.seek(0)
+        new_header = container.read_header(file)
+        assert new_header.kdf == header.kdf
+        assert container.SLOTS_FEATURE in new_header.features
+
+
+def test_header_with_unknown_kdf(header):
+    data = header.dumps().replace(b"pbkdf2-sha256", b"argon2id-sha2")
+    with pytest.raises(CorruptedContainer):
+        container.read_header(io.BytesIO(data))
+
+
+def test_header_without_compression(header):
+    _dict = header.to_dict()
+    del _dict["compression"]
+    assert Header.from_dict(_dict).compression == "none"
+
+
+def test_legacy_file():
+    file = io.BytesIO(os.urandom(16) + b"gAAAAA" + b"A" * 94)
+    assert container.is_legacy(file)
+    assert not container.is_container(file)
+    assert file.tell() == 0
+
+    # too short to contain a token
+    assert not container.is_legacy(io.BytesIO(os.urandom(16) + b"gAAAAA"))
+    assert not container.is_legacy(io.BytesIO(os.urandom(16) + b"not a token" * 10))
+
+
+def test_header_features(header):
+    assert header.features == list(container.FEATURES)
+    assert Header.from_dict(header.to_dict()).features == header.features
+
+    # files written before the features were listed
+    _dict = header.to_dict()
+    del _dict["features"]
+    assert Header.from_dict(_dict).features == []
+
+
+def test_unsupported_feature(header):
+    header.features = [*container.FEATURES, "from the future"]
+    with pytest.raises(CorruptedContainer, match="from the future"):
+        container.read_header(io.BytesIO(header.dumps()))
+
+
+@pytest.mark.parametrize("workers", (1, 4))
+def test_read_write_streams(header, workers):
+    records = [os.urandom(size) for size in (0, 1, 15, 16, 17, 100)]
+    other = [b"other stream"]
+    file = write_container(header, {0: records, 1: other})
+
+    assert read_records(file, 0, workers=workers) == records
+    file.seek(0)
+    assert read_records(file, 1, workers=workers) == other
+
+
+def test_segments_are_bounded(header):
+    file = write_container(header, {0: [os.urandom(100)]})
+    with stream_source(file.getvalue()) as source:
+        for location in source.locations[0]:
+            assert location.length <= container.NONCE_SIZE + 16 + container.TAG_SIZE
+
+
+def test_wrong_key(header):
+    file = write_container(header, {0: [b"data"]})
+    with pytest.raises(InvalidToken):
+        read_records(file, 0, key=bytes(32))
+
+
+def test_tampered_segment(header):
+    file = write_container(header, {0: [b"data" * 10]})
+    data = bytearray(file.getvalue())
+    data[-1] ^= 1
+
+    with pytest.raises(CorruptedContainer):
+        read_records(io.BytesIO(data), 0)
+
+
+def test_segments_of_another_file(header):
+    """
+    Segments of an older file encrypted with the same key can't be put in place of the
+    current ones unnoticed.
+    """
+
+    header.file_id = os.urandom(container.FILE_ID_SIZE)
+    old = write_container(header, {0: [b"old record"]}).getvalue()
+    header.file_id = os.urandom(container.FILE_ID_SIZE)
+    new = write_container(header, {0: [b"new record"]}).getvalue()
+
+    start = len(header.dumps())
+    with pytest.raises(CorruptedContainer):
+        read_records(io.BytesIO(new[:start] + old[start:]), 0)
+
+
+def test_copy_stream(tmp_path, header):
+    path = tmp_path / "old.dba"
+    header.file_id = os.urandom(container.FILE_ID_SIZE)
+    path.write_bytes(write_container(header, {5: [b"record"] * 10}).getvalue())
+    source = StreamSource(path, KEY)
+
+    header.file_id = os.urandom(container.FILE_ID_SIZE)
+    file = io.BytesIO()
+    ContainerWriter(file, KEY, header).copy_stream(source, 5)
+    file.seek(0)
+    assert read_records(file, 5) == [b"record"] * 10
+    source.close()
+
+
+def test_truncated_stream(header):
+    """
+    Dropping the final segment of a stream shouldn't go unnoticed.
+    """
+
+    data = write_container(header, {0: [b"data" * 10]}).getvalue()
+    with stream_source(data) as source:
+        last = source.locations[0][-1]
+    truncated = data[:last.offset - container.SEGMENT_HEADER.size]
+
+    with pytest.raises(CorruptedContainer):
+        read_records(io.BytesIO(truncated), 0)
+
+
+def test_unsupported_version(header):
+    header.version = container.FORMAT_VERSION + 1
+    with pytest.raises(CorruptedContainer):
+        container.read_header(io.BytesIO(header.dumps()))
+
+
+@pytest.mark.parametrize("compression", ("zlib", "lzma"))
+def test_compressed_streams(header, compression):
+    header.compression = compression
+    records = [b"a" * 1000, b"", b"b" * 100]
+    file = write_container(header, {0: records})
+    assert read_records(file, 0) == records
+
+    # repetitive data should take a few segments instead of 70
+    with stream_source(file.getvalue()) as source:
+        assert len(source.locations[0]) < 10
+
+
+def test_truncated_compressed_stream(header):
+    """
+    Compressed stream can't end before the compressor has been flushed.
+    """
+
+    header.compression = "zlib"
+    file = io.BytesIO()
+    writer = ContainerWriter(file, KEY, header)
+    stream = writer.stream(0)
+    stream.write_record(b"a" * 1000)
+    stream._flush_segment(bytes(stream.buffer), final=True)
+    file.seek(0)
+
+    with pytest.raises(CorruptedContainer):
+        read_records(file, 0)
+
+
+def test_unknown_compression(header):
+    file = write_container(header, {0: [b"record"]})
+    with stream_source(file.getvalue()) as source:
+        source.header.compression = "bzip2"
+        with pytest.raises(CorruptedContainer):
+            list(source.read_stream(0))
+
+
+def test_index_ignores_torn_tail(tmp_path, header):
+    path = tmp_path / "main.dba"
+    data = write_container(header, {0: [b"record"], 1: [b"a" * 100]}).getvalue()
+    path.write_bytes(data[:-5])
+
+    source = StreamSource(path, KEY)
+    assert list(iter_records(source.read_stream(0))) == [b"record"]
+    assert not source.locations[1][-1].final
+    with pytest.raises(CorruptedContainer):
+        list(source.read_stream(1))
+
+    last = source.locations[1][-1]
+    assert source.end == last.offset + last.length < len(data) - 5
+
+
+def test_stream_source_is_file(tmp_path, header):
+    path = tmp_path / "main.dba"
+    path.write_bytes(write_container(header, {0: [b"record"]}).getvalue())
+    source = StreamSource(path, KEY)
+    assert source.is_file(path)
+
+    path.unlink()
+    assert not source.is_file(path)
+    path.write_bytes(write_container(header, {0: [b"record"]}).getvalue())
+    assert not source.is_file(path)
+
+
+@pytest.mark.parametrize("workers", (1, 4))
+def test_stream_source_read_records(tmp_path, header, workers):
+    records = [os.urandom(size) for size in (0, 1, 15, 16, 17, 100, 1000)]
+    path = tmp_path / "main.dba"
+    path.write_bytes(write_container(header, {0: records, 1: [b"other"]}).getvalue())
+    source = StreamSource(path, KEY)
+
+    assert list(source.read_records(0, workers)) == records
+    # the pages released after the first read are read again
+    assert list(source.read_records(0, workers)) == records
+    assert list(source.read_records(1, workers)) == [b"other"]
+    assert b"".join(source.read_stream(1)) == container.RECORD_LENGTH.pack(5) + b"other"
+    source.close()
+
+
+def test_stream_source_tampered(tmp_path, header):
+    data = bytearray(write_container(header, {0: [b"data" * 10]}).getvalue())
+    data[-1] ^= 1
+    path = tmp_path / "main.dba"
+    path.write_bytes(data)
+
+    with pytest.raises(CorruptedContainer):
+        list(StreamSource(path, KEY).read_records(0))
+
+
+def test_header_shards(header):
+    assert header.shard_streams == [container.ACCOUNTS_STREAM]
+    header.shards = [container.SHARD_STREAMS, container.SHARD_STREAMS + 1]
+    header.index = container.INDEX_STREAMS
+    assert Header.from_dict(header.to_dict()) == header
+
+
+@pytest.mark.parametrize("accounts, shards", ((0, 1), (2047, 1), (4096, 4), (10 ** 6, 64)))
+def test_shard_count(accounts, shards):
+    assert container.shard_count(accounts) == shards
+
+
+def test_shard_of():
+    shards = {container.shard_of(f"account{i}", 8) for i in range(100)}
+    assert shards == set(range(8))
+    # shards don't depend on hash randomization of the interpreter
+    assert container.shard_of("gmail", 8) == zlib.crc32(b"gmail") % 8
+
+
+def test_encode_shards():
+    streams = [container.SHARD_STREAMS + i for i in range(5)]
+    record = container.encode_shards(streams)
+    assert container.decode_shards(record) == streams
+
+    with pytest.raises(CorruptedContainer):
+        container.decode_shards(record[:-1])
+
+
+def test_encode_stream():
+    record = container.encode_stream(container.INDEX, container.INDEX_STREAMS + 1)
+    assert record[:1] == container.INDEX
+    assert container.decode_stream(record) == container.INDEX_STREAMS + 1
+
+    with pytest.raises(CorruptedContainer):
+        container.decode_stream(record[:-1])
+
+
+def test_encode_digest():
+    digest = container.attachment_digest(KEY, [b"file ", b"content"])
+    record = container.encode_digest(5, digest)
+    assert container.decode_digest(record) == (5, digest)
+
+    with pytest.raises(CorruptedContainer):
+        container.decode_digest(record[:-1])
+
+
+def test_attachment_digest():
+    digest = container.attachment_digest(KEY, [b"file content"])
+    assert container.attachment_digest(KEY, [b"file ", b"content"]) == digest
+    assert container.attachment_digest(KEY, [b"other content"]) != digest
+    # the digest depends on the key
+    assert container.attachment_digest(os.urandom(32), [b"file content"]) != digest
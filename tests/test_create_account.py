@@ -19,8 +19,8 @@ import pytest
 from gi.repository import Gtk
 
 from core.create_account import CreateAccount, CONFIRM_ATTACH_EXISTING_FILE, SELECT_FILES_TO_DETACH, \
-    CONFIRM_FILES_DETACH, ERROR_READING_FILE
-from core.gtk_utils import items_names
+    CONFIRM_FILES_DETACH, ERROR_READING_FILE, ATTACHING_FILES
+from core.gtk_utils import items_names, wait_until
 from core.widgets import DateChooserDialog, WarningDialog
 
 
@@ -168,30 +168,56 @@ def test_drop_files(form):
     assert len(form.attached_paths) == 2
 
 
-def test_get_attached_files_success(form):
+def test_read_attached_files(form):
     form.attach_file("tests/data/file1.txt")
     form.attach_file("tests/data/file2.txt")
     form.attached_paths["file"] = None  # this file should be skipped
+    form.apply_account = Mock()
 
-    attached_files = form.get_attached_files()
-    assert attached_files["file1.txt"] == 'RmlsZSAxIGNvbnRlbnQuCg=='
-    assert attached_files["file2.txt"] == 'SGVsbG8gd29ybGQhCg=='
+    form.on_apply()
+    # the form is disabled while the files are read in background
+    assert not form.parent_widget.sensitive
+    assert form.database_window.statusbar.label.text == ATTACHING_FILES.format(0)
+    wait_until(lambda: form.apply_account.called)
+    assert form.parent_widget.sensitive
+
+    attached_files = form.apply_account.call_args.args[0]
+    assert list(attached_files) == ["file1.txt", "file2.txt"]
+    # the files aren't kept in memory
+    assert attached_files["file1.txt"].data is None
+    assert attached_files["file1.txt"].read() == b"File 1 content.\n"
+    assert attached_files["file2.txt"].read() == b"Hello world!\n"
 
 
 @patch("core.create_account.ErrorDialog", autospec=True)
-def test_get_attached_files_error(dialog: Mock, src_dir, form):
+def test_read_attached_files_error(dialog: Mock, src_dir, form):
     form.attach_file("tests/data/file1.txt")
     form.attach_file(f"{src_dir}/main.dba")
     (src_dir / "main.dba").unlink()
+    form.apply_account = Mock()
 
-    attached_files = form.get_attached_files()
+    form.on_apply()
+    wait_until(lambda: form.apply_account.called)
     # file1 should have been read
-    assert attached_files["file1.txt"] == 'RmlsZSAxIGNvbnRlbnQuCg=='
+    attached_files = form.apply_account.call_args.args[0]
+    assert attached_files["file1.txt"].read() == b"File 1 content.\n"
+    assert "main.dba" not in attached_files
 
     # and there should have been an error dialog about main.dba file
     dialog.assert_called_with(ERROR_READING_FILE.format("main.dba"), ANY)
 
 
+def test_files_attached_while_saving(form):
+    form.apply_account = Mock()
+    form.database_window.writing = True
+
+    form.on_files_attached(({}, {}))
+    # the account is created only after the database is saved
+    assert not form.apply_account.called
+    form.database_window.writing = False
+    wait_until(lambda: form.apply_account.called)
+
+
 def test_create_account(form: CreateAccount, account):
     form.database_window.database.accounts = {}
     form.database_window.accounts_list.children[1].destroy()
@@ -212,6 +238,7 @@ def test_create_account(form: CreateAccount, account):
     form.attach_file("tests/data/file2.txt")
 
     form.on_apply()
+    wait_until(lambda: account.accountname in form.database_window.database.accounts)
     created_account = form.database_window.database.accounts[account.accountname]
     assert created_account == account
 
@@ -18,6 +18,7 @@ from unittest.mock import PropertyMock, patch, Mock
 import pytest
 
 from core.create_database import CreateDatabase, ERROR_DB_CREATION
+from core.sqlite_storage import is_sqlite
 from core.database_utils import Database
 from core.gtk_utils import wait_until, items_names
 from core.widgets import NAME_TAKEN_ERROR, EMPTY_NAME_ERROR, UNALLOWED_CHARS_WARNING, ErrorDialog
@@ -143,6 +144,7 @@ def test_create_database_success(form, src_dir):
     form.password.text = "123"
     form.repeat_password.text = "123"
     form.on_apply()
+    wait_until(lambda: "db" in form.main_window.windows)
 
     # the database file should be created
     assert (src_dir / "db.dba").exists()
@@ -165,6 +167,19 @@ def test_create_database_success(form, src_dir):
     assert win.database == expected_db
 
 
+def test_create_sqlite_database(form, src_dir):
+    form.main_window.config.engine = "sqlite"
+    form.name.text = "db"
+    form.password.text = "123"
+    form.repeat_password.text = "123"
+    form.on_apply()
+    wait_until(lambda: "db" in form.main_window.windows)
+
+    with open(src_dir / "db.dba", "rb") as file:
+        assert is_sqlite(file)
+    assert form.main_window.windows["db"].database.engine == "sqlite"
+
+
 @patch("core.create_database.ErrorDialog", autospec=True)
 @patch("core.create_database.Database.dba_file", new_callable=PropertyMock)
 def test_create_database_error(mock, dialog: "Mock[ErrorDialog]", form, faker):
@@ -176,6 +191,7 @@ def test_create_database_error(mock, dialog: "Mock[ErrorDialog]", form, faker):
     form.repeat_password.text = "123"
 
     form.on_apply()
+    wait_until(lambda: dialog.called)
     dialog.assert_called_with(ERROR_DB_CREATION, err)
 
     # database shouldn't be added to the list
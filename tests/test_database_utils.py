@@ -13,11 +13,36 @@
 #
 #  You should have received a copy of the GNU General Public License
 #  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import os
 import shutil
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
 
 import pytest
+from cryptography.fernet import InvalidToken
 
-from core.database_utils import Account, Database
+from core import container
+from core.container import CorruptedContainer
+from core.compression import Compression
+from core.kdf import KdfParams
+from core.serialization import CODECS
+from core.database_utils import (
+    CONTAINER_ENGINE,
+    CONTAINER_FORMAT,
+    LEGACY_FORMAT,
+    SQLITE_ENGINE,
+    SQLITE_FORMAT,
+    Account,
+    Attachment,
+    AttachmentError,
+    Database,
+    detect_format,
+)
+from core.sqlite_storage import SqliteStorage, is_sqlite
 
 
 @pytest.fixture
@@ -51,13 +76,6 @@ ACCOUNTS_JSON = (
 )
 
 
-@pytest.fixture()
-def salt(monkeypatch):
-    salt = b"0123456789abcdef"
-    monkeypatch.setattr("os.urandom", lambda x: salt)
-    return salt
-
-
 @pytest.fixture
 def main_db(src_dir):
     shutil.copy("tests/data/main.dba", src_dir)
@@ -96,6 +114,12 @@ def test_account_from_dict(account):
     assert _account == account
 
 
+def test_account_has_slots(account):
+    assert not hasattr(account, "__dict__")
+    with pytest.raises(AttributeError):
+        account.unknown_field = "value"
+
+
 def test_dumps(accounts):
     database = Database("main", "123", accounts)
     json = database.dumps()
@@ -132,17 +156,52 @@ def test_close_database(accounts):
     assert not database.accounts
 
 
-def test_create_database(src_dir, salt, accounts):
+def test_create_database(src_dir, accounts):
     database = Database("main", "123", accounts)
     database.create()
 
     with open(src_dir / "main.dba", "rb") as db_file:
-        actual_salt = db_file.read(16)
-        assert actual_salt == salt
+        assert not container.is_legacy(db_file)
+        header = container.read_header(db_file)
+        assert header.version == container.FORMAT_VERSION
 
-        token = db_file.read()
-        data = Database.decrypt(token, "123", salt).decode()
-        assert data == ACCOUNTS_JSON
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts == accounts
+
+    # every new file gets a new id, so that its segments can't be mixed with older ones
+    database.create()
+    with open(src_dir / "main.dba", "rb") as db_file:
+        assert len(header.file_id) == container.FILE_ID_SIZE
+        assert container.read_header(db_file).file_id != header.file_id
+
+
+def test_open_legacy_database(main_db, accounts):
+    """
+    Databases in legacy format should be opened and saved in the new format.
+    """
+
+    db = Database("main")
+    with open(db.dba_file, "rb") as db_file:
+        assert container.is_legacy(db_file)
+
+    db.open("123")
+    db.create()
+    with open(db.dba_file, "rb") as db_file:
+        assert not container.is_legacy(db_file)
+
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts == accounts
+
+
+def test_open_database_wrong_password(main_db, accounts):
+    Database("main", "123", accounts).create()
+
+    db = Database("main")
+    with pytest.raises(InvalidToken):
+        db.open("321")
+    assert db._key_cache is None
 
 
 def test_rename_database(src_dir, main_db):
@@ -154,6 +213,30 @@ def test_rename_database(src_dir, main_db):
     assert (src_dir / "crypt.dba").exists()
 
 
+def test_rename_database_files(src_dir, main_db):
+    db = Database("main")
+    db.open("123")
+    db.create(backups=2)
+    db.create(backups=2)
+    db.record_history(None, [])
+    (src_dir / "main.history.corrupt").write_bytes(b"")
+    # files of another database
+    (src_dir / "main.dba.dba").write_bytes(b"")
+    (src_dir / "main.dba.history").write_bytes(b"")
+
+    db.rename("crypt")
+    assert sorted(path.name for path in src_dir.iterdir()) == [
+        "crypt.dba", "crypt.dba.1", "crypt.dba.2", "crypt.history", "crypt.history.corrupt",
+        "main.dba.dba", "main.dba.history",
+    ]
+    assert len(db.history().revisions()) == 1
+
+    db.delete()
+    assert sorted(path.name for path in src_dir.iterdir()) == [
+        "main.dba.dba", "main.dba.history",
+    ]
+
+
 def test_database_saved(main_db, accounts):
     db = Database("main", "123", accounts)
     assert db.saved
@@ -175,6 +258,7 @@ def test_database_saved_no_database(main_db, accounts):
 
 def test_save_database(src_dir, main_db, accounts):
     db = Database("main", "123", accounts)
+    db.create(backups=1)
 
     new_accounts = accounts.copy()
     del new_accounts["mega"]
@@ -184,15 +268,17 @@ def test_save_database(src_dir, main_db, accounts):
     new_db.open("321")
     assert new_db.accounts == new_accounts
     assert not (src_dir / "main.dba").exists()
+    # backups of the database are renamed along with it
+    assert not (src_dir / "main.dba.1").exists()
+    assert (src_dir / "crypt.dba.1").exists()
 
 
 def test_save_database_name_didnt_change(src_dir, main_db, accounts):
     """
     Saving a database when its name didn't change.
 
-    For Database.save(), it's important to first delete old database and then create new one,
-    not the other way around. Because if the name of the database didn't change during saving,
-    the database file will be removed.
+    For Database.save(), it's important to delete old database only if the name changed,
+    otherwise the new database file would be removed.
     """
     db = Database("main", "123", accounts)
 
@@ -203,3 +289,919 @@ def test_save_database_name_didnt_change(src_dir, main_db, accounts):
     new_db = Database("main")
     new_db.open("321")
     assert new_db.accounts == new_accounts
+
+
+def test_key_derived_once(main_db, accounts):
+    """
+    Opening, saving and checking whether database is saved should derive the key only once.
+    """
+    with patch.object(KdfParams, "derive", autospec=True, side_effect=KdfParams.derive) as derive:
+        db = Database("main")
+        db.open("123")
+        db.create()
+        assert db.saved
+
+        db.save("main", "123", accounts)
+        db.open("123")
+        derive.assert_called_once()
+
+
+def test_key_derived_again_when_password_changes(main_db, accounts):
+    db = Database("main")
+    db.open("123")
+
+    with patch.object(KdfParams, "derive", autospec=True, side_effect=KdfParams.derive) as derive:
+        new_db = db.save("main", "321", accounts)
+        derive.assert_called_once()
+
+    new_db.close()
+    with pytest.raises(InvalidToken):
+        new_db.open("123")
+
+
+def test_close_database_wipes_key(main_db):
+    db = Database("main")
+    db.open("123")
+    db.close()
+    assert db._key_cache is None
+
+
+def test_database_saved_tracks_changes(main_db, account2):
+    db = Database("main")
+    db.open("123")
+
+    with patch.object(Database, "open") as mock:
+        assert db.saved
+
+        db.accounts["gmail"].email = "test@gmail.com"
+        assert not db.saved
+
+        db.create()
+        assert db.saved
+
+        del db.accounts["mega"]
+        assert not db.saved
+
+        db.accounts["mega"] = account2
+        assert not db.saved
+
+        # no need to read the database from disk
+        mock.assert_not_called()
+
+
+def test_account_revision_changes(account):
+    revision = account.revision
+    account.notes = "new notes"
+    assert account.revision > revision
+    assert "revision" not in account.to_dict()
+
+
+def test_attachments_are_not_loaded(main_db, accounts):
+    Database("main", "123", accounts).create()
+
+    db = Database("main")
+    db.open("123")
+    attachment = db.accounts["gmail"].attached_files["file1"]
+    assert attachment.data is None
+    assert attachment.read() == b"file1 content\n"
+
+
+def test_attachments_survive_saving(main_db, accounts):
+    """
+    Attachments should be copied to the new file even though they aren't loaded.
+    """
+    Database("main", "123", accounts).create()
+
+    db = Database("main")
+    db.open("123")
+    db.dba_file.unlink()  # this is what DatabaseWindow does before saving
+    db.create()
+
+    # and after changing the password
+    new_db = db.save("crypt", "321", db.accounts)
+    new_db.close()
+    new_db.open("321")
+    assert new_db.accounts == accounts
+
+
+def test_created_attachments_are_freed(src_dir, account):
+    attachment = account.attached_files["file1"]
+    assert attachment.data is not None
+
+    Database("main", "123", {account.accountname: account}).create()
+    assert attachment.data is None
+    assert attachment.read() == b"file1 content\n"
+
+
+@pytest.mark.parametrize("algorithm", ("none", "zlib", "lzma"))
+def test_create_compressed_database(src_dir, accounts, algorithm):
+    Database("main", "123", accounts).create(Compression(algorithm, 9))
+    with open(src_dir / "main.dba", "rb") as db_file:
+        assert container.read_header(db_file).compression == algorithm
+
+    db = Database("main")
+    db.open("123")
+    assert db.accounts == accounts
+
+
+def test_compression_shrinks_database(src_dir, account):
+    account.notes = "Some very repetitive notes. " * 1000
+    db = Database("main", "123", {account.accountname: account})
+
+    db.create(Compression("none"))
+    size = db.dba_file.stat().st_size
+    db.create(Compression("zlib"))
+    assert db.dba_file.stat().st_size < size / 10
+
+
+def test_change_compression_of_attachments(main_db, accounts):
+    """
+    Attachments can't be copied as they are when compression algorithm changes.
+    """
+    Database("main", "123", accounts).create(Compression("none"))
+
+    db = Database("main")
+    db.open("123")
+    db.create(Compression("lzma"))
+
+    db.close()
+    db.open("123")
+    assert db.accounts == accounts
+
+
+def test_loads_interns_fields():
+    db = Database("main")
+    db.loads(ACCOUNTS_JSON)
+    assert db.accounts["gmail"].email is db.accounts["mega"].email
+
+
+def test_open_interns_fields(src_dir, account, account2):
+    Database("main", "123", {"gmail": account, "mega": account2}).create()
+
+    db = Database("main")
+    db.open("123")
+    assert db.accounts["gmail"].email is db.accounts["mega"].email
+
+
+def test_change_password(src_dir, accounts):
+    db = Database("main", "123", accounts)
+    db.create()
+    content = db.dba_file.read_bytes()
+    inode = db.dba_file.stat().st_ino
+    with open(db.dba_file, "rb") as file:
+        container.read_header(file)
+        segments = file.tell()
+
+    db.change_password("321")
+    assert db.password == "321"
+
+    # only the header is changed, in place
+    new_content = db.dba_file.read_bytes()
+    assert db.dba_file.stat().st_ino == inode
+    assert len(new_content) == len(content)
+    assert new_content[segments:] == content[segments:]
+
+    new_db = Database("main")
+    with pytest.raises(InvalidToken):
+        new_db.open("123")
+    new_db.open("321")
+    assert new_db.accounts == accounts
+
+
+def test_change_password_keeps_unsaved_changes(src_dir, accounts, account2):
+    db = Database("main", "123", accounts)
+    db.create()
+    db.accounts = {"mega": account2}
+
+    db.change_password("321")
+    assert not db.saved
+
+    disk_db = Database("main")
+    disk_db.open("321")
+    assert disk_db.accounts == accounts
+
+
+def test_change_password_of_legacy_database(main_db, accounts):
+    db = Database("main")
+    db.open("123")
+    db.change_password("321")
+
+    with open(db.dba_file, "rb") as file:
+        assert not container.is_legacy(file)
+
+    new_db = Database("main")
+    new_db.open("321")
+    assert new_db.accounts == accounts
+
+    # the database can be saved with the new password
+    db.create()
+    new_db.open("321")
+    assert new_db.accounts == accounts
+
+
+def test_create_database_with_scrypt(src_dir, accounts):
+    kdf = KdfParams(os.urandom(16), "scrypt", n=2 ** 10)
+    Database("main", "123", accounts).create(kdf=kdf)
+    with open(src_dir / "main.dba", "rb") as db_file:
+        assert container.read_header(db_file).kdf == kdf
+
+    db = Database("main")
+    db.open("123")
+    assert db.accounts == accounts
+
+
+def test_change_password_kdf(src_dir, accounts):
+    db = Database("main", "123", accounts)
+    db.create()
+
+    kdf = KdfParams(os.urandom(16), "scrypt", n=2 ** 10)
+    db.change_password("321", kdf=kdf)
+    with open(src_dir / "main.dba", "rb") as db_file:
+        assert container.read_header(db_file).kdf == kdf
+
+    new_db = Database("main")
+    new_db.open("321")
+    assert new_db.accounts == accounts
+
+
+def journal_streams(db: Database) -> list[int]:
+    source = container.StreamSource(db.dba_file, db._data_key)
+    return sorted(s for s in source.locations if s >= container.JOURNAL_ATTACHMENTS)
+
+
+@pytest.fixture
+def journal_db(src_dir, accounts):
+    # big enough, so that a few changes don't trigger compaction
+    notes = os.urandom(64 * 1024).hex()
+    big = Account("big", "", "", "", "", notes)
+    Database("main", "123", {**accounts, "big": big}).create()
+
+    db = Database("main")
+    db.open("123")
+    return db
+
+
+def test_save_changes_appends_to_journal(journal_db, account2):
+    db = journal_db
+    content = db.dba_file.read_bytes()
+
+    db.accounts["gmail"].notes = "New notes."
+    del db.accounts["mega"]
+    account2.accountname = "mega2"
+    account2.attached_files = {"file3": Attachment(b"file3 content")}
+    db.accounts["mega2"] = account2
+    db.save_changes()
+    assert db.saved
+
+    new_content = db.dba_file.read_bytes()
+    assert new_content.startswith(content)
+    assert journal_streams(db) == [container.JOURNAL_ATTACHMENTS, container.TRANSACTIONS]
+
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts == db.accounts
+    assert new_db.accounts["mega2"].attached_files["file3"].read() == b"file3 content"
+
+
+def test_open_damaged_journal(journal_db):
+    journal_db.accounts["gmail"].notes = "New notes."
+    journal_db.save_changes()
+
+    db = Database("main")
+    with patch.object(Database, "replay_record", side_effect=CorruptedContainer), \
+            pytest.raises(CorruptedContainer):
+        db.open("123")
+    # the accounts decoded before the error aren't kept
+    assert db.accounts == {}
+
+
+def test_save_changes_closes_previous_source(journal_db, account2):
+    db = journal_db
+    source = db._source
+    attachment = db.accounts["gmail"].attached_files["file2"]
+    assert attachment.source is source
+
+    db.accounts["gmail"].notes = "New notes."
+    db.save_changes()
+    # attachments stored before are read from the new source
+    assert source.file.closed
+    assert attachment.source is db._source is not source
+    assert attachment.read() == b"file2 content\n"
+
+    db.create()
+    assert attachment.source is db._source
+    db.close()
+    assert attachment.source.file.closed
+
+
+def test_save_changes_after_change_password(journal_db):
+    db = journal_db
+    source = db._source
+    attachment = db.accounts["gmail"].attached_files["file2"]
+
+    db.change_password("321")
+    assert attachment.source is source
+    assert db.stored_in(attachment, source)
+
+    # the file is still appended to rather than re-created
+    content = db.dba_file.read_bytes()
+    db.accounts["gmail"].notes = "New notes."
+    db.save_changes()
+    assert db.dba_file.read_bytes().startswith(content)
+    assert source.file.closed
+    assert attachment.source is db._source
+
+    new_db = Database("main")
+    new_db.open("321")
+    assert new_db.accounts == db.accounts
+    assert new_db.accounts["gmail"].attached_files["file2"].read() == b"file2 content\n"
+
+
+def test_save_changes_without_changes(journal_db):
+    content = journal_db.dba_file.read_bytes()
+    journal_db.save_changes()
+    assert journal_db.dba_file.read_bytes() == content
+
+
+def test_interrupted_save_changes(journal_db):
+    db = journal_db
+    db.accounts["gmail"].notes = "Saved notes."
+    db.save_changes()
+    size = db.dba_file.stat().st_size
+
+    db.accounts["gmail"].notes = "Lost notes."
+    db.save_changes()
+    # as if saving was interrupted in the middle of the last transaction
+    with open(db.dba_file, "r+b") as file:
+        file.truncate(file.seek(0, os.SEEK_END) - 10)
+
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts["gmail"].notes == "Saved notes."
+
+    # the broken transaction is overwritten by the next one
+    new_db.accounts["mega"].notes = "New notes."
+    new_db.save_changes()
+    assert len(journal_streams(new_db)) == 2
+
+    db.open("123")
+    assert db.accounts == new_db.accounts
+    assert db.dba_file.stat().st_size > size
+
+
+@pytest.fixture
+def sharded_db(src_dir, monkeypatch):
+    monkeypatch.setattr("core.container.ACCOUNTS_PER_SHARD", 2)
+    accounts = {
+        f"account{i}": Account(f"account{i}", "user", "user@gmail.com", "123", "", "")
+        for i in range(10)
+    }
+    Database("main", "123", accounts).create()
+
+    db = Database("main")
+    db.open("123")
+    return db
+
+
+def test_sharded_database(sharded_db):
+    db = sharded_db
+    with open(db.dba_file, "rb") as file:
+        header = container.read_header(file)
+    assert header.shards == [container.SHARD_STREAMS + shard for shard in range(5)]
+
+    # every shard contains only its own accounts
+    source = container.StreamSource(db.dba_file, db._data_key)
+    for shard, stream in enumerate(header.shards):
+        accounts = db.read_shard(source, CODECS[header.codec], stream)
+        for account in accounts:
+            assert container.shard_of(account.accountname, 5) == shard
+    assert len(db.accounts) == 10
+
+
+def test_journal_fold(sharded_db):
+    """
+    Once the journal gets big enough, only the changed shard is written again.
+    """
+
+    db = sharded_db
+    account = db.accounts["account1"]
+    shard = container.shard_of("account1", 5)
+    old_shards = db._journal.shards
+
+    for i in range(20):
+        account.notes = f"New notes {i}."
+        db.save_changes()
+        if db._journal.folded != container.TRANSACTIONS - 1:
+            break
+    else:
+        pytest.fail("The journal wasn't folded.")
+
+    assert not db._journal.dirty
+    changed = [i for i, (old, new) in enumerate(zip(old_shards, db._journal.shards)) if old != new]
+    assert changed == [shard]
+
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts == db.accounts
+    assert new_db._journal == db._journal
+
+
+def test_garbage_collection(sharded_db):
+    """
+    The file is re-created once too much of it is taken by old versions of shards.
+    """
+
+    db = sharded_db
+    for i in range(200):
+        db.accounts["account1"].notes = f"New notes {i}."
+        db.save_changes()
+        if not journal_streams(db):
+            break
+    else:
+        pytest.fail("The file wasn't re-created.")
+
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts == db.accounts
+
+
+def test_read_index(journal_db, account2):
+    db = journal_db
+    with open(db.dba_file, "rb") as file:
+        header = container.read_header(file)
+        header_end = file.tell()
+    # the index goes right after the header
+    source = container.StreamSource(db.dba_file, db._data_key)
+    assert source.locations[header.index][0].offset == \
+        header_end + container.SEGMENT_HEADER.size
+
+    new_db = Database("main")
+    assert new_db.read_index("123") == ["gmail", "mega", "big"]
+    assert not new_db.accounts
+
+    # changes in the journal are applied to the names
+    del db.accounts["mega"]
+    account2.accountname = "mega2"
+    db.accounts["mega2"] = account2
+    db.save_changes()
+
+    new_db = Database("main")
+    assert new_db.read_index("123") == ["gmail", "big", "mega2"]
+    # the key is derived only once
+    with patch("core.kdf.KdfParams.derive") as derive_key:
+        new_db.open("123")
+    derive_key.assert_not_called()
+    assert new_db.accounts == db.accounts
+
+
+def test_read_index_after_fold(sharded_db):
+    db = sharded_db
+    old_index = db._journal.index
+    for i in range(20):
+        db.accounts[f"new{i}"] = Account(f"new{i}", "user", "user@gmail.com", "123", "", "")
+        db.save_changes()
+        if db._journal.folded != container.TRANSACTIONS - 1:
+            break
+    else:
+        pytest.fail("The journal wasn't folded.")
+
+    assert db._journal.index != old_index
+    new_db = Database("main")
+    assert new_db.read_index("123") == list(db.accounts)
+    new_db.open("123")
+    assert new_db._journal == db._journal
+
+
+def test_read_index_wrong_password(journal_db):
+    db = Database("main")
+    with pytest.raises(InvalidToken):
+        db.read_index("321")
+    assert db._key_cache is None
+
+
+def test_read_index_of_legacy_database(main_db):
+    db = Database("main")
+    assert db.read_index("123") is None
+    assert db.password == "123"
+
+
+def test_compaction_keeps_journal_attachments(journal_db):
+    db = journal_db
+    db.accounts["mega"].attached_files = {"file3": Attachment(b"file3 content")}
+    db.save_changes()
+    db.create()
+    assert journal_streams(db) == []
+
+    db.close()
+    db.open("123")
+    assert db.accounts["mega"].attached_files["file3"].read() == b"file3 content"
+
+
+def test_save_changes_of_legacy_database(main_db, accounts):
+    db = Database("main")
+    db.open("123")
+    db.accounts["gmail"].notes = "New notes."
+    db.save_changes()
+
+    with open(db.dba_file, "rb") as file:
+        assert not container.is_legacy(file)
+    assert journal_streams(db) == []
+
+
+def test_failed_create_keeps_database(main_db, accounts, src_dir):
+    content = (src_dir / "main.dba").read_bytes()
+    db = Database("main", "123", accounts)
+
+    with patch("core.database_utils.Account.to_dict", side_effect=OSError("Disk is full")), \
+            patch("core.database_utils.DEFAULT_CODEC", "json"), \
+            pytest.raises(OSError):
+        db.create()
+
+    assert (src_dir / "main.dba").read_bytes() == content
+    assert sorted(src_dir.iterdir()) == [src_dir / "main.dba"]
+
+
+def test_create_keeps_backups(main_db, accounts, src_dir):
+    content = (src_dir / "main.dba").read_bytes()
+    db = Database("main", "123", accounts)
+    db.create(backups=1)
+    assert (src_dir / "main.dba.1").read_bytes() == content
+
+
+@pytest.fixture
+def sqlite_db(src_dir, accounts):
+    Database("main", "123", accounts).create(engine=SQLITE_ENGINE)
+    db = Database("main")
+    db.open("123")
+    return db
+
+
+def test_sqlite_engine(sqlite_db, accounts):
+    db = sqlite_db
+    with open(db.dba_file, "rb") as file:
+        assert is_sqlite(file)
+    assert db.engine == SQLITE_ENGINE
+    assert db.accounts == accounts
+    assert db.accounts["gmail"].attached_files["file1"].read() == b"file1 content\n"
+    assert db.read_index("123") is None
+
+
+def test_sqlite_save_changes(sqlite_db, account2):
+    db = sqlite_db
+    db.accounts["gmail"].notes = "New notes."
+    db.accounts["gmail"].attached_files = {"file3": Attachment(b"file3 content")}
+    del db.accounts["mega"]
+    account2.accountname = "mega2"
+    db.accounts["mega2"] = account2
+
+    with patch.object(Database, "create") as create:
+        db.save_changes()
+    create.assert_not_called()
+    assert db.saved
+
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts == db.accounts
+    # attachments of the deleted and changed accounts are removed with them
+    assert set(new_db._storage.digests()) == {
+        new_db.accounts["gmail"].attached_files["file3"].stream,
+    }
+
+
+def test_sqlite_change_password(sqlite_db, accounts):
+    db = sqlite_db
+    db.change_password("321")
+
+    new_db = Database("main")
+    with pytest.raises(InvalidToken):
+        new_db.open("123")
+    new_db.open("321")
+    assert new_db.accounts == accounts
+
+
+def test_sqlite_close(sqlite_db):
+    storage = sqlite_db._storage
+    sqlite_db.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        storage.connection.execute("SELECT 1")
+
+    # the connection is closed when the password is wrong too
+    db = Database("main")
+    with patch.object(SqliteStorage, "close", autospec=True, side_effect=SqliteStorage.close) \
+            as close, pytest.raises(InvalidToken):
+        db.open("wrong")
+    close.assert_called_once()
+
+
+def test_switch_engine(sqlite_db, accounts):
+    db = sqlite_db
+    storage = db._storage
+    db.create(engine=CONTAINER_ENGINE)
+    # the attachments are read from the new file, so the old one is closed
+    with pytest.raises(sqlite3.ProgrammingError):
+        storage.connection.execute("SELECT 1")
+    db.accounts["gmail"].notes = "New notes."
+    db.save_changes()
+
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.engine == CONTAINER_ENGINE
+    assert new_db.accounts == db.accounts
+
+    new_db.create(engine=SQLITE_ENGINE)
+    new_db.open("123")
+    assert new_db.accounts == db.accounts
+
+
+def test_unknown_engine(src_dir, accounts):
+    with pytest.raises(ValueError):
+        Database("main", "123", accounts).create(engine="unknown")
+
+
+def attachment_streams(db: Database) -> list[int]:
+    source = container.StreamSource(db.dba_file, db._data_key)
+    return sorted(
+        s for s in source.locations
+        if s < container.INDEX_STREAMS
+        or container.JOURNAL_ATTACHMENTS <= s < container.TRANSACTIONS
+    )
+
+
+def test_duplicate_attachments_stored_once(src_dir, accounts):
+    accounts["mega"].attached_files = {
+        "copy": Attachment(b"file1 content\n"),
+        "file1": Attachment(b"file1 content\n"),
+    }
+    Database("main", "123", accounts).create()
+
+    db = Database("main")
+    db.open("123")
+    assert db.accounts == accounts
+    # file1 of both accounts is stored once, file2 separately
+    assert len(attachment_streams(db)) == 2
+    assert len(db._journal.digests) == 2
+    gmail = db.accounts["gmail"].attached_files
+    mega = db.accounts["mega"].attached_files
+    assert mega["copy"] is mega["file1"] is gmail["file1"]
+
+
+def test_save_changes_reuses_stored_attachment(journal_db, account2):
+    db = journal_db
+    streams = attachment_streams(db)
+    db.accounts["mega"].attached_files = {"copy": Attachment(b"file2 content\n")}
+    account2.accountname = "mega2"
+    account2.attached_files = {
+        "new": Attachment(b"new content"),
+        "same": Attachment(b"new content"),
+    }
+    db.accounts["mega2"] = account2
+    db.save_changes()
+
+    # only the new content is appended, once
+    assert attachment_streams(db) == streams + [container.JOURNAL_ATTACHMENTS]
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts == db.accounts
+    assert new_db._journal.digests == db._journal.digests
+    copy = new_db.accounts["mega"].attached_files["copy"]
+    assert copy is new_db.accounts["gmail"].attached_files["file2"]
+
+
+def test_digests_survive_journal_fold(sharded_db):
+    db = sharded_db
+    db.accounts["account1"].attached_files = {"file": Attachment(b"file content")}
+    db.accounts["account2"].attached_files = {"file": Attachment(b"file content")}
+    for i in range(20):
+        db.accounts["account3"].notes = f"New notes {i}."
+        db.save_changes()
+        if db._journal.folded != container.TRANSACTIONS - 1:
+            break
+    else:
+        pytest.fail("The journal wasn't folded.")
+
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db._journal == db._journal
+    assert len(new_db._journal.digests) == 1
+    assert new_db.accounts == db.accounts
+
+
+def test_sqlite_deduplication(sqlite_db, account2):
+    db = sqlite_db
+    account2.accountname = "mega2"
+    account2.attached_files = {"copy": Attachment(b"file1 content\n")}
+    db.accounts["mega2"] = account2
+    db.save_changes()
+
+    storage = db._storage
+    gmail_file = db.accounts["gmail"].attached_files["file1"]
+    assert db.accounts["mega2"].attached_files["copy"].stream == gmail_file.stream
+    assert len(storage.digests()) == 2
+
+    # the content is kept while any account still refers to it
+    del db.accounts["gmail"]
+    db.save_changes()
+    new_db = Database("main")
+    new_db.open("123")
+    assert new_db.accounts["mega2"].attached_files["copy"].read() == b"file1 content\n"
+
+    del new_db.accounts["mega2"]
+    new_db.save_changes()
+    assert not new_db._storage.digests()
+
+
+def test_deduplication_report(src_dir, accounts):
+    accounts["mega"].attached_files = {"copy": Attachment(b"file1 content\n")}
+    db = Database("main", "123", accounts)
+    report = db.deduplication()
+    assert (report.attachments, report.unique) == (3, 2)
+    assert report.saved == len(b"file1 content\n")
+
+    db.create()
+    db.open("123")
+    assert db.deduplication() == report
+
+
+def test_attachment_from_file(src_dir, accounts):
+    path = src_dir / "file.bin"
+    content = os.urandom(3 * 1024 ** 2 + 5)
+    path.write_bytes(content)
+    progress = []
+
+    attachment = Attachment.from_file(path, b"k" * 32, lambda *args: progress.append(args))
+    # the file isn't loaded into memory
+    assert attachment.data is None
+    assert attachment.size() == len(content)
+    assert attachment.digest(b"k" * 32) == container.attachment_digest(b"k" * 32, [content])
+    assert progress[-1] == (len(content), len(content))
+    assert len(progress) == 4
+
+    accounts["mega"].attached_files = {"file.bin": attachment}
+    db = Database("main", "123", accounts)
+    db.create()
+    assert attachment.path is None
+    db.open("123")
+    assert db.accounts["mega"].attached_files["file.bin"].read() == content
+
+
+def test_account_copy(journal_db):
+    account = journal_db.accounts["gmail"]
+    copy = account.copy()
+    assert copy == account
+    assert copy.revision != account.revision
+
+    # the copy doesn't depend on the .dba file
+    journal_db.close()
+    assert copy.attached_files["file2"].read() == b"file2 content\n"
+
+
+def test_attachment_size_limit(src_dir, monkeypatch):
+    path = src_dir / "file.bin"
+    path.write_bytes(b"12345")
+    monkeypatch.setattr("core.database_utils.MAX_ATTACHMENT_SIZE", 4)
+    with pytest.raises(AttachmentError):
+        Attachment.from_file(path)
+
+
+def test_attached_file_changed(src_dir):
+    path = src_dir / "file.txt"
+    path.write_bytes(b"content")
+    attachment = Attachment.from_file(path)
+    path.write_bytes(b"new content")
+    assert attachment.read() == b"content"
+    path.unlink()
+    assert attachment.read() == b"content"
+    assert attachment.size() == len(b"content")
+
+
+def test_attachments_from_files(src_dir):
+    paths = {}
+    for i in range(4):
+        paths[f"file{i}"] = src_dir / f"file{i}"
+        paths[f"file{i}"].write_bytes(b"x" * 1000 * i)
+    paths["missing"] = src_dir / "missing"
+    progress = []
+
+    attached_files, errors = Attachment.from_files(
+        paths, b"k" * 32, lambda *args: progress.append(args),
+    )
+    assert list(errors) == ["missing"]
+    assert isinstance(errors["missing"], FileNotFoundError)
+    assert [attached_files[f"file{i}"].read() for i in range(4)] == [
+        b"x" * 1000 * i for i in range(4)
+    ]
+    assert max(progress) == (6000, 6000)
+
+
+def test_save_attachment(src_dir):
+    content = os.urandom(2 * 1024 ** 2)
+    source = src_dir / "source"
+    source.write_bytes(content)
+    progress = []
+
+    Attachment.from_file(source).save(src_dir / "copy", lambda *args: progress.append(args))
+    assert (src_dir / "copy").read_bytes() == content
+    assert progress == [(1024 ** 2, len(content)), (len(content), len(content))]
+    assert not list(src_dir.glob("copy.*.tmp"))
+
+
+def test_secret_fields_sealed(account):
+    slot = Account.password.slot
+    assert isinstance(slot.__get__(account), bytes)
+    assert b"123" not in slot.__get__(account)
+    assert account.password == "123"
+    assert account.utf8("notes") == b"My gmail account."
+
+    account.notes = "Новий."
+    assert account.notes == "Новий."
+    assert Account.notes.slot.__get__(account) != "Новий.".encode()
+
+    attachment = Attachment(b"file content")
+    assert b"file content" not in attachment._data
+    assert attachment.read() == b"file content"
+    assert attachment.size() == len(b"file content")
+
+
+def test_open_doesnt_decode_secrets(src_dir, accounts):
+    Database("main", "123", accounts).create()
+    db = Database("main")
+    with patch("core.sealed.unseal") as unseal:
+        db.open("123")
+    unseal.assert_not_called()
+    assert db.accounts == accounts
+
+
+# opens database and prints how much the peak RSS grew while it was opened
+MEASURE_OPEN = """
+import gc
+import sys
+from pathlib import Path
+
+import core
+core.SRC_DIR = Path(sys.argv[1])
+from core.database_utils import Database
+
+
+def rss(field: str) -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+
+
+db = Database("main")
+db.password = "123"
+db.open("123")  # the key is derived and cached, its memory isn't counted
+db.accounts = {}
+gc.collect()
+with open("/proc/self/clear_refs", "w") as clear_refs:
+    clear_refs.write("5")  # resets the peak RSS
+before = rss("VmRSS:")
+db.open("123")
+print(rss("VmHWM:") - before)
+"""
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Uses /proc.")
+def test_open_memory(src_dir):
+    """
+    Opening a database doesn't keep several copies of its content in memory at once.
+    """
+
+    accounts = {
+        f"account{i}": Account(f"account{i}", "user", "", "123", "", os.urandom(4096).hex())
+        for i in range(2000)
+    }
+    db = Database("main", "123", accounts)
+    db.create()
+
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE_OPEN, str(src_dir)],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent.parent,
+    )
+    # the notes take about as much memory as the content of the file
+    assert int(result.stdout) < 3 * db.dba_file.stat().st_size
+
+
+def test_detect_format(main_db, src_dir, accounts):
+    with open(src_dir / "main.dba", "rb") as file:
+        assert detect_format(file) == LEGACY_FORMAT
+        assert file.tell() == 0
+
+    formats = ((CONTAINER_ENGINE, CONTAINER_FORMAT), (SQLITE_ENGINE, SQLITE_FORMAT))
+    for engine, file_format in formats:
+        Database("main", "123", accounts).create(engine=engine)
+        with open(src_dir / "main.dba", "rb") as file:
+            assert detect_format(file) == file_format
+
+    for content in (b"", b"not a database" * 100):
+        assert detect_format(io.BytesIO(content)) is None
+
+
+def test_open_not_a_database(src_dir):
+    (src_dir / "main.dba").write_bytes(b"not a database" * 100)
+    with pytest.raises(InvalidToken):
+        Database("main").open("123")
@@ -23,11 +23,12 @@ from core.create_account import CreateAccount
 from core.database_utils import Database
 from core.database_window import DatabaseWindow, SELECT_ACCOUNT_TO_EDIT, CONFIRM_ACCOUNT_DELETION, \
     SELECT_ACCOUNTS_TO_DELETE, CONFIRM_QUIT, SUCCESS_DB_SAVED, ERROR_DB_SAVE, \
-    SUCCESS_CUTTING_ACCOUNTS, SUCCESS_COPYING_ACCOUNTS, CONFIRM_ACCOUNT_REPLACE
+    SUCCESS_CUTTING_ACCOUNTS, SUCCESS_COPYING_ACCOUNTS, CONFIRM_ACCOUNT_REPLACE, SAVING_DB, \
+    LOADING_ACCOUNTS, ERROR_DB_LOADING, DB_BEING_WRITTEN
 from core.display_account import DisplayAccount
 from core.edit_account import EditAccount
 from core.edit_database import EditDatabase
-from core.gtk_utils import load_icon, item_name, items_names
+from core.gtk_utils import load_icon, item_name, items_names, wait_until
 from core.widgets import ErrorDialog
 
 
@@ -68,6 +69,57 @@ def test_load_accounts(db_window):
     assert account_names == ["gmail", "mega"]
 
 
+@pytest.fixture
+def loading_window(databases, main_window):
+    db = main_window.databases[2]
+    db.open("123")
+    db.create()
+    db.close()
+
+    names = db.read_index("123")
+    return DatabaseWindow(db, main_window, names)
+
+
+def test_load_accounts_from_index(loading_window):
+    win = loading_window
+    # the names are displayed right away, the accounts are loaded in background
+    assert items_names(win.accounts_list) == ["gmail", "mega"]
+    assert win.statusbar.label.text == LOADING_ACCOUNTS
+    assert not win.menubar_toolbar.sensitive
+
+    # the account selected while loading is displayed once it's loaded
+    win.accounts_list.children[0].activate()
+    wait_until(lambda: not win.loading)
+    assert win.menubar_toolbar.sensitive
+    assert win.database.saved
+
+    form = win.form_box.children[0]
+    assert isinstance(form, DisplayAccount)
+    assert form.account == win.database.accounts["gmail"]
+
+
+@patch("core.database_window.ErrorDialog", autospec=True)
+def test_load_accounts_error(dialog: "Mock[ErrorDialog]", databases, main_window):
+    db = main_window.databases[2]
+    db.open("123")
+    db.create()
+    db.close()
+    names = db.read_index("123")
+
+    err = Exception("error")
+    with patch.object(db, "open", side_effect=err):
+        DatabaseWindow(db, main_window, names)
+        wait_until(lambda: dialog.called)
+    dialog.assert_called_with(ERROR_DB_LOADING, err)
+    assert not db.opened
+
+
+def test_quit_while_loading(loading_window):
+    win = loading_window
+    assert not win.do_delete_event(None)
+    wait_until(lambda: not win.database.opened)
+
+
 def test_select_account(db_window):
     # select an account
     row = db_window.accounts_list.children[0]
@@ -198,6 +250,22 @@ def test_confirm_quit_Ok(dialog: Mock, db_window):
     assert not db_window.database.opened
 
 
+@patch("core.database_window.WarningDialog", autospec=True)
+def test_confirm_quit_Save(dialog: Mock, db_window):
+    # the database is not saved
+    del db_window.database.accounts["mega"]
+
+    # choose Save in the confirmation dialog
+    dialog.return_value.run.return_value = Gtk.ResponseType.ACCEPT
+    assert not db_window.do_delete_event(None)
+    assert not db_window.database.opened
+
+    # the database should be saved before closing
+    db = Database("main")
+    db.open("123")
+    assert list(db.accounts) == ["gmail"]
+
+
 def test_hide_edit_db_form_when_its_window_closes(db_window):
     window = db_window.main_window
     form = EditDatabase(db_window.database, window)
@@ -207,9 +275,38 @@ def test_hide_edit_db_form_when_its_window_closes(db_window):
     assert not window.form_box.children
 
 
+def test_quit_while_editing_database(db_window):
+    # EditDatabase is changing password or name of the database in background
+    db_window.set_writing(True)
+
+    assert db_window.do_delete_event(None)
+    assert db_window.database.opened
+    assert db_window.statusbar.label.text == f"✘ {DB_BEING_WRITTEN}"
+
+
 def test_save_database_success(db_window):
     db_window.on_save()
-    assert db_window.statusbar.label.text == f"✔ {SUCCESS_DB_SAVED}"
+    assert db_window.statusbar.label.text == SAVING_DB
+    wait_until(lambda: db_window.statusbar.label.text == f"✔ {SUCCESS_DB_SAVED}")
+
+
+def test_save_database_disables_editing(db_window):
+    db_window.on_save()
+    # the accounts can't be changed while they're being written
+    assert db_window.writing
+    assert not db_window.menubar_toolbar.sensitive
+    assert not db_window.form_box.sensitive
+
+    wait_until(lambda: not db_window.writing)
+    assert db_window.menubar_toolbar.sensitive
+    assert db_window.form_box.sensitive
+
+
+@patch("core.database_window.auto_backup")
+def test_save_database_backup(auto_backup: Mock, db_window):
+    db_window.on_save()
+    wait_until(lambda: db_window.statusbar.label.text == f"✔ {SUCCESS_DB_SAVED}")
+    auto_backup.assert_called_once_with()
 
 
 @patch("core.database_window.ErrorDialog", autospec=True)
@@ -219,6 +316,7 @@ def test_save_database_error(mock, dialog: "Mock[ErrorDialog]", db_window, faker
     mock.side_effect = err
 
     db_window.on_save()
+    wait_until(lambda: dialog.called)
     dialog.assert_called_with(ERROR_DB_SAVE, err)
     assert not db_window.statusbar.label.text
 
@@ -231,7 +329,7 @@ def test_check_db_saved(db_window):
     assert db_window.title == "*main"
 
     db_window.on_save()
-    assert db_window.title == "main"
+    wait_until(lambda: db_window.title == "main")
 
 
 def test_cut_accounts(db_window):
@@ -311,6 +409,11 @@ def test_cut_and_paste_accounts(db_window, db_window2):
     assert "*" in db_window.title
     assert "*" in db_window2.title
 
+    # the pasted account doesn't depend on the file of the database it was cut from
+    pasted = db_window2.database.accounts["mega"]
+    db_window.database.close()
+    assert all(attachment.read() for attachment in pasted.attached_files.values())
+
 
 def test_copy_and_paste_accounts(db_window, db_window2):
     # select an account
@@ -18,6 +18,7 @@ from unittest.mock import patch, Mock
 import pytest
 from gi.repository import Gtk, Gdk
 
+from core.database_utils import Attachment
 from core.display_account import DisplayAccount, NOTES_PLACEHOLDER, DOTS, SUCCESS_SAVING_FILE, \
     SUCCESS_PASSWORD_COPY, SUCCESS_NOTES_COPY
 from core.gtk_utils import notes_text, items_names
@@ -85,7 +86,7 @@ def test_copy_notes(form: DisplayAccount, account):
 
 def test_save_attached_file_success(form: DisplayAccount, account, src_dir):
     path = src_dir / "file.txt"
-    form.save_attached_file(path, "SGVsbG8h")
+    form.save_attached_file(path, Attachment(b"Hello!"))
     assert open(path, "rb").read() == b"Hello!"
     assert form.database_window.statusbar.label.text == f"✔ {SUCCESS_SAVING_FILE}"
 
@@ -93,5 +94,5 @@ def test_save_attached_file_success(form: DisplayAccount, account, src_dir):
 @patch("core.display_account.ErrorDialog", autospec=True)
 def test_save_attached_file_error(dialog: Mock, form: DisplayAccount, account):
     path = "/file.txt"
-    form.save_attached_file(path, "Hello!")
+    form.save_attached_file(path, Attachment(b"Hello!"))
     dialog.assert_called()
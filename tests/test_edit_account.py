@@ -15,6 +15,7 @@
 #  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
 import pytest
 
+from core.database_utils import Attachment
 from core.edit_account import EditAccount
 from core.gtk_utils import notes_text, items_names
 
@@ -46,12 +47,13 @@ def test_load_account(form, account):
 
 
 def test_load_already_attached_files(form, account):
-    form.attach_file("tests/data/file1.txt")
-    result = form.build_account()
+    attachment = Attachment.from_file("tests/data/file1.txt")
+    result = form.build_account({"file1.txt": attachment})
 
-    assert result.attached_files["file1.txt"] == 'RmlsZSAxIGNvbnRlbnQuCg=='
-    assert result.attached_files["file1"] == "ZmlsZTEgY29udGVudAo="
-    assert result.attached_files["file2"] == "ZmlsZTIgY29udGVudAo="
+    assert result.attached_files["file1.txt"].read() == b"File 1 content.\n"
+    # already attached files shouldn't be copied
+    assert result.attached_files["file1"] is account.attached_files["file1"]
+    assert result.attached_files["file2"] is account.attached_files["file2"]
 
 
 def test_edit_account(form, account):
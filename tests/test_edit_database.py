@@ -18,9 +18,9 @@ from unittest.mock import Mock, PropertyMock, patch
 import pytest
 
 from core.database_utils import Database
-from core.database_window import DatabaseWindow
+from core.database_window import DB_BEING_WRITTEN, DatabaseWindow
 from core.edit_database import EditDatabase, ERROR_EDITING_DB
-from core.gtk_utils import item_name, items_names
+from core.gtk_utils import item_name, items_names, wait_until
 from core.widgets import ErrorDialog
 
 
@@ -49,7 +49,10 @@ def test_edit_database_success(src_dir, form):
     form.password.text = "321"
     form.repeat_password.text = "321"
     form.on_apply()
+    assert form.main_window.pending_renames == {("main", "database")}
+    wait_until(lambda: "database" in form.main_window.windows)
 
+    assert not form.main_window.pending_renames
     assert (src_dir / "database.dba").exists()
     assert not (src_dir / "main.dba").exists()
 
@@ -74,6 +77,42 @@ def test_edit_database_success(src_dir, form):
     assert win.title == "database"
 
 
+def test_edit_database_password(src_dir, form):
+    win = DatabaseWindow(form.main_window.databases[2], form.main_window)
+    form.main_window.windows["main"] = win
+
+    form.password.text = "321"
+    form.repeat_password.text = "321"
+    form.on_apply()
+    # the window can't change the database while its password is changed
+    assert win.writing
+    wait_until(lambda: len(form.main_window.form_box.children) == 0)
+
+    assert not win.writing
+    assert win.database.password == "321"
+    assert form.main_window.windows["main"] is win
+    assert items_names(form.main_window.db_list).count("main") == 1
+
+    db = Database("main")
+    db.open("321")
+    assert db.accounts == win.database.accounts
+
+
+def test_edit_database_while_saving(form):
+    win = DatabaseWindow(form.main_window.databases[2], form.main_window)
+    form.main_window.windows["main"] = win
+    win.on_save()
+
+    form.password.text = "321"
+    form.repeat_password.text = "321"
+    form.on_apply()
+    assert form.main_window.statusbar.label.text == f"✘ {DB_BEING_WRITTEN}"
+    assert form.apply.sensitive
+
+    wait_until(lambda: not win.writing)
+    assert win.database.password == "123"
+
+
 @patch("core.edit_database.ErrorDialog", autospec=True)
 @patch("core.edit_database.Database.dba_file", new_callable=PropertyMock)
 def test_edit_database_error(mock, dialog: "Mock[ErrorDialog]", form, faker):
@@ -85,5 +124,7 @@ def test_edit_database_error(mock, dialog: "Mock[ErrorDialog]", form, faker):
     form.repeat_password.text = "321"
 
     form.on_apply()
+    wait_until(lambda: dialog.called)
     dialog.assert_called_with(ERROR_EDITING_DB, err)
+    assert not form.main_window.pending_renames
 
@@ -0,0 +1,103 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import threading
+
+import pytest
+
+from core.file_utils import atomic_write, backup_files, locked, rotate_backups
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "main.dba"
+    path.write_bytes(b"old")
+
+    with atomic_write(path) as file:
+        file.write(b"new")
+        assert path.read_bytes() == b"old"
+
+    assert path.read_bytes() == b"new"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_atomic_write_unique_tmp_file(tmp_path):
+    path = tmp_path / "main.dba"
+    with atomic_write(path) as file, atomic_write(path) as other_file:
+        assert file.name != other_file.name
+        assert file.name.endswith(".tmp")
+        file.write(b"1")
+        other_file.write(b"2")
+    assert path.read_bytes() == b"1"
+
+
+def test_atomic_write_error(tmp_path):
+    path = tmp_path / "main.dba"
+    path.write_bytes(b"old")
+
+    with pytest.raises(OSError):
+        with atomic_write(path) as file:
+            file.write(b"new")
+            raise OSError("No space left on device")
+
+    assert path.read_bytes() == b"old"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_atomic_write_backups(tmp_path):
+    path = tmp_path / "main.dba"
+    for version in (b"1", b"2", b"3", b"4"):
+        with atomic_write(path, backups=2) as file:
+            file.write(version)
+
+    assert path.read_bytes() == b"4"
+    assert (tmp_path / "main.dba.1").read_bytes() == b"3"
+    assert (tmp_path / "main.dba.2").read_bytes() == b"2"
+    assert not (tmp_path / "main.dba.3").exists()
+
+
+def test_rotate_backups_without_file(tmp_path):
+    path = tmp_path / "main.dba"
+    rotate_backups(path, 3)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_backup_files(tmp_path):
+    path = tmp_path / "main.dba"
+    for version in range(12):
+        with atomic_write(path, backups=10) as file:
+            file.write(b"%d" % version)
+    (tmp_path / "main.dba.tmp").write_bytes(b"")
+    (tmp_path / "main.dba.dba").write_bytes(b"")
+
+    assert backup_files(path) == [tmp_path / f"main.dba.{number}" for number in range(1, 11)]
+
+
+def test_locked(tmp_path):
+    path = tmp_path / "lock"
+    events = []
+
+    def hold_lock():
+        with locked(path):
+            events.append("second")
+
+    with locked(path):
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        thread.join(0.2)
+        # the other thread waits until the lock is released
+        assert thread.is_alive()
+        events.append("first")
+    thread.join()
+    assert events == ["first", "second"]
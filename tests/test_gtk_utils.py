@@ -13,10 +13,13 @@
 #
 #  You should have received a copy of the GNU General Public License
 #  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import threading
+from unittest.mock import Mock
+
 import pytest
 from gi.repository import Gtk
 
-from core.gtk_utils import ListOrder, abc_list_sort, delete_list_item, item_name
+from core.gtk_utils import ListOrder, Task, abc_list_sort, delete_list_item, item_name, wait_until
 
 
 @pytest.mark.parametrize(
@@ -60,3 +63,43 @@ def test_delete_item():
 
     for row in list_box.children:
         assert item_name(row) != "data"
+
+
+def test_task_done():
+    main_thread = threading.current_thread()
+    results = []
+
+    def on_done(result):
+        # callbacks should be called on the main loop
+        assert threading.current_thread() == main_thread
+        results.append(result)
+
+    Task(lambda x: x * 2, 21, on_done=on_done)
+    wait_until(lambda: results)
+    assert results == [42]
+
+
+def test_task_error():
+    err = ValueError("error")
+    on_error = Mock()
+
+    def func():
+        raise err
+
+    Task(func, on_error=on_error)
+    wait_until(lambda: on_error.called)
+    on_error.assert_called_with(err)
+
+
+def test_task_cancel():
+    event = threading.Event()
+    on_done = Mock()
+
+    task = Task(event.wait, on_done=on_done)
+    task.cancel()
+    event.set()
+
+    wait_until(lambda: not task.running)
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+    on_done.assert_not_called()
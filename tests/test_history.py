@@ -0,0 +1,227 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import os
+
+import pytest
+
+from core import history
+from core.container import CorruptedContainer
+from core.database_utils import Account, Attachment, Database
+
+
+def make_account(name: str, notes: str = "", **attached_files: bytes) -> Account:
+    return Account(
+        name, "user", "user@example.com", "123", "01.01.2000", notes, False,
+        {file: Attachment(data) for file, data in attached_files.items()},
+    )
+
+
+@pytest.fixture
+def db(src_dir) -> Database:
+    accounts = {
+        f"account{i}": make_account(f"account{i}", os.urandom(50).hex()) for i in range(100)
+    }
+    db = Database("main", "123", accounts)
+    db.create()
+    return db
+
+
+def test_save_records_revisions(db):
+    db.save_changes()
+    db.accounts["account1"] = make_account("account1", "changed")
+    del db.accounts["account2"]
+    db.save_changes()
+    # nothing changed, so no revision is recorded
+    db.save_changes()
+
+    revisions = db.history().revisions()
+    assert [r.number for r in revisions] == [1, 2]
+    assert revisions[0].checkpoint
+    assert len(revisions[0].changed) == 100
+    assert not revisions[1].checkpoint
+    assert revisions[1].changed == ["account1"]
+    assert revisions[1].deleted == ["account2"]
+
+
+def test_delta_size(db):
+    db.save_changes()
+    checkpoint_size = db.history_file.stat().st_size
+
+    db.accounts["account1"] = make_account("account1", "changed")
+    db.save_changes()
+    delta_size = db.history_file.stat().st_size - checkpoint_size
+    assert delta_size < checkpoint_size / 10
+
+
+def test_checkpoints(db, monkeypatch):
+    monkeypatch.setattr(history, "CHECKPOINT_INTERVAL", 3)
+    for i in range(7):
+        db.accounts["account1"] = make_account("account1", str(i))
+        db.save_changes()
+
+    revisions = db.history().revisions()
+    assert [r.checkpoint for r in revisions] == [True, False, False, True, False, False, True]
+    assert len(revisions[3].changed) == 100
+
+    # accounts of a revision are replayed from the checkpoint before it
+    db.restore(6)
+    assert db.accounts["account1"].notes == "5"
+
+
+def test_prune(db, monkeypatch):
+    monkeypatch.setattr(history, "CHECKPOINT_INTERVAL", 2)
+    monkeypatch.setattr(history, "KEEP_CHECKPOINTS", 2)
+    contents = [os.urandom(10_000) for _ in range(7)]
+    for content in contents:
+        db.accounts["account1"] = make_account("account1", file=content)
+        db.save_changes()
+
+    # revisions 1 and 3 are checkpoints before the last two
+    hist = db.history()
+    assert [r.number for r in hist.revisions()] == [5, 6, 7]
+    # only the attachments of the kept revisions are kept
+    attachments = [s for s in hist.source.locations if s < history.REVISION_STREAMS]
+    assert len(attachments) == 3
+    hist.close()
+
+    with pytest.raises(KeyError):
+        db.revision_accounts(4)
+    for number in (5, 6, 7):
+        attachment = db.revision_accounts(number)["account1"].attached_files["file"]
+        assert attachment.read() == contents[number - 1]
+
+    # numbers of the dropped revisions aren't used again
+    db.accounts["account1"] = make_account("account1", "changed")
+    db.save_changes()
+    assert db.history().revisions()[-1].number == 8
+
+
+def test_restore(db):
+    db.save_changes()
+    db.accounts["account1"] = make_account("account1", "changed")
+    del db.accounts["account2"]
+    db.accounts["new"] = make_account("new")
+    db.save_changes()
+
+    accounts = db.revision_accounts(1)
+    assert set(accounts) == {f"account{i}" for i in range(100)}
+    assert accounts["account1"].notes != "changed"
+
+    db.restore_account(1, "account2")
+    assert "account2" in db.accounts
+    with pytest.raises(KeyError):
+        db.restore_account(1, "new")
+
+    db.restore(1)
+    assert "new" not in db.accounts
+    db.save_changes()
+    # restoring is saved as a new revision
+    assert db.history().revisions()[-1].deleted == ["new"]
+
+    disk_db = Database("main")
+    disk_db.open("123")
+    assert disk_db.revision_accounts(3) == disk_db.accounts
+
+    with pytest.raises(KeyError):
+        db.restore(10)
+
+
+def test_attachments(db):
+    content = os.urandom(100_000)
+    db.accounts["account1"] = make_account("account1", file=content)
+    db.save_changes()
+    size = db.history_file.stat().st_size
+
+    # the same content attached to another account isn't stored again
+    db.accounts["account2"] = make_account("account2", copy=content)
+    db.save_changes()
+    assert db.history_file.stat().st_size - size < len(content) / 10
+
+    db.restore_account(2, "account2")
+    assert db.accounts["account2"].attached_files["copy"].read() == content
+    db.save_changes()
+
+    disk_db = Database("main")
+    disk_db.open("123")
+    assert disk_db.accounts["account2"].attached_files["copy"].read() == content
+
+
+def test_interrupted_revision(db):
+    db.save_changes()
+    db.accounts["account1"] = make_account("account1", "changed")
+    db.save_changes()
+    # the last revision was written partially
+    size = db.history_file.stat().st_size
+    with open(db.history_file, "r+b") as file:
+        file.truncate(size - 10)
+
+    assert [r.number for r in db.history().revisions()] == [1]
+    db.accounts["account1"] = make_account("account1", "changed again")
+    db.save_changes()
+    # the partial revision was dropped, so its number is used again
+    assert [r.number for r in db.history().revisions()] == [1, 2]
+    assert db.revision_accounts(2)["account1"].notes == "changed again"
+
+
+def test_damaged_revision(db):
+    notes = db.accounts["account1"].notes
+    db.save_changes()
+    for changed in ("first", "second"):
+        db.accounts["account1"] = make_account("account1", changed)
+        db.save_changes()
+
+    # damage the second revision
+    hist = db.history()
+    location = hist.source.locations[hist.revision(2).stream][0]
+    hist.close()
+    with open(db.history_file, "r+b") as file:
+        file.seek(location.offset + location.length - 1)
+        last = file.read(1)
+        file.seek(-1, os.SEEK_CUR)
+        file.write(bytes([last[0] ^ 1]))
+
+    hist = db.history()
+    assert [r.number for r in hist.revisions()] == [1, 3]
+    assert hist.damaged() == [2]
+    hist.close()
+    assert db.revision_accounts(1)["account1"].notes == notes
+    with pytest.raises(CorruptedContainer):
+        db.revision_accounts(3)
+
+    # the next revision is a checkpoint, so that it can be restored
+    db.accounts["account1"] = make_account("account1", "third")
+    db.save_changes()
+    assert db.history().revision(4).checkpoint
+    assert db.revision_accounts(4)["account1"].notes == "third"
+
+
+def test_unreadable_history(db):
+    db.history_file.write_bytes(b"damaged")
+    db.save_changes()
+    assert [r.checkpoint for r in db.history().revisions()] == [True]
+    # the old history is kept aside
+    assert (db.history_file.parent / "main.history.corrupt").read_bytes() == b"damaged"
+
+    db.history_file.write_bytes(b"damaged again")
+    db.save_changes()
+    assert (db.history_file.parent / "main.history.corrupt.1").read_bytes() == b"damaged again"
+
+
+def test_rename(db):
+    db.save_changes()
+    db.rename("renamed")
+    assert not (db.history_file.parent / "main.history").exists()
+    assert [r.number for r in db.history().revisions()] == [1]
@@ -0,0 +1,97 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import os
+from unittest.mock import patch
+
+import pytest
+
+from core import kdf
+from core.kdf import KdfParams
+
+
+@pytest.fixture(autouse=True)
+def clear_calibration_cache():
+    kdf.calibrated_params.cache_clear()
+    yield
+    kdf.calibrated_params.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "params",
+    (
+        KdfParams(os.urandom(16), iterations=10),
+        KdfParams(os.urandom(16), "scrypt", n=2 ** 10, r=4, p=2),
+    ),
+)
+def test_kdf_params_to_dict(params):
+    assert KdfParams.from_dict(params.to_dict()) == params
+
+
+def test_scrypt_params_dont_include_iterations():
+    params = KdfParams(os.urandom(16), "scrypt")
+    assert "iterations" not in params.to_dict()
+
+
+def test_derive():
+    salt = os.urandom(16)
+    for params in (KdfParams(salt, iterations=10), KdfParams(salt, "scrypt", n=2 ** 10)):
+        key = params.derive("123")
+        assert len(key) == 32
+        assert params.derive("123") == key
+        assert params.derive("321") != key
+
+
+def test_unsupported_algorithm():
+    with pytest.raises(ValueError):
+        KdfParams(os.urandom(16), "md5")
+
+
+@patch("core.kdf.measure", return_value=0.01)
+def test_calibrate_pbkdf2(measure):
+    params = kdf.calibrate("pbkdf2-sha256", target=0.25)
+    assert params.algorithm == "pbkdf2-sha256"
+    # 10k iterations take 10 ms, so 250 ms is 250k iterations
+    assert params.iterations == 250_000
+
+
+@patch("core.kdf.measure", return_value=0.01)
+def test_calibrate_scrypt(measure):
+    params = kdf.calibrate("scrypt", target=0.1)
+    assert params.algorithm == "scrypt"
+    assert params.n == kdf.MIN_SCRYPT_N * 8
+    assert params.p == 1
+
+    # once memory limit is reached, parallelism is increased instead
+    params = kdf.calibrate("scrypt", target=10)
+    assert params.n == kdf.MAX_SCRYPT_N
+    assert params.p == 125
+
+
+@patch("core.kdf.measure", return_value=1)
+def test_calibrate_never_weakens(measure):
+    assert kdf.calibrate("pbkdf2-sha256", target=0.01).iterations == kdf.MIN_ITERATIONS
+    params = kdf.calibrate("scrypt", target=0.01)
+    assert (params.n, params.p) == (kdf.MIN_SCRYPT_N, 1)
+
+
+def test_calibrate_is_cached():
+    first = kdf.calibrate("pbkdf2-sha256", target=0.01)
+    with patch("core.kdf.measure") as measure:
+        second = kdf.calibrate("pbkdf2-sha256", target=0.01)
+        measure.assert_not_called()
+
+    assert first.iterations == second.iterations
+    assert first.salt != second.salt
@@ -17,7 +17,7 @@ import shutil
 from pathlib import Path
 from unittest.mock import Mock, patch, PropertyMock
 
-from gi.repository import Gtk, GdkPixbuf
+from gi.repository import Gtk, GdkPixbuf, Gio
 
 import core
 from core.create_database import CreateDatabase
@@ -203,6 +203,8 @@ def test_delete_database_no_selection(databases, main_window):
 
 def test_delete_database_success(databases, main_window):
     main_db = main_window.databases[2]
+    backup = main_db.dba_file.with_name("main.dba.1")
+    backup.write_bytes(b"")
     main_window.form_box.add(OpenDatabase(main_db, main_window))
     main_window.delete_database(main_db)
 
@@ -216,8 +218,9 @@ def test_delete_database_success(databases, main_window):
     for row in main_window.db_list.children:
         assert item_name(row) != "main"
 
-    # its .dba file should be deleted
+    # its .dba file should be deleted, along with its backups
     assert not main_db.dba_file.exists()
+    assert not backup.exists()
 
     # no form should be shown
     assert not main_window.form_box.children
@@ -367,6 +370,19 @@ def test_import_corrupted_database(dialog: Mock, src_dir, main_window):
     assert not main_window.statusbar.label.text
 
 
+@patch("core.main_window.IconDialog", autospec=True)
+def test_import_not_a_database(dialog: Mock, src_dir, tmp_path, main_window):
+    IconDialog.run = lambda _: None
+    # big enough, but neither legacy nor version 2 database
+    path = tmp_path / "notes.dba"
+    path.write_bytes(b"some notes\n" * 100)
+    main_window.import_database(str(path))
+
+    dialog.assert_called_with("Warning!", WARNING_DB_CORRUPTED, "dialog-warning")
+    assert not Path(src_dir / "notes.dba").exists()
+    assert Database("notes") not in main_window.databases
+
+
 @patch("shutil.copy", autospec=True)
 @patch("core.main_window.ErrorDialog", autospec=True)
 def test_import_database_error(dialog: Mock, mock_copy: Mock, src_dir, main_window, faker):
@@ -453,3 +469,92 @@ def test_export_database_error(dialog: Mock, mock_copy: Mock, main_window, faker
     dialog.assert_called_with(ERROR_DB_EXPORT, err)
     dialog.return_value.run.assert_called()
     assert not main_window.statusbar.label.text
+
+
+def src_file(name: str) -> Gio.File:
+    return Gio.File.new_for_path(str(core.SRC_DIR / name))
+
+
+def test_src_dir_created(databases, main_window):
+    shutil.copy("tests/data/main.dba", core.SRC_DIR / "new.dba")
+    event = Gio.FileMonitorEvent.CREATED
+    main_window.on_src_dir_changed(None, src_file("new.dba"), None, event)
+    # the event of a database created by the app itself changes nothing
+    main_window.on_src_dir_changed(None, src_file("new.dba"), None, event)
+    # and other files are ignored
+    main_window.on_src_dir_changed(None, src_file("settings.json"), None, event)
+
+    assert items_names(main_window.db_list) == ["crypt", "data", "main", "new"]
+    assert main_window.databases[3] == Database("new")
+    assert "new" in main_window.manifest.files
+
+
+def test_src_dir_other_files(databases, main_window):
+    (core.SRC_DIR / "main.history").write_bytes(b"history")
+    main_window.on_src_dir_changed(
+        None, src_file("main.history"), None, Gio.FileMonitorEvent.CREATED,
+    )
+
+    assert items_names(main_window.db_list) == ["crypt", "data", "main"]
+    # the change is recorded, so that SRC_DIR isn't scanned at startup
+    assert main_window.manifest.directory_mtime_ns == core.SRC_DIR.stat().st_mtime_ns
+
+
+def test_databases_tooltips(databases, main_window):
+    size = (core.SRC_DIR / "main.dba").stat().st_size
+    assert main_window.database_tooltip("main") == f"Legacy database, {size / 1024:.0f} KiB"
+    assert main_window.database_tooltip("unknown") == ""
+
+    row = main_window.db_list.children[2]
+    assert row.children[0].children[0].tooltip_text == main_window.database_tooltip("main")
+
+
+def test_src_dir_deleted(databases, main_window):
+    main_window.databases[0].open("123")
+    (core.SRC_DIR / "crypt.dba").unlink()
+    (core.SRC_DIR / "main.dba").unlink()
+    for name in ("crypt.dba", "main.dba"):
+        main_window.on_src_dir_changed(
+            None, src_file(name), None, Gio.FileMonitorEvent.DELETED,
+        )
+
+    # opened databases stay in the list
+    assert items_names(main_window.db_list) == ["crypt", "data"]
+    assert sorted(main_window.manifest.files) == ["data"]
+
+
+def test_src_dir_renamed(databases, main_window):
+    db = main_window.databases[2]
+    db.open("123")
+    main_window.windows["main"] = win = Mock()
+    (core.SRC_DIR / "main.dba").rename(core.SRC_DIR / "b.dba")
+    main_window.on_src_dir_changed(
+        None, src_file("main.dba"), src_file("b.dba"), Gio.FileMonitorEvent.RENAMED,
+    )
+
+    assert items_names(main_window.db_list) == ["b", "crypt", "data"]
+    assert db.name == "b"
+    assert main_window.windows == {"b": win}
+    assert win.title == "b"
+
+    # a database saved by the app
+    main_window.on_src_dir_changed(
+        None, src_file("b.tmp"), src_file("b.dba"), Gio.FileMonitorEvent.RENAMED,
+    )
+    assert items_names(main_window.db_list) == ["b", "crypt", "data"]
+
+
+def test_src_dir_renamed_by_edit_database(databases, main_window):
+    db = main_window.databases[2]
+    db.open("123")
+    main_window.pending_renames.add(("main", "b"))
+    # the file is moved, but Database.rename hasn't finished yet
+    (core.SRC_DIR / "main.dba").rename(core.SRC_DIR / "b.dba")
+    main_window.on_src_dir_changed(
+        None, src_file("main.dba"), src_file("b.dba"), Gio.FileMonitorEvent.RENAMED,
+    )
+
+    # the list is updated by EditDatabase once the renaming is done
+    assert items_names(main_window.db_list) == ["crypt", "data", "main"]
+    assert db.name == "main"
+    assert "b" in main_window.manifest.files
@@ -0,0 +1,107 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import os
+import shutil
+from unittest.mock import patch
+
+import pytest
+
+from core.database_utils import LEGACY_FORMAT
+from core.manifest import MANIFEST_FILE, DatabaseManifest
+
+# long ago, so that the manifest is written later than SRC_DIR is modified
+PAST_NS = 1_600_000_000 * 10 ** 9
+
+
+@pytest.fixture
+def manifest(databases, src_dir) -> DatabaseManifest:
+    manifest = DatabaseManifest(src_dir)
+    manifest.load()
+    return manifest
+
+
+def set_mtime(path, mtime_ns: int = PAST_NS):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_load(manifest, src_dir):
+    assert manifest.load() == ["crypt", "data", "main"]
+    assert manifest.files["main"].format == LEGACY_FORMAT
+    assert manifest.files["main"].size == (src_dir / "main.dba").stat().st_size
+
+
+def test_load_cached(manifest, src_dir):
+    set_mtime(src_dir)
+    manifest.load()
+
+    # neither SRC_DIR is listed nor the files are read
+    with patch("core.manifest.detect_format") as detect, \
+            patch("pathlib.Path.glob") as glob:
+        assert DatabaseManifest(src_dir).load() == ["crypt", "data", "main"]
+    detect.assert_not_called()
+    glob.assert_not_called()
+
+
+def test_load_changed_directory(manifest, src_dir):
+    set_mtime(src_dir)
+    manifest.load()
+
+    (src_dir / "crypt.dba").unlink()
+    shutil.copy(src_dir / "main.dba", src_dir / "new.dba")
+    with patch("core.manifest.detect_format", return_value=LEGACY_FORMAT) as detect:
+        assert DatabaseManifest(src_dir).load() == ["data", "main", "new"]
+    # only the new file is read
+    detect.assert_called_once()
+
+
+def test_load_racy(manifest, src_dir):
+    # SRC_DIR was modified when the manifest was written, it could have changed since
+    set_mtime(src_dir)
+    manifest.load()
+    set_mtime(src_dir / MANIFEST_FILE)
+
+    shutil.copy(src_dir / "main.dba", src_dir / "new.dba")
+    set_mtime(src_dir)
+    assert DatabaseManifest(src_dir).load() == ["crypt", "data", "main", "new"]
+
+
+def test_load_damaged(manifest, src_dir):
+    (src_dir / MANIFEST_FILE).write_text("{")
+    assert DatabaseManifest(src_dir).load() == ["crypt", "data", "main"]
+
+
+def test_update(manifest, src_dir):
+    (src_dir / "main.dba").write_bytes(b"not a database")
+    info = manifest.update("main")
+    assert info.format is None
+    assert info.size == len(b"not a database")
+
+    (src_dir / "data.dba").unlink()
+    assert manifest.update("data") is None
+    assert DatabaseManifest(src_dir).load() == ["crypt", "main"]
+
+
+def test_refresh(manifest, src_dir):
+    set_mtime(src_dir)
+    manifest.load()
+
+    # history of a database doesn't change the list
+    (src_dir / "main.history").write_bytes(b"history")
+    manifest.refresh()
+    with patch("pathlib.Path.glob") as glob:
+        assert DatabaseManifest(src_dir).load() == ["crypt", "data", "main"]
+    glob.assert_not_called()
@@ -0,0 +1,134 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import dataclasses
+
+import pytest
+
+from core.database_utils import Account, Attachment, Database
+from core.merge import Conflict, Merger, merge
+
+
+def copy(account: Account, **changes) -> Account:
+    """
+    Copies account as if it was read from another copy of the database.
+    """
+    return dataclasses.replace(account, **changes)
+
+
+@pytest.fixture
+def base() -> dict[str, Account]:
+    return {
+        name: Account(
+            name, "user", "user@example.com", "123", "01.01.2000", "notes", False,
+            {"file": Attachment(b"content")},
+        )
+        for name in ("gmail", "mega", "github", "gitlab")
+    }
+
+
+def test_digest(base):
+    merger = Merger(bytes(32))
+    gmail = base["gmail"]
+    assert merger.digest(gmail) == merger.digest(copy(gmail))
+    assert merger.digest(gmail) != merger.digest(copy(gmail, password="321"))
+    assert merger.digest(gmail) != merger.digest(
+        copy(gmail, attached_files={"file": Attachment(b"other")}),
+    )
+    assert merger.digest(gmail) != merger.digest(
+        copy(gmail, attached_files={"renamed": Attachment(b"content")}),
+    )
+
+
+def test_merge_non_conflicting(base):
+    ours = {name: copy(account) for name, account in base.items()}
+    theirs = {name: copy(account) for name, account in base.items()}
+    ours["gmail"] = copy(base["gmail"], notes="ours")
+    del ours["mega"]
+    ours["new ours"] = copy(base["gmail"], accountname="new ours")
+    theirs["github"] = copy(base["github"], email="other@example.com")
+    del theirs["gitlab"]
+    theirs["new theirs"] = copy(base["gmail"], accountname="new theirs")
+
+    result = merge(base, ours, theirs)
+    assert not result.conflicts
+    assert list(result.accounts) == ["gmail", "github", "new ours", "new theirs"]
+    assert result.accounts["gmail"] is ours["gmail"]
+    assert result.accounts["github"] is theirs["github"]
+    assert result.changed == ["github", "gitlab", "new theirs"]
+
+
+def test_merge_fields(base):
+    ours = dict(base)
+    theirs = dict(base)
+    ours["gmail"] = copy(base["gmail"], notes="ours", password="321")
+    theirs["gmail"] = copy(
+        base["gmail"],
+        email="other@example.com",
+        password="456",
+        attached_files={"file": Attachment(b"content"), "new": Attachment(b"new")},
+    )
+
+    result = merge(base, ours, theirs)
+    gmail = result.accounts["gmail"]
+    assert gmail.notes == "ours"
+    assert gmail.email == "other@example.com"
+    # conflicting fields keep our values
+    assert gmail.password == "321"
+    assert set(gmail.attached_files) == {"file", "new"}
+    assert result.conflicts == [Conflict("gmail", "password")]
+    assert result.changed == ["gmail"]
+
+
+def test_merge_conflicts(base):
+    ours = dict(base)
+    theirs = dict(base)
+    ours["gmail"] = copy(base["gmail"], attached_files={"file": Attachment(b"ours")})
+    theirs["gmail"] = copy(base["gmail"], attached_files={"file": Attachment(b"theirs")})
+    ours["mega"] = copy(base["mega"], notes="changed")
+    del theirs["mega"]
+    del ours["github"]
+    theirs["github"] = copy(base["github"], notes="changed")
+
+    result = merge(base, ours, theirs)
+    assert result.conflicts == [
+        Conflict("gmail", "attached_files", "file"),
+        Conflict("mega"),
+        Conflict("github"),
+    ]
+    assert result.accounts["gmail"].attached_files["file"].read() == b"ours"
+    # changes are kept over deletions
+    assert result.accounts["mega"] is ours["mega"]
+    assert result.accounts["github"] is theirs["github"]
+
+
+def test_merge_databases(src_dir, base):
+    Database("main", "123", base).create()
+    ours = Database("main")
+    ours.open("123")
+    theirs = Database("main")
+    theirs.open("123")
+    ours.accounts["gmail"] = copy(ours.accounts["gmail"], notes="ours")
+    theirs.accounts["mega"] = copy(theirs.accounts["mega"], notes="theirs")
+
+    result = merge(base, ours.accounts, theirs.accounts, ours._data_key)
+    ours.accounts = result.accounts
+    ours.save_changes()
+
+    merged = Database("main")
+    merged.open("123")
+    assert merged.accounts["gmail"].notes == "ours"
+    assert merged.accounts["mega"].notes == "theirs"
+    assert merged.accounts["github"] == base["github"]
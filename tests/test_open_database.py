@@ -17,7 +17,7 @@ from unittest.mock import patch, PropertyMock, Mock
 
 import pytest
 
-from core.gtk_utils import wait_until
+from core.gtk_utils import items_names, wait_until
 from core.open_database import OpenDatabase, ERROR_DB_OPENING
 from core.widgets import ErrorDialog
 
@@ -60,6 +60,7 @@ def test_password_prefill(databases, main_window):
 def test_open_database_success(form: OpenDatabase):
     form.password.text = "123"
     form.on_open_database()
+    wait_until(lambda: "main" in form.main_window.windows)
 
     assert not form.incorrect_password.mapped
     assert form.main_window.databases[2].password == "123"
@@ -69,6 +70,22 @@ def test_open_database_success(form: OpenDatabase):
     assert win.database == form.main_window.databases[2]
 
 
+def test_open_database_with_index(form: OpenDatabase):
+    db = form.database
+    db.open("123")
+    db.create()
+    db.close()
+
+    form.password.text = "123"
+    form.on_open_database()
+    wait_until(lambda: "main" in form.main_window.windows)
+
+    win = form.main_window.windows["main"]
+    assert items_names(win.accounts_list) == ["gmail", "mega"]
+    wait_until(lambda: not win.loading)
+    assert list(db.accounts) == ["gmail", "mega"]
+
+
 def test_open_database_incorrect_password(form):
     form.password.text = "pas"
     form.on_open_database()
@@ -87,6 +104,7 @@ def test_open_database_error(mock, dialog: "Mock[ErrorDialog]", form, faker):
     mock.side_effect = err
 
     form.on_open_database()
+    wait_until(lambda: dialog.called)
     dialog.assert_called_with(ERROR_DB_OPENING, err)
 
     # the open database form shouldn't be hidden
@@ -94,3 +112,29 @@ def test_open_database_error(mock, dialog: "Mock[ErrorDialog]", form, faker):
 
     # database password should be cleared
     assert form.main_window.databases[2].password is None
+
+
+def test_open_database_busy(form):
+    form.password.text = "123"
+    form.on_open_database()
+
+    # while the database is being opened, spinner is shown and the form is disabled
+    assert form.spinner.visible
+    assert form.cancel_button.visible
+    assert not form.open_button.sensitive
+
+    wait_until(lambda: "main" in form.main_window.windows)
+
+
+def test_cancel_open_database(form):
+    form.password.text = "123"
+    form.on_open_database()
+    form.on_cancel()
+
+    assert not form.spinner.visible
+    assert form.open_button.sensitive
+
+    # the database should be closed and its window shouldn't be shown
+    wait_until(lambda: not form.task.running)
+    wait_until(lambda: not form.main_window.databases[2].opened)
+    assert "main" not in form.main_window.windows
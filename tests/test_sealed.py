@@ -0,0 +1,47 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from core.sealed import OVERHEAD, SealedFile, seal, unseal
+
+
+def test_seal():
+    sealed = seal(b"secret")
+    assert b"secret" not in sealed
+    assert len(sealed) == len(b"secret") + OVERHEAD
+    assert unseal(sealed) == b"secret"
+    # every value gets its own nonce
+    assert seal(b"secret") != sealed
+
+
+def test_unseal_tampered():
+    sealed = bytearray(seal(b"secret"))
+    sealed[-1] ^= 1
+    with pytest.raises(InvalidTag):
+        unseal(bytes(sealed))
+
+
+def test_sealed_file():
+    file = SealedFile()
+    file.write(b"secret")
+    file.write(b"another secret")
+    assert file.size == len(b"secretanother secret")
+    assert list(file.read()) == [b"secret", b"another secret"]
+
+    file._file.seek(0)
+    assert b"secret" not in file._file.read()
+    file.close()
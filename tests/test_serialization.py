@@ -0,0 +1,65 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+from core.database_utils import Account, Database
+from core.serialization import CODECS, BinaryCodec, JsonCodec
+
+
+@pytest.fixture
+def unicode_account():
+    return Account(
+        accountname="пошта 📧",
+        username="Користувач",
+        email="",
+        password="pa$$\u0000word",
+        birthdate="01.01.2000",
+        notes="Line 1\nLine 2",
+        copy_email=True,
+    )
+
+
+@pytest.mark.parametrize("codec", CODECS.values(), ids=CODECS.keys())
+@pytest.mark.parametrize("_account", ("account", "unicode_account"))
+def test_codec_roundtrip(codec, _account, request):
+    account = request.getfixturevalue(_account)
+    streams = {file: stream for stream, file in enumerate(account.attached_files, 1)}
+
+    record = codec.encode(account, streams)
+    fields, attached_files = codec.decode(record)
+
+    assert Account(*fields, attached_files=account.attached_files) == account
+    assert attached_files == streams
+
+
+def test_binary_codec_is_smaller(account):
+    streams = {"file1": 1, "file2": 2}
+    binary = BinaryCodec().encode(account, streams)
+    json = JsonCodec().encode(account, streams)
+    assert len(binary) < len(json)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_open_database_with_codec(codec, monkeypatch, src_dir, account):
+    with monkeypatch.context() as m:
+        m.setattr("core.database_utils.DEFAULT_CODEC", codec)
+        Database("main", "123", {account.accountname: account}).create()
+
+    # the codec is recorded in the header, so the database can be opened
+    # no matter what the default codec is
+    db = Database("main")
+    db.open("123")
+    assert db.accounts == {account.accountname: account}
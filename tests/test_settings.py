@@ -17,6 +17,7 @@ import shutil
 
 import pytest
 
+from core.compression import Compression
 from core.settings import Config, SettingsDialog
 
 
@@ -32,6 +33,9 @@ def test_load_settings_empty_config(dialog):
     assert not config.main_db
     assert config.general_font == '30px "Ubuntu"'
     assert config.monospace_font == '35px "Ubuntu Mono"'
+    assert config.get_compression() == Compression()
+    assert config.backups == 0
+    assert config.engine == "container"
 
 
 def test_load_settings(dialog, src_dir):
@@ -64,19 +68,40 @@ def test_load_preferences(dialog, main_window):
     main_window.config.general_font = '32px "Arial"'
     main_window.config.monospace_font = '24px "Inconsolata Medium"'
     main_window.config.main_db = True
+    main_window.config.compression = "lzma"
+    main_window.config.compression_level = 9
+    main_window.config.backups = 2
+    main_window.config.engine = "sqlite"
 
     dialog.load_settings()
     assert dialog.general_font.font == "Arial 32"
     assert dialog.mono_font.font == "Inconsolata Medium 24"
     assert dialog.main_db.active
+    assert dialog.compression.active_id == "lzma"
+    assert dialog.compression_level.value == 9
+    assert dialog.backups.value == 2
+    assert dialog.engine.active_id == "sqlite"
 
 
 def test_save(dialog, main_window):
     dialog.general_font.font = "Arial 32"
     dialog.mono_font.font = "Inconsolata Medium 24"
     dialog.main_db.active = True
+    dialog.compression.active_id = "none"
+    dialog.compression_level.value = 3
+    dialog.backups.value = 1
+    dialog.engine.active_id = "sqlite"
     dialog.on_save()
 
     assert main_window.config.general_font == '32px "Arial"'
     assert main_window.config.monospace_font == '24px "Inconsolata Medium"'
     assert main_window.config.main_db
+    assert main_window.config.get_compression() == Compression("none", 3)
+    assert main_window.config.backups == 1
+    assert main_window.config.engine == "sqlite"
+
+
+def test_invalid_compression_settings(dialog):
+    config = Config()
+    config.compression = "bzip2"
+    assert config.get_compression() == Compression()
@@ -0,0 +1,104 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import os
+
+import pytest
+
+from core import sqlite_storage
+from core.container import CorruptedContainer, Header
+from core.kdf import KdfParams
+from core.sqlite_storage import SqliteStorage, is_sqlite
+
+KEY = bytes(range(32))
+
+
+@pytest.fixture
+def storage(tmp_path):
+    path = tmp_path / "main.dba"
+    storage = SqliteStorage.create(path, Header(KdfParams(os.urandom(16))), KEY)
+    with storage.transaction():
+        storage.upsert("gmail", "user@gmail.com", b"gmail record", [])
+        storage.upsert("mega", "user@gmail.com", b"mega record", [])
+        storage.upsert("github", "user@github.com", b"github record", [])
+    storage.commit()
+    return storage
+
+
+def test_create(storage, tmp_path):
+    assert os.listdir(tmp_path) == ["main.dba"]
+    with open(tmp_path / "main.dba", "rb") as file:
+        assert is_sqlite(file)
+    assert storage.is_file(tmp_path / "main.dba")
+
+    new_storage = SqliteStorage(tmp_path / "main.dba", KEY)
+    assert sorted(new_storage.records()) == [b"github record", b"gmail record", b"mega record"]
+
+
+def test_upsert_and_delete(storage):
+    with storage.transaction():
+        storage.upsert("gmail", "user@github.com", b"new gmail record", [])
+        storage.delete("mega")
+    assert sorted(storage.records()) == [b"github record", b"new gmail record"]
+
+
+def test_names_are_not_stored(storage):
+    content = storage.path.read_bytes()
+    for value in (b"gmail", b"user@gmail.com", b"mega record"):
+        assert value not in content
+
+
+def test_swapped_records(storage):
+    """
+    A record moved to the row of another account is detected.
+    """
+
+    gmail, github = storage.blind_index("gmail"), storage.blind_index("github")
+    with storage.transaction():
+        storage.connection.execute(
+            "UPDATE accounts SET record = (SELECT record FROM accounts WHERE name = ?) "
+            "WHERE name = ?",
+            (github, gmail),
+        )
+    with pytest.raises(CorruptedContainer):
+        list(storage.records())
+
+
+def test_wrong_key(storage):
+    other = SqliteStorage(storage.path, os.urandom(32))
+    with pytest.raises(CorruptedContainer):
+        list(other.records())
+
+
+def test_attachments(storage, monkeypatch):
+    monkeypatch.setattr(sqlite_storage, "CHUNK_SIZE", 10)
+    content = os.urandom(95)
+    with storage.transaction():
+        stream = storage.next_attachment()
+        storage.add_attachment(stream, "gmail", [content[:50], content[50:]], b"1")
+        storage.add_attachment(stream + 1, "mega", [b""], b"2")
+
+    assert b"".join(storage.read_stream(stream)) == content
+    assert b"".join(storage.read_stream(stream + 1)) == b""
+    assert storage.digests() == {stream: b"1", stream + 1: b"2"}
+
+    # the last chunk is missing
+    with storage.transaction():
+        storage.connection.execute("DELETE FROM attachments WHERE final")
+    with pytest.raises(CorruptedContainer):
+        list(storage.read_stream(stream))
+
+    storage.delete_attachments([stream])
+    assert storage.digests() == {}
@@ -0,0 +1,216 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import base64
+import json
+import os
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import core
+from core.database_utils import Account, Database
+from core.sync import (
+    MAX_CHUNK_SIZE,
+    MIN_CHUNK_SIZE,
+    DirectoryTarget,
+    HttpTarget,
+    SyncError,
+    chunk_name,
+    pull,
+    push,
+    split,
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Stand-in sync server keeping objects in memory.
+    """
+
+    objects: dict[str, bytes]
+
+    def do_GET(self, body=True):
+        data = self.objects.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_PUT(self):
+        self.objects[self.path] = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_target():
+    handler = type("Handler", (Handler,), {"objects": {}})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield HttpTarget(f"http://127.0.0.1:{server.server_port}/sync/")
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def dir_target(tmp_path):
+    return DirectoryTarget(tmp_path / "target")
+
+
+@pytest.fixture(params=["dir_target", "http_target"])
+def target(request):
+    return request.getfixturevalue(request.param)
+
+
+@pytest.fixture
+def db(src_dir) -> Database:
+    accounts = {
+        f"account{i}": Account(
+            f"account{i}", "user", "user@example.com", os.urandom(8).hex(), "01.01.2000",
+            os.urandom(100).hex(), False, {},
+        )
+        for i in range(10_000)
+    }
+    db = Database("main", "123", accounts)
+    db.create()
+    return db
+
+
+@pytest.fixture
+def other_dir(monkeypatch, tmp_path):
+    """
+    SRC_DIR of another machine.
+    """
+
+    def switch():
+        path = tmp_path / "other"
+        path.mkdir()
+        monkeypatch.setattr(core, "SRC_DIR", path)
+        return path
+
+    return switch
+
+
+def changed_chunks(content: bytes, changed: bytes) -> int:
+    """
+    :return: total size of the chunks of `changed` that `content` doesn't have.
+    """
+
+    old = {content[start:start + size] for start, size in split(content)}
+    new = [changed[start:start + size] for start, size in split(changed)]
+    return sum(len(chunk) for chunk in new if chunk not in old)
+
+
+def test_split():
+    content = os.urandom(1024 * 1024)
+    chunks = list(split(content))
+    assert sum(size for _, size in chunks) == len(content)
+    assert all(MIN_CHUNK_SIZE <= size <= MAX_CHUNK_SIZE for _, size in chunks[:-1])
+
+    # inserting data changes only the chunks around it
+    changed = content[:100_000] + b"inserted" + content[100_000:]
+    assert changed_chunks(content, changed) <= 2 * MAX_CHUNK_SIZE
+
+
+# seeded, so that the chunks are the same on every run
+RANDOM = random.Random(0)
+
+
+@pytest.mark.parametrize("content", [
+    # e.g. legacy .dba files
+    base64.urlsafe_b64encode(RANDOM.randbytes(3 * 1024 * 1024)),
+    # json with a lot of repeated text
+    json.dumps([
+        {"username": "user", "email": f"user{i}@example.com", "notes": RANDOM.randbytes(8).hex()}
+        for i in range(30_000)
+    ]).encode(),
+], ids=["base64", "json"])
+def test_split_text(content):
+    # not just cut every MAX_CHUNK_SIZE bytes
+    assert sum(size < MAX_CHUNK_SIZE for _, size in split(content)) > 1
+
+    changed = content[:1_000_000] + b"x" + content[1_000_000:]
+    assert changed_chunks(content, changed) <= 2 * MAX_CHUNK_SIZE
+
+
+def test_push_pull(db, target, other_dir):
+    result = push("main", target)
+    assert result.transferred == result.size == db.dba_file.stat().st_size
+    # nothing changed
+    assert push("main", target).transferred == 0
+
+    path = other_dir()
+    result = pull("main", target)
+    assert result.transferred == result.size
+    assert (path / "main.dba").read_bytes() == db.dba_file.read_bytes()
+
+    other_db = Database("main")
+    other_db.open("123")
+    assert other_db.accounts == db.accounts
+
+
+def test_small_edit(db, target, other_dir):
+    push("main", target)
+    other_dir()
+    pull("main", target)
+
+    other_db = Database("main")
+    other_db.open("123")
+    other_db.accounts["account1"] = Account("account1", "changed", "", "", "", "", False, {})
+    other_db.save_changes()
+    result = push("main", target)
+    # the chunk at the end of the file, cut there rather than at a boundary, is sent again
+    assert 0 < result.transferred < result.size / 4
+
+
+def test_pull_damaged(db, target, other_dir, dir_target):
+    push("main", dir_target)
+    manifest = dir_target.get("main.manifest")
+    chunk = next(iter(dir_target.path.glob("chunks/*")))
+    chunk.write_bytes(b"damaged")
+
+    path = other_dir()
+    (path / "main.dba").write_bytes(b"old")
+    with pytest.raises(SyncError):
+        pull("main", dir_target)
+    # the local file isn't touched
+    assert (path / "main.dba").read_bytes() == b"old"
+    assert dir_target.get("main.manifest") == manifest
+
+    with pytest.raises(SyncError):
+        pull("missing", dir_target)
+
+
+def test_push_skips_stored_chunks(db, dir_target):
+    push("main", dir_target)
+    (dir_target.path / "main.manifest").unlink()
+    # the chunks are still there, only the manifest is sent
+    assert push("main", dir_target).transferred == 0
+    assert dir_target.exists(chunk_name(next(iter(dir_target.path.glob("chunks/*"))).name))
@@ -0,0 +1,110 @@
+#  Copyright (c) 2021-2023. Bohdan Kolvakh
+#  This file is part of PyAccounts.
+#
+#  PyAccounts is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  PyAccounts is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with PyAccounts.  If not, see <https://www.gnu.org/licenses/>.
+import shutil
+from unittest.mock import patch
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+from core.database_utils import (
+    CONTAINER_FORMAT,
+    LEGACY_FORMAT,
+    Attachment,
+    Database,
+    detect_format,
+)
+from core.upgrade import (
+    UpgradeError,
+    legacy_databases,
+    main,
+    upgrade_database,
+    upgrade_databases,
+)
+
+
+@pytest.fixture
+def legacy_dbs(src_dir):
+    for name in ("main", "other"):
+        shutil.copy("tests/data/main.dba", src_dir / f"{name}.dba")
+    # already upgraded
+    Database("new", "123", {}).create()
+    return src_dir
+
+
+def file_format(path) -> str:
+    with open(path, "rb") as file:
+        return detect_format(file)
+
+
+def test_legacy_databases(legacy_dbs):
+    assert legacy_databases(legacy_dbs) == ["main", "other"]
+
+
+def test_upgrade_database(legacy_dbs):
+    legacy = Database("main")
+    legacy.open("123")
+
+    upgrade_database("main", "123")
+    assert file_format(legacy_dbs / "main.dba") == CONTAINER_FORMAT
+    assert (legacy_dbs / "main.dba.1").read_bytes() == open("tests/data/main.dba", "rb").read()
+
+    db = Database("main")
+    db.open("123")
+    assert db.accounts == legacy.accounts
+
+
+def test_upgrade_database_mismatch(legacy_dbs):
+    content = (legacy_dbs / "main.dba").read_bytes()
+    with patch("core.database_utils.Account.__eq__", return_value=False):
+        with pytest.raises(UpgradeError):
+            upgrade_database("main", "123")
+    # the legacy file is restored
+    assert (legacy_dbs / "main.dba").read_bytes() == content
+
+
+def test_upgrade_database_attachments_mismatch(legacy_dbs):
+    content = (legacy_dbs / "main.dba").read_bytes()
+    create = Database.create
+
+    def damage_attachments(db, *args, **kwargs):
+        for account in db.accounts.values():
+            account.attached_files = {
+                file: Attachment(b"damaged") for file in account.attached_files
+            }
+        create(db, *args, **kwargs)
+
+    with patch.object(Database, "create", damage_attachments), pytest.raises(UpgradeError):
+        upgrade_database("main", "123")
+    assert (legacy_dbs / "main.dba").read_bytes() == content
+
+
+def test_upgrade_databases(legacy_dbs):
+    results = upgrade_databases(legacy_dbs, {"main": "123", "other": "wrong"}, workers=2)
+    assert results["main"] is None
+    assert isinstance(results["other"], InvalidToken)
+
+    assert file_format(legacy_dbs / "main.dba") == CONTAINER_FORMAT
+    assert file_format(legacy_dbs / "other.dba") == LEGACY_FORMAT
+    assert not (legacy_dbs / "other.dba.1").exists()
+
+
+def test_main(legacy_dbs, capsys):
+    passwords = iter(["123", ""])
+    with patch("getpass.getpass", lambda _: next(passwords)):
+        assert main(["upgrade", str(legacy_dbs)]) == 0
+    assert "main: upgraded" in capsys.readouterr().out
+    assert legacy_databases(legacy_dbs) == ["other"]
+    assert main(["upgrade", str(legacy_dbs / "missing")]) == 0